@@ -4,7 +4,7 @@ import sys
 import click
 
 from .. import settings
-from . import add, agent, get, init, modify, remove, reset, server, set, webui
+from . import add, agent, flush, get, init, modify, remove, reset, server, set, webui
 
 # コマンドマッピング
 COMMANDS = {
@@ -17,6 +17,7 @@ COMMANDS = {
     "up": webui.main,
     "down": webui.main,
     "reset": reset.main,
+    "flush": flush.main,
 }
 logger = logging.getLogger(__name__)
 
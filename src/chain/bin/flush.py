@@ -0,0 +1,80 @@
+import logging
+import sys
+from pathlib import Path
+
+import click
+import requests
+
+from .. import settings
+from ..core import chaser
+from ..core.spool import SPOOL_DIR, ChaserSpool, list_spools
+
+logger = logging.getLogger(__name__)
+
+ACK_TIMEOUT = 120.0  # 秒
+
+
+def run_path(spool: ChaserSpool) -> str:
+    return f"{settings.prj_id}/{spool.path.parent.name}/{spool.path.stem}"
+
+
+def flush_spools(spools: list[ChaserSpool]) -> int:
+    """全スプールを1本のストリームでまとめて再送し、ACK されたものを削除する"""
+    sender = chaser.get_sender()
+    stream = sender.stream
+    last_seqs = {}
+    for spool in spools:
+        # 登録前に落ちた run もあるので登録し直す（サーバ側は冪等）
+        if (meta := spool.read_meta()) is not None:
+            sender.post(f"/start_run/{run_path(spool)}", meta)
+        seq = 0
+        for _, batch in spool.read():
+            if not stream.writable(timeout=ACK_TIMEOUT):
+                raise TimeoutError(f"Timed out waiting for acks while flushing spool: {spool.path}")
+            seq = stream.send(batch)
+        last_seqs[spool.path] = seq
+
+    flushed = 0
+    for spool in spools:
+        if not stream.wait(last_seqs[spool.path], timeout=ACK_TIMEOUT):
+            msg = f"Timed out flushing spool: {spool.path}"
+            logger.warning(msg)
+            click.secho(msg, fg="yellow", err=True)
+            continue
+        spool.clear()
+        sender.post(f"/end_run/{run_path(spool)}")
+        flushed += 1
+    return flushed
+
+
+def main(cmd: str, target: str, env: str, opt: list[str]) -> None:
+    if target != "chaser":
+        msg = f"Unsupported target: {target}"
+        logger.error(msg)
+        click.secho(msg, fg="red", err=True)
+        sys.exit(1)
+
+    spool_dir = Path(opt[0]) if opt else Path(settings.chaser_options.get("spool_dir", SPOOL_DIR))
+    # 実行中の run が書いているスプールは触らない
+    spools = [spool for spool in list_spools(spool_dir) if not spool.owner_alive()]
+    if not spools:
+        msg = f"No spools to flush in {spool_dir}"
+        logger.info(msg)
+        click.secho(msg, fg="green")
+        return
+
+    try:
+        flushed = flush_spools(spools)
+    except (requests.RequestException, OSError) as e:
+        msg = f"Failed to flush spools: {e}"
+        logger.error(msg)
+        click.secho(msg, fg="red", err=True)
+        sys.exit(1)
+
+    msg = f"Flushed {flushed}/{len(spools)} spools successfully."
+    logger.info(msg)
+    click.secho(msg, fg="green")
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,148 @@
+import importlib.util
+import zlib
+from fnmatch import fnmatchcase
+from typing import Any, NamedTuple
+
+import numpy as np
+
+from . import metric_pb2
+
+# MetricBatch の values・steps・timestamps の符号化（key ごとにクライアントで選ぶ）
+#   dtype: float32 のまま / float16 / bfloat16 に丸めて送る。float16 はファイルにも float16 で書く
+#          （bfloat16 は NumPy に型がないので float32 に戻して書く）
+#   delta: 各列を1つ前の行とのビット列の差（整数の引き算）にする。値の近い列は上位ビットが 0 になり、圧縮が効く
+#   codec: zlib / zstd（zstandard が必要）で圧縮する
+DTYPES = {"float32": "", "float16": "f2", "bfloat16": "bf16"}
+CODECS = ("", "zlib", "zstd")
+WIRE_TYPES = {"": np.float32, "f2": np.float16, "bf16": np.uint16}
+STORAGE_DTYPES = {"": "<f4", "f2": "<f2", "bf16": "<f4"}
+
+
+class Encoding(NamedTuple):
+    dtype: str = "float32"
+    delta: bool = False
+    codec: str = ""
+
+    @classmethod
+    def parse(cls, spec: dict[str, Any]) -> "Encoding":
+        """{"dtype": "float16", "delta": true, "codec": "zstd"} 形式の指定を検証して読む"""
+        try:
+            encoding = cls(**spec)
+        except TypeError as e:
+            raise ValueError(f"Invalid encoding {spec}: {e}") from None
+        if encoding.dtype not in DTYPES:
+            raise ValueError(f"Unknown dtype {encoding.dtype!r} (choose from {', '.join(DTYPES)})")
+        if encoding.codec not in CODECS:
+            raise ValueError(f"Unknown codec {encoding.codec!r} (choose from {', '.join(c for c in CODECS if c)})")
+        if encoding.codec == "zstd" and importlib.util.find_spec("zstandard") is None:
+            raise ValueError("zstd codec needs zstandard")
+        return encoding
+
+
+def resolve_encodings(specs: dict[str, dict[str, Any]]) -> dict[str, Encoding]:
+    """chaser_options の {key のパターン: 指定} を読む"""
+    return {pattern: Encoding.parse(spec) for pattern, spec in specs.items()}
+
+
+def match_encoding(encodings: dict[str, Encoding], key: str) -> Encoding | None:
+    """key に最初に一致したパターンの符号化（なければ None = float32 のまま）"""
+    return next((encoding for pattern, encoding in encodings.items() if fnmatchcase(key, pattern)), None)
+
+
+def storage_dtype(batch: metric_pb2.MetricBatch) -> str:
+    """新しく作るファイルの値の型"""
+    return STORAGE_DTYPES.get(batch.encoding, "<f4")
+
+
+def to_bfloat16(values: np.ndarray) -> np.ndarray:
+    """float32 を bfloat16 のビット列 (uint16) に丸める（最近接偶数丸め。NaN は NaN のまま）"""
+    bits = values.astype(np.float32).view(np.uint32)
+    rounded = (bits + 0x7FFF + ((bits >> 16) & 1)) >> 16
+    return np.where(np.isnan(values), 0x7FC0, rounded).astype(np.uint16)
+
+
+def from_bfloat16(bits: np.ndarray) -> np.ndarray:
+    return (bits.astype(np.uint32) << 16).view(np.float32)
+
+
+def delta_encode(column: np.ndarray, count: int) -> np.ndarray:
+    """(count, 列) のビット列を行方向の差にする（符号なし整数の引き算なので桁あふれしても戻せる）"""
+    bits = column.view(f"<u{column.dtype.itemsize}").reshape((count, -1))
+    out = bits.copy()
+    out[1:] -= bits[:-1]
+    return out
+
+
+def delta_decode(data: bytes, itemsize: int, count: int) -> bytes:
+    bits = np.frombuffer(data, dtype=f"<u{itemsize}").reshape((count, -1))
+    return np.cumsum(bits, axis=0, dtype=bits.dtype).tobytes()
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == "zlib":
+        return zlib.compress(data, 1)
+    if codec == "zstd":
+        import zstandard
+
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return data
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "zstd":
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def encode_batch(batch: metric_pb2.MetricBatch, encoding: Encoding) -> metric_pb2.MetricBatch:
+    """float32 の values と steps・timestamps を encoding で符号化する（batch を書き換えて返す）"""
+    values = np.frombuffer(batch.values, dtype=np.float32)
+    if encoding.dtype == "float16":
+        values = values.astype(np.float16)
+    elif encoding.dtype == "bfloat16":
+        values = to_bfloat16(values)
+    columns: list[np.ndarray] = [
+        values,
+        np.frombuffer(batch.steps, np.int64),
+        np.frombuffer(batch.timestamps, np.float64),
+    ]
+    if encoding.delta:
+        columns = [delta_encode(column, batch.count) if column.size else column for column in columns]
+    batch.values, batch.steps, batch.timestamps = (compress(column.tobytes(), encoding.codec) for column in columns)
+    batch.encoding, batch.delta, batch.codec = DTYPES[encoding.dtype], encoding.delta, encoding.codec
+    return batch
+
+
+def decode_batch(batch: metric_pb2.MetricBatch) -> metric_pb2.MetricBatch:
+    """符号化されたバッチを float32 の values に戻す（encoding はファイルの型を決めるので残す）
+
+    不正なバッチは ValueError（zlib / zstd の展開エラーも含む）。
+    """
+    if batch.encoding not in WIRE_TYPES or batch.codec not in CODECS:
+        raise ValueError(f"Unknown encoding {batch.encoding!r} / codec {batch.codec!r}")
+    if not (batch.delta or batch.codec or batch.encoding):
+        return batch
+    try:
+        columns = [decompress(data, batch.codec) for data in (batch.values, batch.steps, batch.timestamps)]
+    except Exception as e:
+        raise ValueError(f"Failed to decompress batch: {e}") from e
+    wire_type = np.dtype(WIRE_TYPES[batch.encoding])
+    if batch.delta:
+        itemsizes = (wire_type.itemsize, 8, 8)
+        columns = [
+            delta_decode(data, size, batch.count) if data else data
+            for data, size in zip(columns, itemsizes, strict=True)
+        ]
+    values = np.frombuffer(columns[0], dtype=wire_type)
+    values = from_bfloat16(values) if batch.encoding == "bf16" else values.astype(np.float32)
+    batch.values, batch.steps, batch.timestamps = values.tobytes(), columns[1], columns[2]
+    batch.delta, batch.codec = False, ""
+    return batch
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,104 @@
+import logging
+from pathlib import Path
+
+import numpy as np
+
+from .metric_file import MetricFile, MetricWriter, row_dtype
+
+logger = logging.getLogger(__name__)
+
+# 詳細度 (LOD) ピラミッド
+# level k の1行は生データ LOD_FACTOR**k 行ぶんの (最初の step, 最後の時刻, min[dim], max[dim], mean[dim])。
+# {key}.lod{k} に生データと同じチャンク形式（dim = 3 * dim）で保存する。
+LOD_FACTOR = 8
+LOD_LEVELS = 6
+
+
+def lod_path(path: Path, level: int) -> Path:
+    return path.with_suffix(f".lod{level}")
+
+
+def expand(rows: np.ndarray, dim: int) -> np.ndarray:
+    """生データの行を LOD の行 (min = max = mean = 値) にする"""
+    out = np.empty(len(rows), dtype=row_dtype("<f4", 3 * dim))
+    out["step"], out["time"] = rows["step"], rows["time"]
+    out["value"] = np.tile(rows["value"], 3)
+    return out
+
+
+def summarize(rows: np.ndarray, dim: int) -> np.ndarray:
+    """LOD_FACTOR 行ずつまとめて1つ上の level の行にする（len(rows) は LOD_FACTOR の倍数）"""
+    groups = rows.reshape((-1, LOD_FACTOR))
+    values = groups["value"].reshape((len(groups), LOD_FACTOR, 3, dim))
+    out = np.empty(len(groups), dtype=rows.dtype)
+    out["step"], out["time"] = groups["step"][:, 0], groups["time"][:, -1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.nansum(values[:, :, 2], axis=1) / np.sum(~np.isnan(values[:, :, 2]), axis=1)
+    stats = [np.fmin.reduce(values[:, :, 0], axis=1), np.fmax.reduce(values[:, :, 1], axis=1), mean]
+    out["value"] = np.concatenate(stats, axis=1)
+    return out
+
+
+class LodPyramid:
+    """生データへの追記に合わせて LOD ピラミッドを更新する
+
+    各 level は下の level の行が LOD_FACTOR 行そろうごとに1行追記する。端数は pending に持ち、
+    開き直したときは下の level のファイル末尾から復元する。
+    """
+
+    def __init__(self, file: MetricWriter):
+        self.path = file.path
+        self.dim = file.dim
+        self.writers: dict[int, MetricWriter] = {}
+        self.pending: dict[int, np.ndarray] = {}
+        lower_rows = file.header.n_rows
+        for level in range(1, LOD_LEVELS + 1):
+            path = lod_path(self.path, level)
+            n_rows = MetricFile(path).n_rows if path.exists() else 0
+            start = n_rows * LOD_FACTOR
+            if start > lower_rows:
+                logger.warning(f"LOD level {level} is ahead of its source, rebuilding: {path}")
+                path.unlink()
+                n_rows, start = 0, 0
+            tail = self.read(level - 1, start) if start < lower_rows else self.empty()
+            self.pending[level] = tail
+            complete = len(tail) - len(tail) % LOD_FACTOR
+            if complete:
+                # 前回書けなかった分を埋める
+                self.writer(level).append(summarize(tail[:complete], self.dim))
+                self.pending[level] = tail[complete:]
+            lower_rows = n_rows + complete // LOD_FACTOR
+
+    def empty(self) -> np.ndarray:
+        return np.empty(0, dtype=row_dtype("<f4", 3 * self.dim))
+
+    def read(self, level: int, start: int) -> np.ndarray:
+        if level == 0:
+            return expand(np.asarray(MetricFile(self.path).rows(start)), self.dim)
+        return np.array(MetricFile(lod_path(self.path, level)).rows(start))
+
+    def writer(self, level: int) -> MetricWriter:
+        if level not in self.writers:
+            self.writers[level] = MetricWriter(lod_path(self.path, level), 3 * self.dim)
+        return self.writers[level]
+
+    def append(self, rows: np.ndarray) -> None:
+        """生データに追記した rows を上の level へ順に反映する"""
+        rows = expand(rows, self.dim)
+        for level in range(1, LOD_LEVELS + 1):
+            rows = np.concatenate([self.pending[level], rows])
+            complete = len(rows) - len(rows) % LOD_FACTOR
+            self.pending[level] = rows[complete:]
+            if not complete:
+                break
+            rows = summarize(rows[:complete], self.dim)
+            self.writer(level).append(rows)
+
+    def close(self) -> None:
+        for writer in self.writers.values():
+            writer.close()
+        self.writers.clear()
+
+
+if __name__ == "__main__":
+    pass
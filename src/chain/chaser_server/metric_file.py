@@ -0,0 +1,268 @@
+import logging
+import os
+import struct
+import zlib
+from functools import cached_property
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# {key}.chm のレイアウト
+#   header (64 bytes) | rows (step int64, time float64, value dtype[dim]) ... | footer
+# 行は固定長で、chunk_rows 行ごとを1チャンクとして footer にチャンクの索引を持つ。
+# footer は close 時に書き、追記を再開するときに切り落とす（書き込み中のファイルには footer がない）。
+SUFFIX = ".chm"
+MAGIC = b"CHM1"
+FOOTER_MAGIC = b"CHMI"
+VERSION = 1
+HEADER = struct.Struct("<4sHH8sIIQQ")  # magic, version, flags, dtype, dim, chunk_rows, n_rows, footer_offset
+HEADER_SIZE = 64
+FOOTER = struct.Struct("<4sQ")  # magic, チャンク数
+CHUNK = struct.Struct("<QIqqddI")  # first_row, n_rows, step_min, step_max, min, max, crc32
+CHUNK_BYTES = 1 << 20  # 1チャンクのおおよそのサイズ
+MIN_CHUNK_ROWS = 256
+FLAG_UNSORTED = 1  # step 順に届いていない行がある
+
+
+def row_dtype(dtype: str, dim: int) -> np.dtype:
+    return np.dtype([("step", "<i8"), ("time", "<f8"), ("value", dtype, (dim,))])
+
+
+class Header(NamedTuple):
+    dtype: str
+    dim: int
+    chunk_rows: int
+    n_rows: int = 0
+    footer_offset: int = 0
+    flags: int = 0
+
+    @classmethod
+    def create(cls, dim: int, dtype: str = "<f4", chunk_bytes: int = CHUNK_BYTES) -> "Header":
+        dtype = np.dtype(dtype).str
+        return cls(dtype, dim, max(MIN_CHUNK_ROWS, chunk_bytes // row_dtype(dtype, dim).itemsize))
+
+    @classmethod
+    def unpack(cls, data: bytes) -> "Header":
+        if len(data) < HEADER.size:
+            raise ValueError("Truncated metric file header")
+        magic, version, flags, dtype, dim, chunk_rows, n_rows, footer_offset = HEADER.unpack_from(data)
+        if magic != MAGIC or version > VERSION:
+            raise ValueError(f"Not a metric file (magic={magic!r}, version={version})")
+        return cls(dtype.rstrip(b"\0").decode(), dim, chunk_rows, n_rows, footer_offset, flags)
+
+    def pack(self) -> bytes:
+        data = HEADER.pack(
+            MAGIC,
+            VERSION,
+            self.flags,
+            self.dtype.encode(),
+            self.dim,
+            self.chunk_rows,
+            self.n_rows,
+            self.footer_offset,
+        )
+        return data.ljust(HEADER_SIZE, b"\0")
+
+    @property
+    def row_dtype(self) -> np.dtype:
+        return row_dtype(self.dtype, self.dim)
+
+    @property
+    def unsorted(self) -> bool:
+        return bool(self.flags & FLAG_UNSORTED)
+
+    def row_offset(self, row: int) -> int:
+        return HEADER_SIZE + row * self.row_dtype.itemsize
+
+
+class Chunk(NamedTuple):
+    """チャンクの索引: 行範囲、step 範囲、値の最小/最大（NaN は除く）、CRC32"""
+
+    first_row: int
+    n_rows: int = 0
+    step_min: int = np.iinfo(np.int64).max
+    step_max: int = np.iinfo(np.int64).min
+    min: float = np.nan
+    max: float = np.nan
+    crc: int = 0
+
+    def extend(self, rows: np.ndarray) -> "Chunk":
+        """rows を末尾に足したときの索引"""
+        if len(rows) == 0:
+            return self
+        values = rows["value"]
+        return Chunk(
+            self.first_row,
+            self.n_rows + len(rows),
+            min(self.step_min, int(rows["step"].min())),
+            max(self.step_max, int(rows["step"].max())),
+            float(np.fmin(self.min, np.fmin.reduce(values, axis=None))),
+            float(np.fmax(self.max, np.fmax.reduce(values, axis=None))),
+            zlib.crc32(rows.tobytes(), self.crc),
+        )
+
+
+def build_chunks(rows: np.ndarray, chunk_rows: int, first_row: int = 0) -> list[Chunk]:
+    """rows（first_row 行目から）の索引を作る。first_row はチャンク境界であること"""
+    return [
+        Chunk(first_row + start).extend(rows[start : start + chunk_rows]) for start in range(0, len(rows), chunk_rows)
+    ]
+
+
+def pack_footer(chunks: list[Chunk]) -> bytes:
+    return FOOTER.pack(FOOTER_MAGIC, len(chunks)) + b"".join(CHUNK.pack(*chunk) for chunk in chunks)
+
+
+def unpack_footer(data: bytes) -> list[Chunk]:
+    magic, n_chunks = FOOTER.unpack_from(data)
+    if magic != FOOTER_MAGIC or len(data) < FOOTER.size + n_chunks * CHUNK.size:
+        raise ValueError("Broken metric file footer")
+    return [Chunk(*CHUNK.unpack_from(data, FOOTER.size + i * CHUNK.size)) for i in range(n_chunks)]
+
+
+def committed_rows(header: Header, size: int) -> int:
+    """ファイルサイズから実際に読める行数（途中で切れた書き込みは数えない）"""
+    end = header.footer_offset or size
+    return max(0, min(header.n_rows, (min(end, size) - HEADER_SIZE) // header.row_dtype.itemsize))
+
+
+class MetricFile:
+    """チャンク形式メトリクスファイルの読み出し"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self.header = Header.unpack(f.read(HEADER_SIZE))
+            self.size = os.fstat(f.fileno()).st_size
+            self.footer = None
+            if self.header.footer_offset:
+                f.seek(self.header.footer_offset)
+                try:
+                    self.footer = unpack_footer(f.read())
+                except (ValueError, struct.error):
+                    logger.warning(f"Ignoring broken footer: {self.path}")
+        self.n_rows = committed_rows(self.header, self.size)
+        self.torn = self.n_rows < self.header.n_rows
+        if self.torn:
+            logger.warning(f"Metric file is truncated: {self.path} ({self.n_rows}/{self.header.n_rows} rows)")
+
+    @property
+    def dim(self) -> int:
+        return self.header.dim
+
+    @property
+    def unsorted(self) -> bool:
+        return self.header.unsorted
+
+    @cached_property
+    def data(self) -> np.ndarray:
+        """全行の memmap（読んだページだけ載る。同じ MetricFile を使う限りページを共有する）"""
+        if self.n_rows == 0:
+            return np.empty(0, dtype=self.header.row_dtype)
+        return np.memmap(self.path, dtype=self.header.row_dtype, mode="r", offset=HEADER_SIZE, shape=(self.n_rows,))
+
+    def rows(self, start: int = 0, stop: int | None = None) -> np.ndarray:
+        """[start, stop) 行の構造化配列"""
+        return self.data[start:stop]
+
+    @cached_property
+    def index(self) -> list[Chunk] | None:
+        """footer のチャンク索引（行数と合わないときは None）"""
+        if self.footer is not None and sum(c.n_rows for c in self.footer) == self.n_rows:
+            return self.footer
+        return None
+
+    @property
+    def chunks(self) -> list[Chunk]:
+        """チャンク索引。footer がない（書き込み中・異常終了した）ファイルは読み直して作る"""
+        if self.index is not None:
+            return self.index
+        return build_chunks(self.rows(), self.header.chunk_rows)
+
+    def verify(self) -> list[int]:
+        """CRC が合わないチャンクの番号を返す"""
+        chunk_rows = self.header.chunk_rows
+        return [
+            i
+            for i, chunk in enumerate(self.chunks)
+            if zlib.crc32(self.rows(i * chunk_rows, i * chunk_rows + chunk.n_rows).tobytes()) != chunk.crc
+        ]
+
+
+class MetricWriter:
+    """チャンク形式メトリクスファイルへの追記
+
+    行を書いてから header の行数を更新するので、途中で落ちても header の行数までは読める。
+    """
+
+    def __init__(self, path: Path, dim: int, dtype: str = "<f4", chunk_bytes: int = CHUNK_BYTES):
+        self.path = Path(path)
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = os.fstat(self.fd).st_size
+        if size == 0:
+            self.header = Header.create(dim, dtype, chunk_bytes)
+            self.chunks: list[Chunk] = []
+        else:
+            self.header, self.chunks = self.recover(size)
+        self.last_step = max((c.step_max for c in self.chunks), default=-1)
+        os.pwrite(self.fd, self.header.pack(), 0)
+
+    def recover(self, size: int) -> tuple[Header, list[Chunk]]:
+        """既存ファイルを開き直す: footer を読んで切り落とし、書きかけの行を捨てる"""
+        header = Header.unpack(os.pread(self.fd, HEADER_SIZE, 0))
+        n_rows = committed_rows(header, size)
+        chunks = None
+        if 0 < header.footer_offset < size:
+            try:
+                chunks = unpack_footer(os.pread(self.fd, size - header.footer_offset, header.footer_offset))
+            except (ValueError, struct.error):
+                chunks = None
+        if chunks is None or sum(c.n_rows for c in chunks) != n_rows:
+            file = MetricFile(self.path)
+            chunks = build_chunks(np.asarray(file.rows()), header.chunk_rows)
+        os.ftruncate(self.fd, header.row_offset(n_rows))
+        return header._replace(n_rows=n_rows, footer_offset=0), chunks
+
+    @property
+    def dim(self) -> int:
+        return self.header.dim
+
+    def append(self, rows: np.ndarray, unsorted: bool = False) -> None:
+        """行をまとめて1回で書き込み、索引と header を更新する"""
+        if len(rows) == 0:
+            return
+        rows = np.ascontiguousarray(rows, dtype=self.header.row_dtype)
+        data = memoryview(rows.tobytes())
+        offset = self.header.row_offset(self.header.n_rows)
+        while data:
+            written = os.pwrite(self.fd, data, offset)
+            data, offset = data[written:], offset + written
+
+        chunk_rows = self.header.chunk_rows
+        row, pos = self.header.n_rows, 0
+        while pos < len(rows):
+            index, take = row // chunk_rows, min(len(rows) - pos, chunk_rows - row % chunk_rows)
+            if index == len(self.chunks):
+                self.chunks.append(Chunk(row))
+            self.chunks[index] = self.chunks[index].extend(rows[pos : pos + take])
+            row, pos = row + take, pos + take
+        self.last_step = max(self.last_step, int(rows["step"].max()))
+
+        flags = self.header.flags | (FLAG_UNSORTED if unsorted else 0)
+        self.header = self.header._replace(n_rows=row, flags=flags)
+        os.pwrite(self.fd, self.header.pack(), 0)
+
+    def close(self) -> None:
+        """footer を書いて閉じる"""
+        footer_offset = self.header.row_offset(self.header.n_rows)
+        os.pwrite(self.fd, pack_footer(self.chunks), footer_offset)
+        self.header = self.header._replace(footer_offset=footer_offset)
+        os.pwrite(self.fd, self.header.pack(), 0)
+        os.close(self.fd)
+
+
+if __name__ == "__main__":
+    pass
@@ -17,7 +17,7 @@ _sym_db = _symbol_database.Default()
 
 
 DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(
-    b'\n\x0cmetric.proto\x12\x06metric"q\n\rMetricRequest\x12\x0e\n\x06prj_id\x18\x01 \x01(\t\x12\x15\n\rexperiment_id\x18\x02 \x01(\t\x12\x10\n\x08run_uuid\x18\x03 \x01(\t\x12\x0b\n\x03key\x18\x04 \x01(\t\x12\x0b\n\x03\x64im\x18\x05 \x01(\x05\x12\r\n\x05value\x18\x06 \x01(\x0c" \n\x0eMetricResponse\x12\x0e\n\x06status\x18\x01 \x01(\t2\x8c\x01\n\rMetricService\x12;\n\nSendMetric\x12\x15.metric.MetricRequest\x1a\x16.metric.MetricResponse\x12>\n\x0bSendMetrics\x12\x15.metric.MetricRequest\x1a\x16.metric.MetricResponse(\x01\x62\x06proto3'
+    b'\n\x0cmetric.proto\x12\x06metric"q\n\rMetricRequest\x12\x0e\n\x06prj_id\x18\x01 \x01(\t\x12\x15\n\rexperiment_id\x18\x02 \x01(\t\x12\x10\n\x08run_uuid\x18\x03 \x01(\t\x12\x0b\n\x03key\x18\x04 \x01(\t\x12\x0b\n\x03\x64im\x18\x05 \x01(\x05\x12\r\n\x05value\x18\x06 \x01(\x0c"\x81\x02\n\x0bMetricBatch\x12\x0e\n\x06prj_id\x18\x01 \x01(\t\x12\x15\n\rexperiment_id\x18\x02 \x01(\t\x12\x10\n\x08run_uuid\x18\x03 \x01(\t\x12\x0b\n\x03key\x18\x04 \x01(\t\x12\x0b\n\x03\x64im\x18\x05 \x01(\x05\x12\r\n\x05\x63ount\x18\x06 \x01(\x05\x12\x0e\n\x06values\x18\x07 \x01(\x0c\x12\x0b\n\x03seq\x18\x08 \x01(\x03\x12\r\n\x05steps\x18\t \x01(\x0c\x12\x12\n\ntimestamps\x18\n \x01(\x0c\x12\x10\n\x08\x65ncoding\x18\x0b \x01(\t\x12\r\n\x05\x64\x65lta\x18\x0c \x01(\x08\x12\r\n\x05\x63odec\x18\r \x01(\t\x12\x0e\n\x06writer\x18\x0e \x01(\t\x12\x10\n\x08\x62\x61tch_id\x18\x0f \x01(\x03"J\n\tMetricAck\x12\x0b\n\x03seq\x18\x01 \x01(\x03\x12\x0e\n\x06status\x18\x02 \x01(\t\x12\x0f\n\x07verdict\x18\x03 \x01(\t\x12\x0f\n\x07message\x18\x04 \x01(\t" \n\x0eMetricResponse\x12\x0e\n\x06status\x18\x01 \x01(\t2\x87\x02\n\rMetricService\x12;\n\nSendMetric\x12\x15.metric.MetricRequest\x1a\x16.metric.MetricResponse\x12>\n\x0bSendMetrics\x12\x15.metric.MetricRequest\x1a\x16.metric.MetricResponse(\x01\x12<\n\x0bSendBatches\x12\x13.metric.MetricBatch\x1a\x16.metric.MetricResponse(\x01\x12;\n\rStreamBatches\x12\x13.metric.MetricBatch\x1a\x11.metric.MetricAck(\x01\x30\x01\x62\x06proto3'
 )
 
 _globals = globals()
@@ -27,8 +27,12 @@ if not _descriptor._USE_C_DESCRIPTORS:
     DESCRIPTOR._loaded_options = None
     _globals["_METRICREQUEST"]._serialized_start = 24
     _globals["_METRICREQUEST"]._serialized_end = 137
-    _globals["_METRICRESPONSE"]._serialized_start = 139
-    _globals["_METRICRESPONSE"]._serialized_end = 171
-    _globals["_METRICSERVICE"]._serialized_start = 174
-    _globals["_METRICSERVICE"]._serialized_end = 314
+    _globals["_METRICBATCH"]._serialized_start = 140
+    _globals["_METRICBATCH"]._serialized_end = 397
+    _globals["_METRICACK"]._serialized_start = 399
+    _globals["_METRICACK"]._serialized_end = 473
+    _globals["_METRICRESPONSE"]._serialized_start = 475
+    _globals["_METRICRESPONSE"]._serialized_end = 507
+    _globals["_METRICSERVICE"]._serialized_start = 510
+    _globals["_METRICSERVICE"]._serialized_end = 773
 # @@protoc_insertion_point(module_scope)
@@ -0,0 +1,122 @@
+from typing import ClassVar as _ClassVar
+from typing import Optional as _Optional
+
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import message as _message
+
+DESCRIPTOR: _descriptor.FileDescriptor
+
+class MetricRequest(_message.Message):
+    __slots__ = ("prj_id", "experiment_id", "run_uuid", "key", "dim", "value")
+    PRJ_ID_FIELD_NUMBER: _ClassVar[int]
+    EXPERIMENT_ID_FIELD_NUMBER: _ClassVar[int]
+    RUN_UUID_FIELD_NUMBER: _ClassVar[int]
+    KEY_FIELD_NUMBER: _ClassVar[int]
+    DIM_FIELD_NUMBER: _ClassVar[int]
+    VALUE_FIELD_NUMBER: _ClassVar[int]
+    prj_id: str
+    experiment_id: str
+    run_uuid: str
+    key: str
+    dim: int
+    value: bytes
+    def __init__(
+        self,
+        prj_id: str | None = ...,
+        experiment_id: str | None = ...,
+        run_uuid: str | None = ...,
+        key: str | None = ...,
+        dim: int | None = ...,
+        value: bytes | None = ...,
+    ) -> None: ...
+
+class MetricBatch(_message.Message):
+    __slots__ = (
+        "prj_id",
+        "experiment_id",
+        "run_uuid",
+        "key",
+        "dim",
+        "count",
+        "values",
+        "seq",
+        "steps",
+        "timestamps",
+        "encoding",
+        "delta",
+        "codec",
+        "writer",
+        "batch_id",
+    )
+    PRJ_ID_FIELD_NUMBER: _ClassVar[int]
+    EXPERIMENT_ID_FIELD_NUMBER: _ClassVar[int]
+    RUN_UUID_FIELD_NUMBER: _ClassVar[int]
+    KEY_FIELD_NUMBER: _ClassVar[int]
+    DIM_FIELD_NUMBER: _ClassVar[int]
+    COUNT_FIELD_NUMBER: _ClassVar[int]
+    VALUES_FIELD_NUMBER: _ClassVar[int]
+    SEQ_FIELD_NUMBER: _ClassVar[int]
+    STEPS_FIELD_NUMBER: _ClassVar[int]
+    TIMESTAMPS_FIELD_NUMBER: _ClassVar[int]
+    ENCODING_FIELD_NUMBER: _ClassVar[int]
+    DELTA_FIELD_NUMBER: _ClassVar[int]
+    CODEC_FIELD_NUMBER: _ClassVar[int]
+    WRITER_FIELD_NUMBER: _ClassVar[int]
+    BATCH_ID_FIELD_NUMBER: _ClassVar[int]
+    prj_id: str
+    experiment_id: str
+    run_uuid: str
+    key: str
+    dim: int
+    count: int
+    values: bytes
+    seq: int
+    steps: bytes
+    timestamps: bytes
+    encoding: str
+    delta: bool
+    codec: str
+    writer: str
+    batch_id: int
+    def __init__(
+        self,
+        prj_id: str | None = ...,
+        experiment_id: str | None = ...,
+        run_uuid: str | None = ...,
+        key: str | None = ...,
+        dim: int | None = ...,
+        count: int | None = ...,
+        values: bytes | None = ...,
+        seq: int | None = ...,
+        steps: bytes | None = ...,
+        timestamps: bytes | None = ...,
+        encoding: str | None = ...,
+        delta: bool = ...,
+        codec: str | None = ...,
+        writer: str | None = ...,
+        batch_id: int | None = ...,
+    ) -> None: ...
+
+class MetricAck(_message.Message):
+    __slots__ = ("seq", "status", "verdict", "message")
+    SEQ_FIELD_NUMBER: _ClassVar[int]
+    STATUS_FIELD_NUMBER: _ClassVar[int]
+    VERDICT_FIELD_NUMBER: _ClassVar[int]
+    MESSAGE_FIELD_NUMBER: _ClassVar[int]
+    seq: int
+    status: str
+    verdict: str
+    message: str
+    def __init__(
+        self,
+        seq: int | None = ...,
+        status: str | None = ...,
+        verdict: str | None = ...,
+        message: str | None = ...,
+    ) -> None: ...
+
+class MetricResponse(_message.Message):
+    __slots__ = ("status",)
+    STATUS_FIELD_NUMBER: _ClassVar[int]
+    status: str
+    def __init__(self, status: str | None = ...) -> None: ...
@@ -49,6 +49,18 @@ class MetricServiceStub:
             response_deserializer=metric__pb2.MetricResponse.FromString,
             _registered_method=True,
         )
+        self.SendBatches = channel.stream_unary(
+            "/metric.MetricService/SendBatches",
+            request_serializer=metric__pb2.MetricBatch.SerializeToString,
+            response_deserializer=metric__pb2.MetricResponse.FromString,
+            _registered_method=True,
+        )
+        self.StreamBatches = channel.stream_stream(
+            "/metric.MetricService/StreamBatches",
+            request_serializer=metric__pb2.MetricBatch.SerializeToString,
+            response_deserializer=metric__pb2.MetricAck.FromString,
+            _registered_method=True,
+        )
 
 
 class MetricServiceServicer:
@@ -66,6 +78,18 @@ class MetricServiceServicer:
         context.set_details("Method not implemented!")
         raise NotImplementedError("Method not implemented!")
 
+    def SendBatches(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
+    def StreamBatches(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details("Method not implemented!")
+        raise NotImplementedError("Method not implemented!")
+
 
 def add_MetricServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -79,6 +103,16 @@ def add_MetricServiceServicer_to_server(servicer, server):
             request_deserializer=metric__pb2.MetricRequest.FromString,
             response_serializer=metric__pb2.MetricResponse.SerializeToString,
         ),
+        "SendBatches": grpc.stream_unary_rpc_method_handler(
+            servicer.SendBatches,
+            request_deserializer=metric__pb2.MetricBatch.FromString,
+            response_serializer=metric__pb2.MetricResponse.SerializeToString,
+        ),
+        "StreamBatches": grpc.stream_stream_rpc_method_handler(
+            servicer.StreamBatches,
+            request_deserializer=metric__pb2.MetricBatch.FromString,
+            response_serializer=metric__pb2.MetricAck.SerializeToString,
+        ),
     }
     generic_handler = grpc.method_handlers_generic_handler("metric.MetricService", rpc_method_handlers)
     server.add_generic_rpc_handlers((generic_handler,))
@@ -148,3 +182,63 @@ class MetricService:
             metadata,
             _registered_method=True,
         )
+
+    @staticmethod
+    def SendBatches(
+        request_iterator,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.stream_unary(
+            request_iterator,
+            target,
+            "/metric.MetricService/SendBatches",
+            metric__pb2.MetricBatch.SerializeToString,
+            metric__pb2.MetricResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True,
+        )
+
+    @staticmethod
+    def StreamBatches(
+        request_iterator,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.stream_stream(
+            request_iterator,
+            target,
+            "/metric.MetricService/StreamBatches",
+            metric__pb2.MetricBatch.SerializeToString,
+            metric__pb2.MetricAck.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True,
+        )
@@ -0,0 +1,72 @@
+import argparse
+import logging
+from pathlib import Path
+
+import numpy as np
+
+from .lod import LodPyramid
+from .metric_file import SUFFIX, MetricWriter
+
+logger = logging.getLogger(__name__)
+
+LEGACY_SUFFIXES = (".bin", ".meta", ".step", ".time", ".unsorted", ".sidx")
+
+
+def migrate_metric(run_path: Path, key: str, keep: bool = False) -> Path:
+    """旧形式 ({key}.bin/.meta/.step/.time) を {key}.chm に変換する"""
+    meta_path = run_path / f"{key}.meta"
+    dim = int(meta_path.read_text().strip()) if meta_path.exists() else 1
+    values = np.fromfile(run_path / f"{key}.bin", dtype=np.float32)
+    n_rows = len(values) // dim
+    steps = np.arange(n_rows, dtype=np.int64)
+    times = np.full(n_rows, np.nan)
+    if (step_path := run_path / f"{key}.step").exists():
+        column = np.fromfile(step_path, dtype=np.int64, count=n_rows)
+        steps[: len(column)] = column
+    if (time_path := run_path / f"{key}.time").exists():
+        column = np.fromfile(time_path, dtype=np.float64, count=n_rows)
+        times[: len(column)] = column
+
+    path = run_path / f"{key}{SUFFIX}"
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.unlink(missing_ok=True)
+    writer = MetricWriter(tmp, dim)
+    rows = np.empty(n_rows, dtype=writer.header.row_dtype)
+    rows["step"], rows["time"] = steps, times
+    rows["value"] = values[: n_rows * dim].reshape((-1, dim))
+    writer.append(rows, unsorted=bool(n_rows) and bool(np.any(np.diff(steps) < 0)))
+    writer.close()
+    tmp.replace(path)
+    if not writer.header.unsorted:
+        # 開き直すと LOD ピラミッドが末尾から作られる
+        writer = MetricWriter(path, dim)
+        LodPyramid(writer).close()
+        writer.close()
+    if not keep:
+        for suffix in LEGACY_SUFFIXES:
+            (run_path / f"{key}{suffix}").unlink(missing_ok=True)
+    return path
+
+
+def migrate_run(run_path: Path, keep: bool = False) -> list[Path]:
+    """run ディレクトリ内の旧形式メトリクスをすべて変換する（変換済みのものは飛ばす）"""
+    return [
+        migrate_metric(run_path, bin_path.stem, keep)
+        for bin_path in sorted(run_path.glob("*.bin"))
+        if not (run_path / f"{bin_path.stem}{SUFFIX}").exists()
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Convert chaser metrics from .bin/.meta to the chunked format.")
+    parser.add_argument("data_dir", nargs="?", default="/data/experiments", type=Path)
+    parser.add_argument("--keep", action="store_true", help="keep the legacy files")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    for run_path in sorted(p for p in args.data_dir.glob("*/*") if p.is_dir()):
+        for path in migrate_run(run_path, args.keep):
+            logger.info(f"Migrated {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,51 +1,232 @@
+import asyncio
 import logging
+import threading
+from collections import defaultdict
+from collections.abc import AsyncIterator, Callable
+from concurrent.futures import Future
 from pathlib import Path
+from typing import Any
 
-import aiofiles
 from grpc import aio
 
 from . import metric_pb2, metric_pb2_grpc
+from .codec import decode_batch
+from .watch import Watcher, WatchRule
+from .writer import HandleCache, MetricInfo
 
 DATA_DIR = Path("/data/experiments")
 logger = logging.getLogger(__name__)
 
 
 class MetricService(metric_pb2_grpc.MetricServiceServicer):
-    async def SendMetrics(self, request_iterator, context):
-        buffer = []
-        flush_threshold = 100
-
-        async for metric_req in request_iterator:
-            buffer.append(metric_req)
-
-            if len(buffer) >= flush_threshold:
-                await self.flush_to_file(buffer)
-                buffer.clear()
-
-        if buffer:
-            await self.flush_to_file(buffer)
-
-        return metric_pb2.MetricResponse(status="ok")
-
-    async def flush_to_file(self, buffer):
-        for m in buffer:
-            dir_path = DATA_DIR / m.experiment_id / m.run_uuid
-            dir_path.mkdir(parents=True, exist_ok=True)
-
-            metric_path = dir_path / f"{m.key}.bin"
-            meta_path = dir_path / f"{m.key}.meta"
-
-            async with aiofiles.open(metric_path, "ab") as f:
-                await f.write(m.value)
-
-            if not meta_path.exists():
-                async with aiofiles.open(meta_path, "w") as f:
-                    await f.write(str(m.dim))
-
-
-async def chaser_grpc_server(host: str = "0.0.0.0", port: int = 14000):
+    """メトリクス受信サービス
+
+    受け取ったバッチはいったん溜め、同じファイル宛てのものをまとめて書き込む。
+    ファイルハンドルは LRU で開いたまま使い回し、end_run で閉じる。
+    書き込んだメトリクスの情報 (MetricInfo) は update_interval 秒ごとにまとめて on_update に渡す。
+    書き込んだバッチは watch_rules（と run ごとのルール）で判定し、掛かった run の ACK に理由を載せる。
+    """
+
+    def __init__(
+        self,
+        max_open: int = 256,
+        flush_delay: float = 0.005,
+        flush_threshold: int = 256,
+        on_update: Callable[[list[MetricInfo]], None] | None = None,
+        update_interval: float = 1.0,
+        watch_rules: list[WatchRule] | None = None,
+    ):
+        self.handles = HandleCache(DATA_DIR, max_open=max_open)
+        self.flush_delay = flush_delay  # 秒
+        self.flush_threshold = flush_threshold
+        self.queue: list[tuple[metric_pb2.MetricBatch, asyncio.Future[str | None]]] = []
+        self.flush_lock: asyncio.Lock | None = None
+        self.flush_handle: asyncio.TimerHandle | None = None
+        self.on_update = on_update
+        self.update_interval = update_interval  # 秒
+        self.updated: dict[tuple[str, str, str], MetricInfo] = {}
+        self.update_lock = threading.Lock()
+        self.update_handle: asyncio.TimerHandle | None = None
+        self.watcher = Watcher(watch_rules)
+        self.loop: asyncio.AbstractEventLoop | None = None  # gRPC サーバのイベントループ
+
+    async def SendMetric(
+        self, request: metric_pb2.MetricRequest, context: aio.ServicerContext
+    ) -> metric_pb2.MetricResponse:
+        return await self.respond([self.submit(self.to_batch(request))])
+
+    async def SendMetrics(
+        self, request_iterator: AsyncIterator[metric_pb2.MetricRequest], context: aio.ServicerContext
+    ) -> metric_pb2.MetricResponse:
+        return await self.respond([self.submit(self.to_batch(req)) async for req in request_iterator])
+
+    async def SendBatches(
+        self, request_iterator: AsyncIterator[metric_pb2.MetricBatch], context: aio.ServicerContext
+    ) -> metric_pb2.MetricResponse:
+        return await self.respond([self.submit(batch) async for batch in request_iterator])
+
+    @staticmethod
+    async def respond(futures: list[asyncio.Future[str | None]]) -> metric_pb2.MetricResponse:
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        failed = any(isinstance(result, Exception) for result in results)
+        return metric_pb2.MetricResponse(status="error" if failed else "ok")
+
+    async def StreamBatches(
+        self, request_iterator: AsyncIterator[metric_pb2.MetricBatch], context: aio.ServicerContext | None
+    ) -> AsyncIterator[metric_pb2.MetricAck]:
+        """長寿命の双方向ストリーム: 受信と書き込みを分けて、書き込み完了順に ACK を返す"""
+        acks: asyncio.Queue[tuple[int, asyncio.Future[str | None]] | None] = asyncio.Queue(maxsize=1024)
+
+        async def receive() -> None:
+            async for batch in request_iterator:
+                await acks.put((batch.seq, self.submit(batch)))
+            await acks.put(None)
+
+        receiver = asyncio.create_task(receive())
+        try:
+            while (item := await acks.get()) is not None:
+                seq, future = item
+                try:
+                    verdict = await future
+                except Exception as e:
+                    # 書き込めなかったバッチだけ error で返し、ストリームは続ける
+                    yield metric_pb2.MetricAck(seq=seq, status="error", message=str(e) or type(e).__name__)
+                    continue
+                yield metric_pb2.MetricAck(seq=seq, status="ok", verdict=verdict or "")
+            await receiver
+        finally:
+            receiver.cancel()
+
+    @staticmethod
+    def to_batch(m: metric_pb2.MetricRequest) -> metric_pb2.MetricBatch:
+        return metric_pb2.MetricBatch(
+            prj_id=m.prj_id,
+            experiment_id=m.experiment_id,
+            run_uuid=m.run_uuid,
+            key=m.key,
+            dim=m.dim,
+            count=len(m.value) // (m.dim * 4) if m.dim else 0,
+            values=m.value,
+        )
+
+    def submit(self, batch: metric_pb2.MetricBatch) -> asyncio.Future[str | None]:
+        """バッチを書き込み待ちに積み、書き込み完了で解決する Future を返す（値は run の監視の判定理由か None）
+
+        不正なバッチは書き込まず、ValueError で失敗した Future を返す（error の ACK になる）。
+        """
+        future: asyncio.Future[str | None] = asyncio.get_running_loop().create_future()
+        try:
+            batch = decode_batch(batch)
+        except ValueError as e:
+            logger.warning(f"Invalid batch encoding: {batch.run_uuid}/{batch.key} ({e})")
+            future.set_exception(ValueError(f"Invalid batch encoding: {e}"))
+            return future
+        if len(batch.values) != batch.count * batch.dim * 4 or (
+            len(batch.steps) not in (0, batch.count * 8) or len(batch.timestamps) not in (0, batch.count * 8)
+        ):
+            logger.warning(f"Invalid batch size: {batch.run_uuid}/{batch.key} ({batch.count}x{batch.dim})")
+            future.set_exception(ValueError(f"Invalid batch size: {batch.count}x{batch.dim}"))
+            return future
+        self.queue.append((batch, future))
+        if len(self.queue) >= self.flush_threshold:
+            self.schedule_flush(0)
+        elif self.flush_handle is None:
+            self.schedule_flush(self.flush_delay)
+        return future
+
+    def submit_threadsafe(self, batch: metric_pb2.MetricBatch) -> Future[str | None]:
+        """別スレッド（HTTP のハンドラなど）から gRPC と同じ経路でバッチを書き込む"""
+        if self.loop is None:
+            raise RuntimeError("gRPC server is not running")
+
+        async def submit() -> str | None:
+            return await self.submit(batch)
+
+        return asyncio.run_coroutine_threadsafe(submit(), self.loop)
+
+    def schedule_flush(self, delay: float) -> None:
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+        loop = asyncio.get_running_loop()
+        self.flush_handle = loop.call_later(delay, lambda: loop.create_task(self.flush()))
+
+    async def flush(self) -> None:
+        """溜まったバッチをファイルごとにまとめ、スレッドで1ファイル1回の書き込みにする"""
+        self.flush_handle = None
+        if self.flush_lock is None:
+            self.flush_lock = asyncio.Lock()
+        async with self.flush_lock:
+            while self.queue:
+                queue, self.queue = self.queue, []
+                groups = defaultdict(list)
+                for batch, _ in queue:
+                    groups[(batch.experiment_id, batch.run_uuid, batch.key)].append(batch)
+                try:
+                    infos, verdicts, errors = await asyncio.to_thread(self.write, groups)
+                except Exception as e:
+                    logger.exception("Failed to write metrics")
+                    infos, verdicts, errors = [], {}, dict.fromkeys(groups, e)
+                for batch, future in queue:
+                    # 書き込めなかったグループのバッチだけ失敗させる（同じ flush の他のグループは ACK する）
+                    if (error := errors.get((batch.experiment_id, batch.run_uuid, batch.key))) is not None:
+                        future.set_exception(error)
+                        continue
+                    verdict = verdicts.get((batch.experiment_id, batch.run_uuid))
+                    future.set_result(verdict["reason"] if verdict else None)
+                self.mark_updated(infos)
+
+    def write(
+        self, groups: dict[tuple[str, str, str], list[metric_pb2.MetricBatch]]
+    ) -> tuple[list[MetricInfo], dict[tuple[str, str], dict[str, Any]], dict[tuple[str, str, str], Exception]]:
+        """グループを書き込み、(MetricInfo, run ごとの判定, 書き込めなかったグループの例外) を返す"""
+        infos, written, errors = self.handles.write(groups)
+        try:
+            verdicts = self.watcher.check(written)  # 再送で捨てた分は監視にも掛けない
+        except Exception:
+            logger.exception("Failed to check watch rules")
+            verdicts = {}
+        return infos, verdicts, errors
+
+    def mark_updated(self, infos: list[MetricInfo]) -> None:
+        if self.on_update is None:
+            return
+        with self.update_lock:
+            self.updated.update({(i.experiment_id, i.run_uuid, i.key): i for i in infos})
+        if self.update_handle is None:
+            loop = asyncio.get_running_loop()
+            self.update_handle = loop.call_later(self.update_interval, lambda: loop.create_task(self.publish()))
+
+    async def publish(self) -> None:
+        """溜まった MetricInfo を on_update に渡す（DB 更新などはスレッドで）"""
+        self.update_handle = None
+        with self.update_lock:
+            infos, self.updated = list(self.updated.values()), {}
+        if infos and self.on_update is not None:
+            try:
+                await asyncio.to_thread(self.on_update, infos)
+            except Exception:
+                logger.exception("Failed to publish metric updates")
+
+    def close_run(self, experiment_id: str, run_uuid: str) -> None:
+        """run のファイルハンドルを閉じ、最終的な MetricInfo をすぐに渡す（end_run から呼ぶ）"""
+        infos = self.handles.close_run(experiment_id, run_uuid)
+        self.watcher.close_run(experiment_id, run_uuid)
+        if self.on_update is None:
+            return
+        with self.update_lock:
+            for key in [key for key in self.updated if key[:2] == (experiment_id, run_uuid)]:
+                info = self.updated.pop(key)
+                if not any(i.key == info.key for i in infos):
+                    infos.append(info)
+        if infos:
+            self.on_update(infos)
+
+
+async def chaser_grpc_server(host: str = "0.0.0.0", port: int = 14000, service: MetricService | None = None):
     server = aio.server()
-    metric_pb2_grpc.add_MetricServiceServicer_to_server(MetricService(), server)
+    service = service or MetricService()
+    service.loop = asyncio.get_running_loop()
+    metric_pb2_grpc.add_MetricServiceServicer_to_server(service, server)
     server.add_insecure_port(f"{host}:{port}")
     await server.start()
     logger.info(f"Async gRPC server started on port {port}")
@@ -0,0 +1,122 @@
+import json
+import logging
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+from .metric_file import MetricFile
+
+logger = logging.getLogger(__name__)
+
+# 要約統計は {key}.stats に JSON で持ち、ハンドルを閉じるときに書く。
+# 開き直したときは記録済みの行数より後ろの行だけを読んで足し込む。
+STATS_SUFFIX = ".stats"
+RECOVER_ROWS = 1 << 20  # 足し込むときに一度に読む行数
+
+
+def stats_path(path: Path) -> Path:
+    return path.with_suffix(STATS_SUFFIX)
+
+
+class MetricStats:
+    """1つの (run, key) の次元ごとの要約統計（件数・min・max・平均・最後の値・NaN 数）
+
+    バッチの行配列ごとにまとめて更新する。最後の値は step が最大の行の値。
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.n_rows = 0
+        self.count = np.zeros(dim, dtype=np.int64)  # NaN 以外の件数
+        self.nan_count = np.zeros(dim, dtype=np.int64)
+        self.min = np.full(dim, np.inf)
+        self.max = np.full(dim, -np.inf)
+        self.sum = np.zeros(dim)
+        self.last = np.full(dim, np.nan)
+        self.last_step = np.iinfo(np.int64).min
+
+    def update(self, rows: np.ndarray) -> None:
+        if not len(rows):
+            return
+        values = rows["value"].reshape((len(rows), self.dim))
+        nan = np.isnan(values)
+        n_nan = nan.sum(axis=0)
+        self.n_rows += len(rows)
+        self.nan_count += n_nan
+        self.count += len(rows) - n_nan
+        self.min = np.fmin(self.min, np.fmin.reduce(values, axis=0))
+        self.max = np.fmax(self.max, np.fmax.reduce(values, axis=0))
+        self.sum += np.nansum(values, axis=0, dtype=np.float64)
+        steps = rows["step"]
+        i = len(steps) - 1 - int(np.argmax(steps[::-1]))  # 最大の step のうち最後に届いた行
+        if steps[i] >= self.last_step:
+            self.last, self.last_step = values[i].astype(np.float64), int(steps[i])
+
+    @property
+    def mean(self) -> np.ndarray:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.count > 0, self.sum / self.count, np.nan)
+
+    def to_dict(self) -> dict[str, Any]:
+        """JSON にできる形（値がない次元は None）"""
+
+        def column(values: np.ndarray) -> list[float | None]:
+            return [float(v) if np.isfinite(v) else None for v in values]
+
+        return {
+            "n_rows": self.n_rows,
+            "count": self.count.tolist(),
+            "nan_count": self.nan_count.tolist(),
+            "min": column(self.min),
+            "max": column(self.max),
+            "mean": column(self.mean),
+            "last": column(self.last),
+            "last_step": self.last_step if self.n_rows else None,
+        }
+
+    def save(self, path: Path) -> None:
+        state = {**self.to_dict(), "sum": self.sum.tolist()}
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(state))
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path, dim: int) -> "MetricStats":
+        state = json.loads(path.read_text())
+        stats = cls(dim)
+        if len(state["count"]) != dim:
+            raise ValueError(f"Dimension mismatch in {path}")
+        stats.n_rows = state["n_rows"]
+        stats.count = np.array(state["count"], dtype=np.int64)
+        stats.nan_count = np.array(state["nan_count"], dtype=np.int64)
+        stats.min = np.array([np.inf if v is None else v for v in state["min"]])
+        stats.max = np.array([-np.inf if v is None else v for v in state["max"]])
+        stats.sum = np.array(state["sum"], dtype=np.float64)
+        stats.last = np.array([np.nan if v is None else v for v in state["last"]])
+        if state["last_step"] is not None:
+            stats.last_step = state["last_step"]
+        return stats
+
+    @classmethod
+    def recover(cls, path: Path, dim: int) -> "MetricStats":
+        """{key}.stats を読み、その後ろに追記された行を足し込む（なければファイル全体から作る）"""
+        stats = cls(dim)
+        if (saved := stats_path(path)).exists():
+            try:
+                stats = cls.load(saved, dim)
+            except (ValueError, KeyError, TypeError):
+                logger.warning(f"Rebuilding broken stats: {saved}")
+                stats = cls(dim)
+        if not path.exists():
+            return stats
+        file = MetricFile(path)
+        if stats.n_rows > file.n_rows:
+            stats = cls(dim)
+        for start in range(stats.n_rows, file.n_rows, RECOVER_ROWS):
+            stats.update(file.rows(start, min(start + RECOVER_ROWS, file.n_rows)))
+        return stats
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,183 @@
+import json
+import logging
+import threading
+from fnmatch import fnmatchcase
+from typing import Any, NamedTuple
+
+import numpy as np
+
+from . import metric_pb2
+
+logger = logging.getLogger(__name__)
+
+# 受信時の監視ルール
+#   nonfinite: NaN / inf が出たら
+#   above / below: 値が threshold を上回ったら / 下回ったら
+#   plateau: patience step のあいだ最良値を threshold (min_delta) 以上更新しなかったら
+# key は fnmatch のパターン。dim を省略すると全次元のどれか（plateau は 0 次元目）を見る。
+RULE_KINDS = ("nonfinite", "above", "below", "plateau")
+
+
+class WatchRule(NamedTuple):
+    key: str
+    kind: str
+    threshold: float = 0.0
+    patience: int = 0  # plateau のみ (step)
+    mode: str = "min"  # plateau のみ: min なら小さいほど良い
+    dim: int | None = None  # 0 始まり
+    warmup: int = 0  # この step より前は判定しない
+
+    @classmethod
+    def parse(cls, spec: dict[str, Any]) -> "WatchRule":
+        """{"key": "loss", "kind": "plateau", "patience": 1000} 形式の指定を検証して読む"""
+        try:
+            rule = cls(**spec)
+            rule = rule._replace(
+                key=str(rule.key),
+                threshold=float(rule.threshold),
+                patience=int(rule.patience),
+                dim=None if rule.dim is None else int(rule.dim),
+                warmup=int(rule.warmup),
+            )
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid watch rule {spec}: {e}") from None
+        if rule.kind not in RULE_KINDS:
+            raise ValueError(f"Unknown watch rule kind {rule.kind!r} (choose from {', '.join(RULE_KINDS)})")
+        if rule.mode not in ("min", "max"):
+            raise ValueError(f"Invalid mode {rule.mode!r} in watch rule for {rule.key}")
+        if rule.kind == "plateau" and rule.patience <= 0:
+            raise ValueError(f"plateau rule for {rule.key} needs patience > 0")
+        return rule
+
+    def describe(self) -> str:
+        if self.kind == "nonfinite":
+            return "non-finite value"
+        if self.kind == "plateau":
+            return f"no improvement ({self.mode}) for {self.patience} steps"
+        return f"value {'>' if self.kind == 'above' else '<'} {self.threshold:g}"
+
+
+def parse_rules(specs: str | list[dict[str, Any]] | None) -> list[WatchRule]:
+    """JSON 文字列かリストで渡されたルールを読む（YAML・JSON から読んだ形もここで検証する）"""
+    if not specs:
+        return []
+    if isinstance(specs, str):
+        try:
+            specs = json.loads(specs)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid watch rules: {e}") from None
+    if not isinstance(specs, list):
+        raise ValueError(f"Watch rules must be a list of mappings, not {type(specs).__name__}")
+    rules = []
+    for spec in specs:
+        if not isinstance(spec, dict):
+            raise ValueError(f"Watch rule must be a mapping like {{'key': 'loss', 'kind': 'nonfinite'}}, not {spec!r}")
+        rules.append(WatchRule.parse(spec))
+    return rules
+
+
+def first_violation(rule: WatchRule, steps: np.ndarray, values: np.ndarray, state: dict[str, Any]) -> int | None:
+    """バッチ (steps, values[行, 次元]) の中で rule に最初に掛かった行。plateau は state に最良値と更新 step を持つ"""
+    if rule.dim is not None and rule.dim >= values.shape[1]:
+        return None
+    if rule.kind == "plateau":
+        x = values[:, rule.dim or 0].astype(np.float64)
+        x = x if rule.mode == "min" else -x
+        best = state.get("best", np.inf)
+        # 直前の行までの最良値を threshold 以上更新した行が「改善」。NaN は改善にならない
+        before = np.fmin.accumulate(np.concatenate([[best], x[:-1]]))
+        improved = x < before - rule.threshold
+        since = np.maximum.accumulate(np.where(improved, steps, state.get("step", steps[0])))
+        state["best"], state["step"] = float(np.fmin(best, np.fmin.reduce(x))), int(since[-1])
+        bad: np.ndarray | np.bool_ = steps - since > rule.patience
+    else:
+        x = values if rule.dim is None else values[:, [rule.dim]]
+        if rule.kind == "nonfinite":
+            bad = ~np.isfinite(x).all(axis=1)
+        elif rule.kind == "above":
+            bad = (x > rule.threshold).any(axis=1)
+        else:
+            bad = (x < rule.threshold).any(axis=1)
+    bad &= steps >= rule.warmup
+    return int(np.argmax(bad)) if bad.any() else None
+
+
+class Watcher:
+    """受信したバッチを監視ルールで判定し、run ごとに最初に掛かったルールを覚えておく
+
+    ルールは全 run 共通のものと、run ごとに start_run で渡されたものを合わせて使う。
+    判定はバッチ単位で NumPy でまとめて行う。一度掛かった run はそれ以降判定しない。
+    """
+
+    def __init__(self, rules: list[WatchRule] | None = None):
+        self.rules = rules or []
+        self.run_rules: dict[tuple[str, str], list[WatchRule]] = {}
+        self.states: dict[
+            tuple[Any, ...], dict[str, Any]
+        ] = {}  # (experiment, run, key, ルール) -> plateau の状態・直近の step
+        self.verdicts: dict[tuple[str, str], dict[str, Any]] = {}
+        self.lock = threading.Lock()
+
+    def set_rules(self, experiment_id: str, run_uuid: str, rules: list[WatchRule]) -> None:
+        with self.lock:
+            self.run_rules[(experiment_id, run_uuid)] = rules
+
+    def check(
+        self, groups: dict[tuple[str, str, str], list[metric_pb2.MetricBatch]]
+    ) -> dict[tuple[str, str], dict[str, Any]]:
+        """(experiment, run, key) ごとのバッチを判定し、判定の出ている run の {(experiment, run): verdict} を返す"""
+        with self.lock:
+            for name, batches in groups.items():
+                run = name[:2]
+                rules = [r for r in self.rules + self.run_rules.get(run, []) if fnmatchcase(name[2], r.key)]
+                if run in self.verdicts or not rules:
+                    continue
+                steps, values = self.decode(name, batches)
+                for rule in rules:
+                    if not len(steps):
+                        break
+                    state = self.states.setdefault((*name, rule), {})
+                    if (i := first_violation(rule, steps, values, state)) is not None:
+                        self.verdicts[run] = verdict = {
+                            "key": name[2],
+                            "step": int(steps[i]),
+                            "rule": rule._asdict(),
+                            "reason": f"{name[2]}: {rule.describe()} at step {int(steps[i])}",
+                        }
+                        logger.warning(f"Run {run[1]} hit a watch rule: {verdict['reason']}")
+                        break
+            return {run: self.verdicts[run] for run in {name[:2] for name in groups} if run in self.verdicts}
+
+    def decode(
+        self, name: tuple[str, str, str], batches: list[metric_pb2.MetricBatch]
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """バッチの steps / values をそのまま配列として読む（steps がなければ受信側と同じく連番）"""
+        dim = batches[0].dim
+        batches = [b for b in batches if b.dim == dim and b.count]
+        state = self.states.setdefault(name, {})
+        steps, last = [], state.get("last_step", -1)
+        for b in batches:
+            step = np.frombuffer(b.steps, dtype=np.int64) if b.steps else np.arange(last + 1, last + 1 + b.count)
+            last = max(last, int(step.max()))
+            steps.append(step)
+        state["last_step"] = last
+        if not batches:
+            return np.array([], np.int64), np.empty((0, dim), np.float32)
+        values = [np.frombuffer(b.values, dtype=np.float32).reshape((-1, dim)) for b in batches]
+        return np.concatenate(steps), np.concatenate(values)
+
+    def verdict(self, experiment_id: str, run_uuid: str) -> dict[str, Any] | None:
+        with self.lock:
+            return self.verdicts.get((experiment_id, run_uuid))
+
+    def close_run(self, experiment_id: str, run_uuid: str) -> None:
+        run = (experiment_id, run_uuid)
+        with self.lock:
+            self.run_rules.pop(run, None)
+            self.verdicts.pop(run, None)
+            for key in [key for key in self.states if key[:2] == run]:
+                del self.states[key]
+
+
+if __name__ == "__main__":
+    pass
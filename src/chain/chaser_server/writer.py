@@ -0,0 +1,215 @@
+import contextlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any, NamedTuple
+
+import numpy as np
+
+from . import metric_pb2
+from .codec import storage_dtype
+from .lod import LOD_LEVELS, LodPyramid, lod_path
+from .metric_file import SUFFIX, MetricWriter
+from .stats import MetricStats, stats_path
+
+logger = logging.getLogger(__name__)
+
+DEDUP_KEYS = 1 << 16  # 書き込み済みの batch_id を覚えておく (experiment, run, key) の数
+
+
+def to_rows(writer: MetricWriter, batches: list[metric_pb2.MetricBatch]) -> tuple[np.ndarray, bool]:
+    """同じファイル宛てのバッチを1つの行配列にまとめる。step 順が乱れたかも返す"""
+    if skipped := [b.dim for b in batches if b.dim != writer.dim]:
+        logger.warning(f"Dimension mismatch for {writer.path}: {skipped} != {writer.dim}")
+        batches = [b for b in batches if b.dim == writer.dim]
+    rows = np.empty(sum(b.count for b in batches), dtype=writer.header.row_dtype)
+    last_step, unsorted, pos, now = writer.last_step, False, 0, time.time()
+    for batch in batches:
+        part = rows[pos : pos + batch.count]
+        if batch.steps:
+            part["step"] = np.frombuffer(batch.steps, dtype=np.int64)
+        else:
+            part["step"] = np.arange(last_step + 1, last_step + 1 + batch.count)
+        part["time"] = np.frombuffer(batch.timestamps, dtype=np.float64) if batch.timestamps else now
+        part["value"] = np.frombuffer(batch.values, dtype=np.float32).reshape((-1, writer.dim))
+        if batch.count:
+            # step が単調増加なら step 列自体がソート済みインデックスになる
+            unsorted |= bool(part["step"][0] < last_step or np.any(np.diff(part["step"]) < 0))
+            last_step = max(last_step, int(part["step"].max()))
+        pos += batch.count
+    return rows, unsorted
+
+
+class MetricInfo(NamedTuple):
+    """メトリクスファイルの概要（カタログ用）"""
+
+    experiment_id: str
+    run_uuid: str
+    key: str
+    dim: int
+    dtype: str
+    n_rows: int
+    size: int
+    stats: dict[str, Any] | None = None  # MetricStats.to_dict()
+
+
+class MetricHandle:
+    """1つの (experiment, run, key) の追記ハンドル（生データと LOD ピラミッド）"""
+
+    def __init__(self, path: Path, dim: int, dtype: str = "<f4"):
+        self.path = path
+        self.file = MetricWriter(path, dim, dtype)  # dtype は新しく作るときだけ使う
+        self.lod = LodPyramid(self.file) if not self.file.header.unsorted else None
+        self.stats = MetricStats.recover(path, dim)
+
+    def write(self, batches: list[metric_pb2.MetricBatch]) -> None:
+        rows, unsorted = to_rows(self.file, batches)
+        self.file.append(rows, unsorted)
+        self.stats.update(rows)
+        if self.lod is not None and self.file.header.unsorted:
+            # step 順が崩れたら LOD は使えない（ダッシュボード側は生データを間引く）
+            self.lod.close()
+            self.lod = None
+        if self.lod is not None:
+            self.lod.append(rows)
+
+    def info(self, experiment_id: str, run_uuid: str, key: str) -> MetricInfo:
+        header = self.file.header
+        return MetricInfo(
+            experiment_id, run_uuid, key, header.dim, header.dtype, header.n_rows, self.size(), self.stats.to_dict()
+        )
+
+    def size(self) -> int:
+        """生データと LOD を合わせたバイト数"""
+        paths = [self.path] + [lod_path(self.path, level) for level in range(1, LOD_LEVELS + 1)]
+        return sum(path.stat().st_size for path in paths if path.exists())
+
+    def close(self) -> None:
+        self.file.close()
+        self.stats.save(stats_path(self.path))
+        if self.lod is not None:
+            self.lod.close()
+
+
+class HandleCache:
+    """開いた追記ハンドルの LRU キャッシュ（ディレクトリ作成済みかも覚えておく）
+
+    クライアントは ACK が届かなかったバッチを再送する（at-least-once）ので、
+    (experiment, run, key) と writer ごとに書き込み済みの最大 batch_id を覚えておき、それ以下のバッチは捨てる。
+    batch_id は writer 内で送信順に増える。ハンドルを閉じた後のスプールの再送にも効くように、
+    ハンドルとは別に DEDUP_KEYS 件まで LRU で持つ（サーバを再起動すると忘れる）。
+    """
+
+    def __init__(self, data_dir: Path, max_open: int = 256):
+        self.data_dir = data_dir
+        self.max_open = max_open
+        self.handles: OrderedDict[tuple[str, str, str], MetricHandle] = OrderedDict()
+        self.dirs: set[Path] = set()
+        self.committed: OrderedDict[tuple[str, str, str], dict[str, int]] = OrderedDict()  # -> {writer: batch_id}
+        self.lock = threading.Lock()
+        # run ディレクトリを初めて開く前に呼ぶ（手元から消した run を S3 から戻す。ダッシュボードが設定する）
+        self.restore: Callable[[Path], None] | None = None
+
+    def get(self, experiment_id: str, run_uuid: str, key: str, dim: int, dtype: str = "<f4") -> MetricHandle:
+        """lock を取った状態で呼ぶ"""
+        name = (experiment_id, run_uuid, key)
+        if (handle := self.handles.get(name)) is not None:
+            self.handles.move_to_end(name)
+            return handle
+        dir_path = self.data_dir / experiment_id / run_uuid
+        if dir_path not in self.dirs:
+            if self.restore is not None:
+                self.restore(dir_path)
+            dir_path.mkdir(parents=True, exist_ok=True)
+            self.dirs.add(dir_path)
+        while len(self.handles) >= self.max_open:
+            _, old = self.handles.popitem(last=False)
+            old.close()
+        handle = self.handles[name] = MetricHandle(dir_path / f"{key}{SUFFIX}", dim, dtype)
+        return handle
+
+    def runs(self) -> set[tuple[str, str]]:
+        """ハンドルを開いている (experiment, run)。lock を取った状態で呼ぶ"""
+        return {name[:2] for name in self.handles}
+
+    def fresh(
+        self, groups: dict[tuple[str, str, str], list[metric_pb2.MetricBatch]]
+    ) -> dict[tuple[str, str, str], list[metric_pb2.MetricBatch]]:
+        """再送で届いた書き込み済みのバッチ（同じグループ内の重複も）を除く。lock を取った状態で呼ぶ"""
+        out = {}
+        for name, batches in groups.items():
+            last = dict(self.committed.get(name, {}))
+            kept = []
+            for batch in batches:
+                if batch.writer:
+                    if batch.batch_id <= last.get(batch.writer, 0):
+                        continue
+                    last[batch.writer] = batch.batch_id
+                kept.append(batch)
+            if len(kept) < len(batches):
+                logger.info(f"Skipped {len(batches) - len(kept)} resent batches for {'/'.join(name)}")
+            if kept:
+                out[name] = kept
+        return out
+
+    def commit(self, name: tuple[str, str, str], batches: list[metric_pb2.MetricBatch]) -> None:
+        """書き込んだバッチの batch_id を記録する。lock を取った状態で呼ぶ"""
+        committed = self.committed.setdefault(name, {})
+        self.committed.move_to_end(name)
+        for batch in batches:
+            if batch.writer:
+                committed[batch.writer] = max(committed.get(batch.writer, 0), batch.batch_id)
+        while len(self.committed) > DEDUP_KEYS:
+            self.committed.popitem(last=False)
+
+    def write(
+        self, groups: dict[tuple[str, str, str], list[metric_pb2.MetricBatch]]
+    ) -> tuple[
+        list[MetricInfo],
+        dict[tuple[str, str, str], list[metric_pb2.MetricBatch]],
+        dict[tuple[str, str, str], Exception],
+    ]:
+        """(experiment, run, key) ごとにまとめたバッチを、ファイルごとに1回の書き込みで追記する（再送分は除く）
+
+        (MetricInfo, 実際に書いたバッチのグループ, 書き込めなかったグループ（壊れたファイルなど）の例外) を返す。
+        """
+        infos, written, errors = [], {}, {}
+        with self.lock:
+            for name, batches in self.fresh(groups).items():
+                try:
+                    handle = self.get(*name, batches[0].dim, storage_dtype(batches[0]))
+                    handle.write(batches)
+                except Exception as e:
+                    logger.exception(f"Failed to write metrics: {'/'.join(name)}")
+                    errors[name] = e
+                    # 状態が分からないハンドルは捨て、次の書き込みで開き直す
+                    if name in self.handles:
+                        with contextlib.suppress(Exception):
+                            self.handles.pop(name).close()
+                    continue
+                self.commit(name, batches)
+                written[name] = batches
+                infos.append(handle.info(*name))
+        return infos, written, errors
+
+    def close_run(self, experiment_id: str, run_uuid: str) -> list[MetricInfo]:
+        """run のハンドルを閉じ、閉じた時点の MetricInfo を返す"""
+        infos = []
+        with self.lock:
+            for name in [name for name in self.handles if name[:2] == (experiment_id, run_uuid)]:
+                handle = self.handles.pop(name)
+                handle.close()
+                infos.append(handle.info(*name))
+        return infos
+
+    def close(self) -> None:
+        with self.lock:
+            while self.handles:
+                self.handles.popitem()[1].close()
+
+
+if __name__ == "__main__":
+    pass
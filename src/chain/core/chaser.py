@@ -1,8 +1,16 @@
+import contextlib
+import itertools
+import json
 import logging
 import queue
 import threading
 import time
+import uuid
+from collections import Counter, deque
 from collections.abc import Generator
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, NamedTuple
 from urllib.parse import urlparse
 
 import grpc
@@ -13,114 +21,659 @@ from mlflow.tracking import MlflowClient
 
 from .. import settings
 from ..chaser_server import metric_pb2, metric_pb2_grpc
+from ..chaser_server.codec import Encoding, encode_batch, match_encoding, resolve_encodings
+from ..chaser_server.watch import parse_rules
+from .spool import SPOOL_DIR, ChaserSpool
+
+if TYPE_CHECKING:
+    import optuna
 
 logger = logging.getLogger(__name__)
 
 run_context = threading.local()
 
+sender: "ChaserSender | None" = None
+sender_lock = threading.Lock()
+
+BUFFER_BYTES = 256 * 1024 * 1024  # 送信バッファの上限 (bytes)
+BUFFER_POLICY = "drop_oldest"  # block | drop_oldest | sample（学習をメトリクスの送信で止めない）
+BLOCK_TIMEOUT = 10.0  # block でも空きを待つのはここまで（秒）。超えたら古いものから捨てる
+INFLIGHT_BYTES = 64 * 1024 * 1024  # 未 ACK バッチの上限 (bytes)
+BATCH_SIZE = 100  # run ごとのバッチ送信単位 (サンプル数)
+FLUSH_INTERVAL = 1.0  # 秒
+ACK_TIMEOUT = 40.0  # 秒
+COMPRESSIONS = {"gzip": grpc.Compression.Gzip, "deflate": grpc.Compression.Deflate}  # gRPC のメッセージ圧縮
+
+
+class Sample(NamedTuple):
+    key: str
+    value: Any  # log_metric に渡されたまま（ワーカーが to_vector で ndarray にする）
+    step: int | None  # None のときは key ごとの連番
+    timestamp: float  # UNIX 秒
+    nbytes: int  # 送信バッファでの勘定
+
+
+def value_nbytes(value: Any) -> int:
+    """コピーせずに値のバイト数を見積もる（ndarray / tensor / バッファプロトコル / スカラー・リスト）"""
+    if (nbytes := getattr(value, "nbytes", None)) is not None:
+        return int(nbytes)
+    try:
+        return memoryview(value).nbytes
+    except TypeError:
+        return 8 * len(value) if hasattr(value, "__len__") else 8
+
+
+def to_vector(value: Any) -> np.ndarray:
+    """値を1次元の ndarray にする。できる限りコピーせず、元のメモリを参照する
+
+    tensor は DLPack で受け取る（CPU 以外にあるものはここで .cpu() する）。
+    バッファプロトコルのオブジェクトは memoryview の形式のまま読む。
+    """
+    if hasattr(value, "__dlpack__") and not isinstance(value, np.ndarray):
+        if hasattr(value, "detach"):
+            value = value.detach()
+        if hasattr(value, "__dlpack_device__") and value.__dlpack_device__()[0] != 1 and hasattr(value, "cpu"):
+            value = value.cpu()  # kDLCPU = 1
+        return np.from_dlpack(value).reshape(-1)
+    if not isinstance(value, np.ndarray):
+        with contextlib.suppress(TypeError):
+            value = memoryview(value)
+    array: np.ndarray = np.asarray(value).reshape(-1)
+    if array.dtype.kind not in "biuf":
+        raise TypeError(f"Non-numeric metric value of dtype {array.dtype}")
+    return array
+
+
+class MetricBuffer:
+    """バイト数で上限を設けた送信バッファ（プロセス内の全 run で共有）
+
+    上限を超えたときの挙動:
+        block: 空きができるまで log_metric を待たせる（block_timeout 秒を超えたら古いサンプルから捨てる）
+        drop_oldest: 古いサンプルから捨てる
+        sample: バッファを1つおきに間引き、以降の受付間隔を2倍にする
+    サンプル数は owner (run_uuid) ごとに数える。
+    """
+
+    policies = ("block", "drop_oldest", "sample")
+
+    def __init__(
+        self, max_bytes: int = BUFFER_BYTES, policy: str = BUFFER_POLICY, block_timeout: float = BLOCK_TIMEOUT
+    ):
+        if policy not in self.policies:
+            raise ValueError(f"Unknown buffer policy: {policy} (expected one of {self.policies})")
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.overflowed = False  # block で待ちきれずに捨て始めたか（警告は溢れるたびに1回）
+
+        self.items: deque[tuple[str, Sample]] = deque()
+        self.nbytes = 0
+        self.cond = threading.Condition()
+        self.busy: str | None = None  # ワーカーが処理中のサンプルの owner
+
+        self.stride = 1  # sample ポリシーの受付間隔
+        self.tick = 0
+        self.logged: Counter[str] = Counter()
+        self.dropped: Counter[str] = Counter()
+
+    def put(self, owner: str, sample: Sample) -> None:
+        nbytes = sample.nbytes
+        with self.cond:
+            self.logged[owner] += 1
+            if self.policy == "sample":
+                self.tick += 1
+                if self.tick % self.stride:
+                    self.dropped[owner] += 1
+                    return
+            deadline = time.monotonic() + self.block_timeout
+            while self.items and self.nbytes + nbytes > self.max_bytes:
+                if self.policy == "block" and (remaining := deadline - time.monotonic()) > 0:
+                    self.cond.wait(remaining)
+                elif self.policy in ("block", "drop_oldest"):
+                    if self.policy == "block" and not self.overflowed:
+                        self.overflowed = True
+                        logger.warning(
+                            f"[AsyncBatchLogger] Send buffer stayed full for {self.block_timeout}s; "
+                            "dropping oldest samples"
+                        )
+                    old_owner, old = self.items.popleft()
+                    self.nbytes -= old.nbytes
+                    self.dropped[old_owner] += 1
+                else:
+                    self.thin()
+            self.items.append((owner, sample))
+            self.nbytes += nbytes
+            self.cond.notify_all()
+
+    def thin(self) -> None:
+        kept = deque(itertools.islice(self.items, 0, None, 2))
+        for owner, _ in itertools.islice(self.items, 1, None, 2):
+            self.dropped[owner] += 1
+        self.items = kept
+        self.nbytes = sum(sample.nbytes for _, sample in kept)
+        self.stride *= 2
+
+    def get(self, timeout: float | None = None) -> tuple[str, Sample]:
+        """先頭のサンプルを取り出す。処理が終わったら done() を呼ぶ"""
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.items, timeout=timeout):
+                raise queue.Empty
+            owner, sample = self.items.popleft()
+            self.nbytes -= sample.nbytes
+            if self.nbytes <= self.max_bytes // 4:
+                self.stride = 1
+                self.overflowed = False
+            self.busy = owner
+            self.cond.notify_all()
+            return owner, sample
+
+    def done(self) -> None:
+        with self.cond:
+            self.busy = None
+            self.cond.notify_all()
+
+    def take(self, owner: str) -> list[Sample]:
+        """owner のサンプルをすべて取り出す（ワーカーが処理中ならその完了を待つ）"""
+        with self.cond:
+            self.cond.wait_for(lambda: self.busy != owner)
+            taken = [sample for o, sample in self.items if o == owner]
+            self.items = deque(item for item in self.items if item[0] != owner)
+            self.nbytes -= sum(sample.nbytes for sample in taken)
+            self.cond.notify_all()
+            return taken
+
+    def pop_counts(self, owner: str) -> tuple[int, int]:
+        """owner の (logged, dropped) を返して破棄する"""
+        with self.cond:
+            return self.logged.pop(owner, 0), self.dropped.pop(owner, 0)
+
+
+class ChaserStream:
+    """長寿命の双方向ストリーム
+
+    送信はキューに積むだけで、ACK は受信スレッドが非同期に処理する。
+    ストリームが切れた場合は未 ACK のバッチを再送して再接続する。
+    """
+
+    def __init__(self, host: str, port: int, max_inflight_bytes: int = INFLIGHT_BYTES, compression: str | None = None):
+        self.target = f"{host}:{port}"
+        self.channel = grpc.insecure_channel(self.target, compression=COMPRESSIONS.get(compression or ""))
+        self.stub = metric_pb2_grpc.MetricServiceStub(self.channel)
+
+        self.seq = itertools.count(1)
+        self.pending: dict[int, metric_pb2.MetricBatch] = {}  # 未 ACK のバッチ
+        self.pending_bytes = 0
+        self.max_inflight_bytes = max_inflight_bytes
+        self.outbox: queue.Queue[metric_pb2.MetricBatch | None] = queue.Queue()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.healthy = True  # 直近の接続が生きているか
+        self.max_backoff = 30.0  # 秒
+        self.verdicts: dict[str, str] = {}  # run_uuid -> ACK で届いた監視ルールの判定
+        self.rejected: Counter[str] = Counter()  # run_uuid -> サーバが書き込めなかった行数
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def send(self, batch: metric_pb2.MetricBatch) -> int:
+        """バッチを送信キューに積み、通し番号を返す"""
+        with self.cond:
+            seq = next(self.seq)
+            batch.seq = seq
+            self.pending[seq] = batch
+            self.pending_bytes += len(batch.values)
+            self.outbox.put(batch)
+        return seq
+
+    def writable(self, timeout: float | None = None) -> bool:
+        """未 ACK のバイト数が上限未満になるまで待つ"""
+        with self.cond:
+            return self.cond.wait_for(lambda: self.pending_bytes < self.max_inflight_bytes, timeout=timeout)
+
+    def wait(self, seq: int, timeout: float | None = None) -> bool:
+        """seq 以前のバッチがすべて ACK されるまで待つ"""
+        with self.cond:
+            return self.cond.wait_for(lambda: not any(s <= seq for s in self.pending), timeout=timeout)
+
+    def take(self, run_uuid: str) -> list[metric_pb2.MetricBatch]:
+        """run の未 ACK バッチを送信対象から外して返す（スプールへ退避する用）"""
+        with self.cond:
+            seqs = sorted(seq for seq, batch in self.pending.items() if batch.run_uuid == run_uuid)
+            batches = [self.pending.pop(seq) for seq in seqs]
+            self.pending_bytes -= sum(len(batch.values) for batch in batches)
+            self.cond.notify_all()
+        return batches
+
+    def close(self) -> None:
+        with self.cond:
+            self.closed = True
+            self.outbox.put(None)
+        self.thread.join()
+        self.channel.close()
+
+    @staticmethod
+    def requests(outbox: queue.Queue[metric_pb2.MetricBatch | None]) -> Generator[metric_pb2.MetricBatch]:
+        while (batch := outbox.get()) is not None:
+            yield batch
+
+    def run(self) -> None:
+        backoff = 0.5
+        while not self.closed:
+            try:
+                grpc.channel_ready_future(self.channel).result(timeout=backoff)
+            except grpc.FutureTimeoutError:
+                self.healthy = False
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            self.healthy = True
+            with self.cond:
+                # 再接続時は未 ACK のバッチを順番通りに再送する
+                outbox = self.outbox = queue.Queue()
+                for seq in sorted(self.pending):
+                    outbox.put(self.pending[seq])
+            try:
+                for ack in self.stub.StreamBatches(self.requests(outbox)):
+                    with self.cond:
+                        if (batch := self.pending.pop(ack.seq, None)) is not None:
+                            self.pending_bytes -= len(batch.values)
+                            if ack.status == "error":
+                                # 送り直しても通らないので捨てる（スプールにも戻さない）
+                                self.rejected[batch.run_uuid] += batch.count
+                                logger.warning(
+                                    f"[ChaserStream] Batch {batch.run_uuid}/{batch.key} rejected: {ack.message}"
+                                )
+                            elif ack.verdict:
+                                self.verdicts.setdefault(batch.run_uuid, ack.verdict)
+                        self.cond.notify_all()
+                    backoff = 0.5
+            except grpc.RpcError as e:
+                self.healthy = False
+                logger.warning(f"[ChaserStream] Stream to {self.target} dropped: {e.details()}")
+            outbox.put(None)
+            if not self.closed:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+
+class ChaserSender:
+    """プロセス内の全 run で共有する送信器
+
+    1本のチャネル/ストリーム、1つの送信バッファとワーカースレッドで全 run を多重化する。
+    gRPC ポート・Experiment 名・HTTP セッションもプロセス内で使い回す。
+    """
+
+    def __init__(self) -> None:
+        options = settings.chaser_options
+        self.session = requests.Session()
+        self.http = ThreadPoolExecutor(max_workers=4, thread_name_prefix="chaser-http")
+        self.host, self.port = self.get_grpc_target()
+        compression = options.get("compression")
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression!r} (choose from {', '.join(COMPRESSIONS)})")
+        self.stream = ChaserStream(
+            self.host, self.port, options.get("inflight_bytes", INFLIGHT_BYTES), compression=compression
+        )
+        self.buffer = MetricBuffer(
+            max_bytes=options.get("buffer_bytes", BUFFER_BYTES),
+            policy=options.get("buffer_policy", BUFFER_POLICY),
+            block_timeout=options.get("block_timeout", BLOCK_TIMEOUT),
+        )
+        self.batch_size = options.get("batch_size", BATCH_SIZE)
+        self.flush_interval = options.get("flush_interval", FLUSH_INTERVAL)
+        self.spool_dir = Path(options.get("spool_dir", SPOOL_DIR)) if options.get("spool", False) else None
+        # key のパターンごとの値の符号化（{"acts/*": {"dtype": "float16", "delta": true, "codec": "zstd"}}）
+        self.encodings = resolve_encodings(options.get("encoding", {}))
+        self.key_encodings: dict[str, Encoding | None] = {}
+
+        self.runs: dict[str, ChaserActiveRun] = {}
+        self.ended: dict[str, ChaserActiveRun] = {}  # スプールを残して終わった run（replay スレッドが再送を続ける）
+        self.runs_lock = threading.Lock()
+        self.experiments: dict[str, str] = {}  # experiment_id -> name
+
+        threading.Thread(target=self.worker, daemon=True).start()
+        if self.spool_dir is not None:
+            threading.Thread(target=self.replay, daemon=True).start()
+
+    def encoding(self, key: str) -> Encoding | None:
+        """key の符号化（パターンの照合は key ごとに1回だけ）"""
+        if key not in self.key_encodings:
+            self.key_encodings[key] = match_encoding(self.encodings, key)
+        return self.key_encodings[key]
+
+    def get_grpc_target(self) -> tuple[str, int]:
+        """chaser サーバの gRPC (host, port) を取得"""
+        url = f"{settings.chaser_uri}/grpc"
+        response = self.session.get(url, timeout=40)
+        response.raise_for_status()
+        port_info = response.json()  # or res.text if it's just a number
+        port = port_info["port"] if isinstance(port_info, dict) else int(port_info)
+
+        uri = settings.chaser_uri.rstrip("/")
+        parsed = urlparse(uri)
+        return parsed.hostname, int(port)
+
+    def get_experiment_name(self, experiment_id: str) -> str:
+        if experiment_id not in self.experiments:
+            self.experiments[experiment_id] = MlflowClient().get_experiment(experiment_id).name
+        return self.experiments[experiment_id]
+
+    def post(self, path: str, data: dict[str, Any] | None = None) -> None:
+        response = self.session.post(f"{settings.chaser_uri}{path}", data=data, timeout=40)
+        response.raise_for_status()
+
+    def add(self, run: "ChaserActiveRun") -> None:
+        with self.runs_lock:
+            self.runs[run.run_uuid] = run
+
+    def remove(self, run: "ChaserActiveRun") -> bool:
+        """run を外す。スプールが残っていれば再送を続ける対象に移して True を返す"""
+        with self.runs_lock:
+            self.runs.pop(run.run_uuid, None)
+            if run.spool is not None and run.spool.active:
+                self.ended[run.run_uuid] = run
+                return True
+            return False
+
+    def active_runs(self) -> list["ChaserActiveRun"]:
+        with self.runs_lock:
+            return list(self.runs.values())
+
+    def worker(self) -> None:
+        last_sweep = time.time()
+        while True:
+            # 未 ACK が溜まっている間はバッファを消費せず、バッファ側で溢れを処理させる
+            # スプール有効時は送れない分をディスクに逃がすので待たない
+            spooling = self.spool_dir is not None and not self.stream.healthy
+            if spooling or self.stream.writable(timeout=0.2):
+                try:
+                    owner, sample = self.buffer.get(timeout=0.2)
+                except queue.Empty:
+                    pass
+                else:
+                    try:
+                        if (run := self.runs.get(owner)) is not None:
+                            run.append(sample)
+                    finally:
+                        self.buffer.done()
+
+            now = time.time()
+            if now - last_sweep >= 0.2:
+                for run in self.active_runs():
+                    run.flush_if_due(now)
+                last_sweep = now
+
+    def replay(self) -> None:
+        """接続回復後、スプールのある run を順番通りに再送する（終わった run は再送し終えたら end_run を送る）"""
+        while True:
+            with self.runs_lock:
+                runs = [run for run in (*self.runs.values(), *self.ended.values()) if run.spool and run.spool.active]
+            if not (runs and self.stream.healthy):
+                time.sleep(0.5)
+                continue
+            for run in runs:
+                run.replay()
+                if not (run.spool and run.spool.active) and self.ended.pop(run.run_uuid, None) is not None:
+                    logger.info(f"[AsyncBatchLogger] Sending deferred end_run of {run.run_uuid}")
+                    try:
+                        run.post_end()
+                    except requests.RequestException as e:
+                        logger.warning(f"[AsyncBatchLogger] Failed to send end_run of {run.run_uuid}: {e}")
+
+
+def get_sender() -> ChaserSender:
+    global sender
+    with sender_lock:
+        if sender is None:
+            sender = ChaserSender()
+        return sender
+
 
 class ChaserActiveRun:
-    def __init__(self, run: mlflow.ActiveRun):
+    def __init__(self, run: mlflow.ActiveRun, sender: ChaserSender, watch: list[dict[str, Any]] | None = None):
         self.run = run
+        self.sender = sender
+        self.stream = sender.stream
 
         self.prj_id = settings.prj_id
         self.experiment_id = self.run.info.experiment_id
-        self.experiment_name = MlflowClient().get_experiment(self.experiment_id).name
+        self.experiment_name = sender.get_experiment_name(self.experiment_id)
         self.parent = self.run.data.tags.get("mlflow.parentRunId")
         self.run_name = self.run.info.run_name
         self.run_uuid = self.run.info.run_uuid
 
-        self.batch: list[metric_pb2.MetricRequest] = []  # バッチバッファ
-        self.batch_size = 100  # バッチ送信単位
-        self.flush_interval = 1.0  # 秒
+        self.lock = threading.RLock()
+        self.batch: dict[str, list[Sample]] = {}  # key ごとのバッチバッファ
+        self.dims: dict[str, int] = {}
+        self.steps: dict[str, int] = {}  # key ごとの直近の step
+        self.n_samples = 0
         self.last_flush = time.time()
-
-        self.queue = queue.Queue()
-        self.stop_event = threading.Event()
-
-    def setup(self, host: str, port: int) -> None:
-        self.host = host
-        self.port = port
-        self.channel = grpc.insecure_channel(f"{self.host}:{self.port}")
-        self.stub = metric_pb2_grpc.MetricServiceStub(self.channel)
-        self.worker_thread = threading.Thread(target=self.worker, daemon=True)
-        self.worker_thread.start()
-
-    def log_metric(self, key: str, value: np.ndarray) -> None:
-        """メトリクスを送信キューに登録"""
-        self.queue.put((key, value))
-
-    def worker(self):
-        while not self.stop_event.is_set():
-            try:
-                key, value = self.queue.get(timeout=0.2)
-                self.batch.append(
-                    metric_pb2.MetricRequest(
-                        prj_id=self.prj_id,
-                        experiment_id=self.experiment_id,
-                        run_uuid=self.run_uuid,
-                        key=key,
-                        dim=len(value),
-                        value=value.astype(np.float32).tobytes(),
-                    )
-                )
-
-                now = time.time()
-                if len(self.batch) >= self.batch_size or (now - self.last_flush) >= self.flush_interval:
-                    self.send_batch()
-                    self.last_flush = now
-
-            except queue.Empty:
-                now = time.time()
-                if self.batch and (now - self.last_flush) >= self.flush_interval:
-                    self.send_batch()
-                    self.last_flush = now
+        self.last_seq = 0
+        # 再送（再接続・スプール）で同じバッチが2度書かれないよう、サーバはこの2つで重複を除く
+        self.writer = uuid.uuid4().hex
+        self.batch_ids = itertools.count(1)
+        self.deadline = 0.0
+        self.logged = 0
+        self.dropped = 0
+        self.registration: Future[None] | None = None
+        self.end_deferred = False  # end_run はスプールを再送し終えてから replay スレッドが送る
+        # 受信時に判定してもらう監視ルール（不正な指定はここで ValueError）
+        watch = settings.chaser_options.get("watch", []) if watch is None else watch
+        self.watch = [rule._asdict() for rule in parse_rules(watch)]
+
+        self.spool: ChaserSpool | None = None
+        self.replay_lock = threading.Lock()
+        if sender.spool_dir is not None:
+            self.spool = ChaserSpool.for_run(self.experiment_id, self.run_uuid, sender.spool_dir)
+
+    @property
+    def info(self) -> dict[str, Any]:
+        return {"experiment_name": self.experiment_name, "parent": self.parent, "run_name": self.run_name}
+
+    def start(self) -> None:
+        """run を登録して送信器に参加する（サーバへの登録は非同期）"""
+        path = f"/start_run/{settings.prj_id}/{self.experiment_id}/{self.run_uuid}"
+        data = {**self.info, "watch": json.dumps(self.watch)} if self.watch else self.info
+        self.registration = self.sender.http.submit(self.sender.post, path, data)
+        self.sender.add(self)
+
+    @property
+    def verdict(self) -> str | None:
+        """監視ルールに掛かっていればその理由（サーバが書き込んだバッチの ACK で届く）"""
+        return self.stream.verdicts.get(self.run_uuid)
+
+    def log_metric(self, key: str, value: Any, step: int | None = None, timestamp: float | None = None) -> None:
+        """メトリクスを送信バッファに登録（値は参照を積むだけで、変換・コピーはワーカーが行う）
+
+        tensor はここで detach する（コピーはしない）。送るまで autograd のグラフや活性化を抱え込まないように。
+        """
+        if hasattr(value, "detach"):
+            value = value.detach()
+        timestamp = time.time() if timestamp is None else timestamp
+        self.sender.buffer.put(self.run_uuid, Sample(key, value, step, timestamp, value_nbytes(value)))
+
+    def append(self, sample: Sample) -> None:
+        """サンプルを key ごとのバッファに追加"""
+        key = sample.key
+        try:
+            value = to_vector(sample.value)
+        except (TypeError, ValueError, RuntimeError, BufferError) as e:
+            logger.warning(f"[AsyncBatchLogger] Unsupported value for '{key}' ({type(sample.value).__name__}): {e}")
+            return
+        dim = len(value)
+        sample = sample._replace(value=value)
+        with self.lock:
+            if self.dims.setdefault(key, dim) != dim:
+                logger.warning(f"[AsyncBatchLogger] Dimension mismatch for '{key}': {dim} != {self.dims[key]}")
+                return
+            step = self.steps.get(key, -1) + 1 if sample.step is None else sample.step
+            self.steps[key] = step
+            self.batch.setdefault(key, []).append(sample._replace(step=step))
+            self.n_samples += 1
+            if self.n_samples >= self.sender.batch_size:
+                self.send_batch()
+
+    def flush_if_due(self, now: float) -> None:
+        with self.lock:
+            if self.batch and (now - self.last_flush) >= self.sender.flush_interval:
+                self.send_batch()
+
+    def build_batches(self) -> list[metric_pb2.MetricBatch]:
+        """(run, key) ごとにヘッダ1つ + 連結した値バッファのバッチを作る（key に符号化の指定があれば符号化する）"""
+        batches = [
+            metric_pb2.MetricBatch(
+                prj_id=self.prj_id,
+                experiment_id=self.experiment_id,
+                run_uuid=self.run_uuid,
+                key=key,
+                dim=self.dims[key],
+                count=len(samples),
+                writer=self.writer,
+                batch_id=next(self.batch_ids),
+                # float32 の値はそのままバッファとして連結する（型の違うものだけ変換でコピー）
+                values=b"".join(np.ascontiguousarray(sample.value, dtype=np.float32) for sample in samples),
+                steps=np.fromiter((sample.step for sample in samples), np.int64, len(samples)).tobytes(),
+                timestamps=np.fromiter((sample.timestamp for sample in samples), np.float64, len(samples)).tobytes(),
+            )
+            for key, samples in self.batch.items()
+        ]
+        return [
+            batch if (encoding := self.sender.encoding(batch.key)) is None else encode_batch(batch, encoding)
+            for batch in batches
+        ]
+
+    def spooling(self) -> bool:
+        return self.spool is not None and (self.spool.active or not self.stream.healthy)
 
     def send_batch(self) -> None:
+        """バッチをストリームに積む（ACK は待たない）。送れない間はスプールに追記する"""
+        batches = self.build_batches()
+        self.batch.clear()
+        self.n_samples = 0
+        self.last_flush = time.time()
+        if self.spool is not None:
+            with self.spool.lock:
+                # 順序を保つため、スプールに残りがある間は後続もスプールへ
+                if self.spooling():
+                    self.spool.write(batches)
+                    return
+        for batch in batches:
+            self.last_seq = self.stream.send(batch)
+
+    def remaining(self) -> float:
+        return self.deadline - time.time() if self.deadline else ACK_TIMEOUT
+
+    def replay(self) -> None:
+        """直接送ったバッチが ACK されてから、スプールを再送する（順序を保つ）"""
+        with self.replay_lock:
+            if (
+                self.spool is not None
+                and self.spool.active
+                and self.remaining() > 0
+                and self.stream.wait(self.last_seq, timeout=0.5)
+            ):
+                self.replay_chunk()
+
+    def replay_chunk(self, max_bytes: int = 4 * 1024 * 1024) -> None:
+        """スプールを max_bytes 程度ずつ再送し、ACK された位置までコミットする"""
+        if (spool := self.spool) is None:
+            return
+        start = end = spool.offset
+        seq = 0
+        for offset, batch in spool.read():
+            if not self.wait_writable():
+                break
+            seq = self.stream.send(batch)
+            end = offset
+            if end - start >= max_bytes:
+                break
+        if end == start or not self.stream.wait(seq, timeout=max(self.remaining(), 0)):
+            return
+        with spool.lock:
+            spool.commit(end)
+            if spool.exhausted():
+                spool.clear()
+                logger.info(f"[AsyncBatchLogger] Replayed spool of run {self.run_uuid}")
+
+    def wait_writable(self) -> bool:
+        while not self.stream.writable(timeout=0.5):
+            if not self.stream.healthy or self.remaining() <= 0:
+                return False
+        return True
+
+    def persist(self) -> None:
+        """未 ACK のバッチとスプールの残りをディスクに残す（`chain flush chaser` で再送）"""
+        # last_seq 以降の未 ACK はスプールからの再送分なので、スプール側を正とする
+        head = [batch for batch in self.stream.take(self.run_uuid) if batch.seq <= self.last_seq]
+        if (spool := self.spool) is None:
+            return
+        with spool.lock:
+            if head or spool.active:
+                spool.rewrite(head)
+        if spool.active:
+            spool.write_meta(self.info)
+            logger.warning(f"[AsyncBatchLogger] Unsent metrics of run {self.run_uuid} spooled to {spool.path}")
+
+    def post_end(self) -> None:
+        """サーバに run の終了を知らせる（届かなければスプールと一緒に `chain flush chaser` へ回す）"""
+        path = f"/end_run/{settings.prj_id}/{self.experiment_id}/{self.run_uuid}"
+        data = {"dropped": self.dropped, "retained": self.logged - self.dropped}
         try:
-
-            def generator() -> Generator[metric_pb2.MetricRequest]:
-                for req in self.batch:
-                    yield req
-
-            self.stub.SendMetrics(generator())  # ストリーミング送信
-            self.batch.clear()
-        except grpc.RpcError as e:
-            logger.warning(f"[AsyncBatchLogger] Batch send failed: {e.details()}")
+            if self.registration is not None:
+                self.registration.result()
+            self.sender.post(path, data)
+        except requests.RequestException:
+            if self.spool is None or not self.spool.active:
+                raise
+            logger.warning(f"[AsyncBatchLogger] end_run of {self.run_uuid} deferred to `chain flush chaser`")
 
     def stop(self) -> None:
-        """バックグラウンドスレッドの停止"""
-        self.send_batch()
-        self.stop_event.set()
-        self.worker_thread.join()
-
-
-def get_run_stack():
+        """送信バッファに残った分を送り、ACK を待つ"""
+        self.deadline = time.time() + ACK_TIMEOUT
+        remains = self.sender.buffer.take(self.run_uuid)
+        with self.lock:
+            for sample in remains:
+                self.append(sample)
+            self.send_batch()
+        if self.spool is not None:
+            # 再接続中でも ACK_TIMEOUT までは待つ（接続が戻れば replay スレッドが直接送った分の後にスプールを流す）
+            while self.spool.active and self.remaining() > 0:
+                time.sleep(0.1)
+        if not self.stream.wait(self.last_seq, timeout=max(self.remaining(), 0)):
+            logger.warning(f"[AsyncBatchLogger] Timed out waiting for acks of run {self.run_uuid}")
+        if self.spool is not None:
+            with self.replay_lock:
+                self.persist()
+                # 残ったスプールはこのプロセスが生きている間 replay スレッドが期限なしで再送し続ける
+                self.deadline = 0.0
+        self.stream.verdicts.pop(self.run_uuid, None)
+
+        self.logged, self.dropped = self.sender.buffer.pop_counts(self.run_uuid)
+        if self.dropped:
+            logger.warning(
+                f"[AsyncBatchLogger] Run {self.run_uuid}: dropped {self.dropped} of {self.logged} samples "
+                f"(policy={self.sender.buffer.policy})"
+            )
+        if rejected := self.stream.rejected.pop(self.run_uuid, 0):
+            logger.warning(f"[AsyncBatchLogger] Run {self.run_uuid}: server rejected {rejected} rows")
+        self.end_deferred = self.sender.remove(self)
+
+
+def get_run_stack() -> list[ChaserActiveRun]:
     if not hasattr(run_context, "stack"):
         run_context.stack = []
-    return run_context.stack
+    stack: list[ChaserActiveRun] = run_context.stack
+    return stack
+
 
+def start_run(watch: list[dict[str, Any]] | None = None) -> None:
+    """chaser の run を始める。watch は受信時の監視ルール（省略時は chaser_options の watch）
 
-def start_run() -> None:
+    例: [{"key": "*", "kind": "nonfinite"}, {"key": "loss", "kind": "plateau", "patience": 2000}]
+    """
     if (mlflow_run := mlflow.active_run()) is None:
         raise RuntimeError
-    run = ChaserActiveRun(mlflow_run)
-
-    url = f"{settings.chaser_uri}/start_run/{settings.prj_id}/{run.experiment_id}/{run.run_uuid}"
-    data = {"experiment_name": run.experiment_name, "parent": run.parent, "run_name": run.run_name}
-    response = requests.post(url, data=data, timeout=40)
-    response.raise_for_status()
-
-    url = f"{settings.chaser_uri}/grpc"
-    response = requests.get(url, timeout=40)
-    response.raise_for_status()
-    port_info = response.json()  # or res.text if it's just a number
-    port = port_info["port"] if isinstance(port_info, dict) else int(port_info)
-
-    uri = settings.chaser_uri.rstrip("/")
-    parsed = urlparse(uri)
-
-    run.setup(parsed.hostname, port)
+    run = ChaserActiveRun(mlflow_run, get_sender(), watch)
+    run.start()
 
     run_stack = get_run_stack()
     run_stack.append(run)
@@ -130,16 +683,42 @@ def end_run() -> None:
     run_stack = get_run_stack()
     run = run_stack.pop()
     run.stop()
+    if not run.end_deferred:
+        run.post_end()
 
-    url = f"{configs.chaser_uri}/end_run/{configs.prj_id}/{run.experiment_id}/{run.run_uuid}"
-    response = requests.post(url, timeout=40)
-    response.raise_for_status()
 
+def log_metric(key: str, value: Any, step: int | None = None, timestamp: float | None = None) -> None:
+    """メトリクスを記録する。step 省略時は key ごとの連番、timestamp 省略時は現在時刻
 
-def log_metric(key: str, value: np.ndarray) -> None:
+    value は ndarray・tensor・バッファプロトコルのオブジェクト・スカラー・リスト。コピーせずに参照を積むので、
+    送信されるまで（通常は flush_interval 以内）書き換えないこと。
+    """
     run_stack = get_run_stack()
     run = run_stack[-1]
-    run.log_metric(key, value)
+    run.log_metric(key, value, step, timestamp)
+
+
+def verdict() -> str | None:
+    """今の run が監視ルールに掛かっていればその理由"""
+    return get_run_stack()[-1].verdict
+
+
+def report(trial: "optuna.trial.Trial", value: float | None = None, step: int | None = None) -> None:
+    """Optuna の trial に value を step で report し、止めるべきなら optuna.TrialPruned を送出する
+
+    chaser の監視ルールに掛かったとき（NaN や発散など）と、Optuna の pruner が止めると判断したときに止める。
+    """
+    import optuna
+
+    if value is not None:
+        if step is None:
+            raise ValueError("step is required to report a value")
+        trial.report(value, step)
+    if (reason := verdict()) is not None:
+        trial.set_user_attr("chaser_verdict", reason)
+        raise optuna.TrialPruned(reason)
+    if value is not None and trial.should_prune():
+        raise optuna.TrialPruned(f"Pruned at step {step}")
 
 
 if __name__ == "__main__":
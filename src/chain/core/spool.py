@@ -0,0 +1,119 @@
+import json
+import os
+import struct
+import threading
+from collections.abc import Generator, Iterable
+from pathlib import Path
+from typing import Any
+
+from ..chaser_server import metric_pb2
+
+SPOOL_DIR = Path(".chaser/spool")
+RECORD_HEADER = struct.Struct("<I")  # レコード長 (シリアライズ済み MetricBatch)
+
+
+class ChaserSpool:
+    """run ごとの追記専用スプールファイル
+
+    送信できなかった MetricBatch を長さ付きレコードとして追記し、
+    再送済みの位置を `.offset` に記録する。`.pid` は書き込み中のプロセス、
+    `.json` は後から run を登録し直すための情報。
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.offset_path = path.with_suffix(".offset")
+        self.pid_path = path.with_suffix(".pid")
+        self.meta_path = path.with_suffix(".json")
+        self.lock = threading.Lock()
+        self.active = self.path.exists()
+        self.offset = int(self.offset_path.read_text()) if self.offset_path.exists() else 0
+
+    @classmethod
+    def for_run(cls, experiment_id: str, run_uuid: str, spool_dir: Path = SPOOL_DIR) -> "ChaserSpool":
+        return cls(Path(spool_dir) / experiment_id / f"{run_uuid}.spool")
+
+    def write(self, batches: Iterable[metric_pb2.MetricBatch]) -> None:
+        """バッチを末尾に追記（lock は呼び出し側で取る）"""
+        if not self.active:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.pid_path.write_text(str(os.getpid()))
+        with open(self.path, "ab") as f:
+            for batch in batches:
+                data = batch.SerializeToString()
+                f.write(RECORD_HEADER.pack(len(data)) + data)
+        self.active = True
+
+    def read(self, offset: int | None = None) -> Generator[tuple[int, metric_pb2.MetricBatch]]:
+        """offset 以降のレコードを (次の offset, バッチ) の順に返す。途中で切れたレコードは無視する"""
+        offset = self.offset if offset is None else offset
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            while len(head := f.read(RECORD_HEADER.size)) == RECORD_HEADER.size:
+                (size,) = RECORD_HEADER.unpack(head)
+                data = f.read(size)
+                if len(data) < size:
+                    return
+                offset += RECORD_HEADER.size + size
+                yield offset, metric_pb2.MetricBatch.FromString(data)
+
+    def commit(self, offset: int) -> None:
+        """offset までの再送完了を記録"""
+        tmp = self.offset_path.with_name(self.offset_path.name + ".tmp")
+        tmp.write_text(str(offset))
+        tmp.replace(self.offset_path)
+        self.offset = offset
+
+    def exhausted(self) -> bool:
+        return self.path.stat().st_size <= self.offset
+
+    def rewrite(self, head: Iterable[metric_pb2.MetricBatch]) -> None:
+        """未再送のレコードの前に head を挟んで書き直す（終了時に未 ACK 分を退避する用）"""
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp, "wb") as f:
+            for batch in head:
+                data = batch.SerializeToString()
+                f.write(RECORD_HEADER.pack(len(data)) + data)
+            if self.active:
+                with open(self.path, "rb") as src:
+                    src.seek(self.offset)
+                    while chunk := src.read(1 << 20):
+                        f.write(chunk)
+        if not self.active:
+            self.pid_path.write_text(str(os.getpid()))
+        tmp.replace(self.path)
+        self.commit(0)
+        self.active = True
+
+    def write_meta(self, meta: dict[str, Any]) -> None:
+        self.meta_path.write_text(json.dumps(meta))
+
+    def read_meta(self) -> dict[str, Any] | None:
+        return json.loads(self.meta_path.read_text()) if self.meta_path.exists() else None
+
+    def clear(self) -> None:
+        for path in (self.path, self.offset_path, self.pid_path, self.meta_path):
+            path.unlink(missing_ok=True)
+        self.offset = 0
+        self.active = False
+
+    def owner_alive(self) -> bool:
+        """スプールを書いているプロセスが生きているか"""
+        if not self.pid_path.exists():
+            return False
+        try:
+            os.kill(int(self.pid_path.read_text()), 0)
+        except (ProcessLookupError, ValueError):
+            return False
+        except PermissionError:
+            return True
+        return True
+
+
+def list_spools(spool_dir: Path = SPOOL_DIR) -> list[ChaserSpool]:
+    return [ChaserSpool(path) for path in sorted(Path(spool_dir).glob("*/*.spool"))]
+
+
+if __name__ == "__main__":
+    pass
@@ -1,50 +1,75 @@
 import asyncio
 import logging
+import math
 import os
 import uuid
 from pathlib import Path
 from threading import Thread
+from typing import Any
 
 import dash
-from chaser.server import chaser_grpc_server
+from chaser import metric_pb2
+from chaser.server import MetricService, chaser_grpc_server
+from chaser.watch import parse_rules
 from dash import Dash, Input, Output, State, html
-from dash.dependencies import MATCH
-from flask import request
+from dash.dependencies import ALL, MATCH
+from flask import Response, request
+from flask.typing import ResponseReturnValue
 
 from src.engine import (
+    LIVE_WINDOW,
+    MAX_POINTS,
     add_experiment,
     add_run,
     add_tag,
     check_prj_id,
     delete_plot_state,
+    generate_heatmap,
     generate_plot,
+    generate_sweep_plot,
+    get_cache_stats,
+    get_dim,
     get_plot_state,
+    get_push_status,
+    get_row_count,
+    get_run_table,
+    get_tail,
+    list_experiment_metrics,
     list_experiments,
     list_metrics,
     list_runs_hierarchy,
-    push_all_to_s3,
+    list_sweep_metrics,
     save_plot_state,
+    schedule_push,
+    start_cache_eviction,
+    upsert_metrics,
 )
+from src.export import FORMATS, export_stream, parse_dims, plan_export
 from src.layout import get_layout, get_run_list
 from src.plot import plot_card
+from src.transform import parse_transform
 
 logger = logging.getLogger(__name__)
 DATA_DIR = Path("/data/experiments")
+METRIC_TIMEOUT = 30.0  # /metric の書き込みを待つ秒数
 
 app = Dash(__name__, suppress_callback_exceptions=True)
 server = app.server
 app.title = "Chaser Dashboard"
 app.layout = get_layout()
+# 全 run 共通の監視ルール (JSON)。例: [{"key": "*", "kind": "nonfinite"}]
+metric_service = MetricService(on_update=upsert_metrics, watch_rules=parse_rules(os.getenv("CHASER_WATCH")))
 
 
 def start_grpc_background() -> None:
     def start() -> None:
-        asyncio.run(chaser_grpc_server(host="0.0.0.0", port=14000))
+        asyncio.run(chaser_grpc_server(host="0.0.0.0", port=14000, service=metric_service))
 
     Thread(target=start, daemon=True).start()
 
 
 start_grpc_background()
+start_cache_eviction(metric_service.handles)
 
 
 ##########################################
@@ -54,7 +79,7 @@ start_grpc_background()
     Output("experiment-dropdown", "options"),
     Input("reload-experiment-list", "n_intervals"),
 )
-def update_experiment_list(n_intervals: int) -> list:
+def update_experiment_list(n_intervals: int) -> list[dict[str, Any]]:
     return [{"label": exp["name"], "value": exp["id"]} for exp in list_experiments()]
 
 
@@ -132,13 +157,64 @@ def update_button_style(is_disabled):
 ##########################################
 # 図
 ##########################################
+# 図の描画幅をブラウザから取得（左ペインと余白を除く）
+app.clientside_callback(
+    "function(run) { return Math.max(window.innerWidth - 360, 300); }",
+    Output("viewport-width", "data"),
+    Input("selected-run", "data"),
+)
+
+
+def parse_step_range(relayout: dict[str, Any] | None) -> tuple[int | None, int | None] | None:
+    """relayoutData から x 軸 (step) の表示範囲を取り出す。x 軸が変わっていなければ None"""
+    if not relayout:
+        return None
+    if relayout.get("xaxis.autorange"):
+        return None, None
+    if "xaxis.range[0]" in relayout and "xaxis.range[1]" in relayout:
+        low, high = relayout["xaxis.range[0]"], relayout["xaxis.range[1]"]
+    elif "xaxis.range" in relayout:
+        low, high = relayout["xaxis.range"]
+    else:
+        return None
+    return math.floor(low), math.ceil(high)
+
+
+def plot_offset(figure: dict[str, Any], row: int) -> dict[str, Any]:
+    """ライブ追従の起点: 図に含めた行数と、追記先の trace（min/max の帯以外）"""
+    return {"row": row, "traces": [i for i, trace in enumerate(figure["data"]) if trace.name]}
+
+
+def render_plot(
+    experiment_id: int,
+    run_id: str,
+    metric: str,
+    plot_type: str,
+    n_dim: int,
+    dim: int,
+    step_range: tuple[int | None, int | None],
+    width: int | None,
+    transform: str | None,
+    param: Any,
+) -> dict[str, Any]:
+    """plot の種類に合わせて図を作る（heatmap は全次元を1枚に描き、dim と変換は使わない）"""
+    if plot_type == "heatmap":
+        return generate_heatmap(experiment_id, run_id, metric, step_range, width or MAX_POINTS)
+    transform = parse_transform(transform, param)
+    return generate_plot(experiment_id, run_id, metric, n_dim, dim, step_range, width or MAX_POINTS, transform)
+
+
 # 図一覧を DB から取得して描画
 @app.callback(
     Output("plots-container", "children"),
     Input("selected-run", "data"),
     State("experiment-dropdown", "value"),
+    State("viewport-width", "data"),
+    State("live-follow", "value"),
 )
-def update_all_plots(selected_run, experiment_id):
+def update_all_plots(
+    selected_run: str | None, experiment_id: int | None, width: int | None, live: list[str]
+) -> list[Any]:
     if not selected_run or not experiment_id:
         return []
     try:
@@ -156,7 +232,12 @@ def update_all_plots(selected_run, experiment_id):
         options = metrics_list[0].get("option", {})  # dict
         n_dim = options.get("n_dim", 1)
         dim = options.get("dim", 1)
-        figure = generate_plot(experiment_id, selected_run, metric, n_dim, dim)
+        transform, param = options.get("transform"), options.get("param")
+        plot_type = plot.get("type", "lines")
+        row = get_row_count(experiment_id, selected_run, metric)
+        figure = render_plot(
+            experiment_id, selected_run, metric, plot_type, n_dim, dim, (None, None), width, transform, param
+        )
         if metric:
             children.append(
                 plot_card(
@@ -166,17 +247,25 @@ def update_all_plots(selected_run, experiment_id):
                     metric=metric,
                     n_dim=n_dim,
                     dim=dim,
+                    offset=plot_offset(figure, row),
+                    live=bool(live),
+                    transform=transform,
+                    param=param,
+                    plot_type=plot_type,
                 )
             )
     return children
 
 
-# プロットの内容を更新（metric or dimが変化したとき）
+# プロットの内容を更新（metric, dim, 変換, 図の種類が変化したとき）
 @app.callback(
     Output({"type": "plot-update-dummy", "index": MATCH}, "children"),
     [
         Input({"type": "metric-dropdown", "index": MATCH}, "value"),
         Input({"type": "dim-input", "index": MATCH}, "value"),
+        Input({"type": "transform-dropdown", "index": MATCH}, "value"),
+        Input({"type": "transform-param", "index": MATCH}, "value"),
+        Input({"type": "plot-type", "index": MATCH}, "value"),
     ],
     [
         State({"type": "plot-graph", "index": MATCH}, "id"),
@@ -185,17 +274,228 @@ def update_all_plots(selected_run, experiment_id):
     ],
     prevent_initial_call=True,
 )
-def update_plot(selected_metric, selected_dim, plot_info, experiment_id, selected_run):
+def update_plot(
+    selected_metric: str,
+    selected_dim: int,
+    transform: str | None,
+    param: Any,
+    plot_type: str,
+    plot_info: dict[str, Any] | None,
+    experiment_id: int | None,
+    selected_run: str | None,
+) -> str:
     if not (plot_info and experiment_id and selected_run):
-        raise dash.exceptions.PreventUpdates
+        raise dash.exceptions.PreventUpdate
     try:
         plot_id = plot_info["index"]
-        save_plot_state(experiment_id, selected_run, plot_id, selected_metric, selected_dim)
+        save_plot_state(
+            experiment_id, selected_run, plot_id, selected_metric, selected_dim, transform, param, plot_type
+        )
     except Exception:
         logger.exception("Failed to update plot state")
     return ""
 
 
+# ズーム・パンしたら表示範囲に合う詳細度で描き直す（変換や図の種類を変えたときは今の表示範囲のまま描き直す）
+@app.callback(
+    Output({"type": "plot-graph", "index": MATCH}, "figure"),
+    Output({"type": "plot-offset", "index": MATCH}, "data"),
+    Input({"type": "plot-graph", "index": MATCH}, "relayoutData"),
+    Input({"type": "transform-dropdown", "index": MATCH}, "value"),
+    Input({"type": "transform-param", "index": MATCH}, "value"),
+    Input({"type": "plot-type", "index": MATCH}, "value"),
+    [
+        State({"type": "metric-dropdown", "index": MATCH}, "value"),
+        State({"type": "dim-input", "index": MATCH}, "value"),
+        State("experiment-dropdown", "value"),
+        State("selected-run", "data"),
+        State("viewport-width", "data"),
+    ],
+    prevent_initial_call=True,
+)
+def zoom_plot(
+    relayout: dict[str, Any] | None,
+    transform: str | None,
+    param: Any,
+    plot_type: str,
+    metric: str | None,
+    dim: int | None,
+    experiment_id: int | None,
+    selected_run: str | None,
+    width: int | None,
+) -> tuple[dict[str, Any], dict[str, Any]]:
+    step_range = parse_step_range(relayout)
+    if dash.ctx.triggered_id and dash.ctx.triggered_id["type"] != "plot-graph":
+        step_range = step_range or (None, None)
+    if step_range is None or not (metric and experiment_id and selected_run):
+        raise dash.exceptions.PreventUpdate
+    n_dim = get_dim(experiment_id, selected_run, metric)
+    dim = max(1, min(dim or 1, n_dim))
+    row = get_row_count(experiment_id, selected_run, metric)
+    figure = render_plot(
+        experiment_id, selected_run, metric, plot_type, n_dim, dim, step_range, width, transform, param
+    )
+    return figure, plot_offset(figure, row)
+
+
+@app.callback(
+    Output({"type": "live-interval", "index": ALL}, "disabled"),
+    Input("live-follow", "value"),
+    State({"type": "live-interval", "index": ALL}, "id"),
+)
+def toggle_live(live: list[str], interval_ids: list[dict[str, Any]]) -> list[bool]:
+    return [not live] * len(interval_ids)
+
+
+# ライブ追従: 前回の続きから追記された行だけを extendData で送る
+@app.callback(
+    Output({"type": "plot-graph", "index": MATCH}, "extendData"),
+    Output({"type": "plot-offset", "index": MATCH}, "data", allow_duplicate=True),
+    Input({"type": "live-interval", "index": MATCH}, "n_intervals"),
+    [
+        State({"type": "plot-offset", "index": MATCH}, "data"),
+        State({"type": "metric-dropdown", "index": MATCH}, "value"),
+        State({"type": "transform-dropdown", "index": MATCH}, "value"),
+        State({"type": "transform-param", "index": MATCH}, "value"),
+        State("experiment-dropdown", "value"),
+        State("selected-run", "data"),
+    ],
+    prevent_initial_call=True,
+)
+def follow_plot(
+    n_intervals: int,
+    offset: dict[str, Any] | None,
+    metric: str | None,
+    transform: str | None,
+    param: Any,
+    experiment_id: int | None,
+    selected_run: str | None,
+) -> tuple[tuple[dict[str, Any], list[int], int], dict[str, Any]]:
+    if not (offset and offset["traces"] and metric and experiment_id and selected_run):
+        raise dash.exceptions.PreventUpdate
+    traces = offset["traces"]
+    transform = parse_transform(transform, param)
+    x, y, row = get_tail(experiment_id, selected_run, metric, offset["row"], len(traces), transform=transform)
+    if len(x) == 0:
+        raise dash.exceptions.PreventUpdate
+    data = {"x": [x] * len(traces), "y": [y[:, i] for i in range(len(traces))]}
+    return (data, traces, LIVE_WINDOW), {**offset, "row": row}
+
+
+# ライブ追従 (heatmap): 追記があれば今の表示範囲で描き直す（格子の大きさは変わらないので送る量も一定）
+@app.callback(
+    Output({"type": "plot-graph", "index": MATCH}, "figure", allow_duplicate=True),
+    Output({"type": "plot-offset", "index": MATCH}, "data", allow_duplicate=True),
+    Input({"type": "live-interval", "index": MATCH}, "n_intervals"),
+    [
+        State({"type": "plot-offset", "index": MATCH}, "data"),
+        State({"type": "plot-type", "index": MATCH}, "value"),
+        State({"type": "plot-graph", "index": MATCH}, "relayoutData"),
+        State({"type": "metric-dropdown", "index": MATCH}, "value"),
+        State("experiment-dropdown", "value"),
+        State("selected-run", "data"),
+        State("viewport-width", "data"),
+    ],
+    prevent_initial_call=True,
+)
+def follow_heatmap(
+    n_intervals: int,
+    offset: dict[str, Any] | None,
+    plot_type: str,
+    relayout: dict[str, Any] | None,
+    metric: str | None,
+    experiment_id: int | None,
+    selected_run: str | None,
+    width: int | None,
+) -> tuple[dict[str, Any], dict[str, Any]]:
+    if plot_type != "heatmap" or not (offset and metric and experiment_id and selected_run):
+        raise dash.exceptions.PreventUpdate
+    row = get_row_count(experiment_id, selected_run, metric)
+    if row == offset["row"]:
+        raise dash.exceptions.PreventUpdate
+    step_range = parse_step_range(relayout) or (None, None)
+    figure = generate_heatmap(experiment_id, selected_run, metric, step_range, width or MAX_POINTS)
+    return figure, plot_offset(figure, row)
+
+
+# run の一覧表: experiment のどれかの run が持つ metric を選べる
+@app.callback(
+    Output("run-table-container", "style"),
+    Output("table-metric", "options"),
+    Output("table-metric", "value"),
+    Input("experiment-dropdown", "value"),
+    State("table-metric", "value"),
+)
+def update_table_metrics(
+    experiment_id: int | None, metric: str | None
+) -> tuple[dict[str, str], list[dict[str, str]], str | None]:
+    metrics = list_experiment_metrics(experiment_id) if experiment_id else []
+    if not metrics:
+        return {"display": "none"}, [], None
+    metric = metric if metric in metrics else metrics[0]
+    return {"display": "block"}, [{"label": m, "value": m} for m in metrics], metric
+
+
+@app.callback(
+    Output("run-table", "data"),
+    Input("table-metric", "value"),
+    Input("table-dim", "value"),
+    Input("reload-experiment-list", "n_intervals"),
+    State("experiment-dropdown", "value"),
+)
+def update_run_table(
+    metric: str | None, dim: int | None, n_intervals: int, experiment_id: int | None
+) -> list[dict[str, Any]]:
+    if not (metric and experiment_id):
+        return []
+    return get_run_table(experiment_id, metric, dim or 1)
+
+
+# 子 run を持つ run を選んだら sweep の集計図を出す
+@app.callback(
+    Output("sweep-container", "style"),
+    Output("sweep-metric", "options"),
+    Output("sweep-metric", "value"),
+    Output("sweep-interval", "disabled"),
+    Input("selected-run", "data"),
+    State("experiment-dropdown", "value"),
+    State("sweep-metric", "value"),
+)
+def update_sweep_controls(
+    selected_run: str | None, experiment_id: int | None, metric: str | None
+) -> tuple[dict[str, str], list[dict[str, str]], str | None, bool]:
+    metrics = list_sweep_metrics(experiment_id, selected_run) if selected_run and experiment_id else []
+    if not metrics:
+        return {"display": "none"}, [], None, True
+    metric = metric if metric in metrics else metrics[0]
+    return {"display": "block"}, [{"label": m, "value": m} for m in metrics], metric, False
+
+
+@app.callback(
+    Output("sweep-graph", "figure"),
+    Input("sweep-metric", "value"),
+    Input("sweep-dim", "value"),
+    Input("sweep-goal", "value"),
+    Input("sweep-interval", "n_intervals"),
+    State("selected-run", "data"),
+    State("experiment-dropdown", "value"),
+    State("viewport-width", "data"),
+    prevent_initial_call=True,
+)
+def update_sweep_plot(
+    metric: str | None,
+    dim: int | None,
+    goal: str,
+    n_intervals: int,
+    selected_run: str | None,
+    experiment_id: int | None,
+    width: int | None,
+) -> dict[str, Any]:
+    if not (metric and selected_run and experiment_id):
+        raise dash.exceptions.PreventUpdate
+    return generate_sweep_plot(experiment_id, selected_run, metric, dim or 1, goal, width or MAX_POINTS)
+
+
 # プロットの追加／削除操作
 @app.callback(
     Output("add-dummy", "children"),
@@ -239,11 +539,17 @@ def delete_plot(n_clicks, btn_id, selected_run):
 
 
 @server.route("/start_run/<prj_id>/<experiment_id>/<run_uuid>", methods=["POST"])
-def start_run(prj_id: str, experiment_id: str, run_uuid: str) -> dict:
+def start_run(prj_id: str, experiment_id: str, run_uuid: str) -> ResponseReturnValue:
     check_prj_id(prj_id)
     parent = request.form.get("parent")
     exp_name = request.form.get("experiment_name")
     run_name = request.form.get("run_name")
+    try:
+        rules = parse_rules(request.form.get("watch"))
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}, 400
+    if rules:
+        metric_service.watcher.set_rules(experiment_id, run_uuid, rules)
     dir_path = DATA_DIR / experiment_id / run_uuid
     dir_path.mkdir(exist_ok=True, parents=True)
     add_experiment(experiment_id, exp_name)
@@ -254,32 +560,87 @@ def start_run(prj_id: str, experiment_id: str, run_uuid: str) -> dict:
 
 
 @server.route("/end_run/<prj_id>/<experiment_id>/<run_uuid>", methods=["POST"])
-def end_run(prj_id: str, experiment_id: str, run_uuid: str) -> dict:
+def end_run(prj_id: str, experiment_id: str, run_uuid: str) -> dict[str, Any]:
     check_prj_id(prj_id)
-    dir_path = DATA_DIR / experiment_id / run_uuid
-    push_all_to_s3(dir_path)
-    return {"status": "ok"}
+    dropped = int(request.form.get("dropped", 0))
+    if dropped:
+        retained = request.form.get("retained")
+        logger.warning(f"Run {run_uuid}: client dropped {dropped} samples ({retained} retained)")
+    metric_service.close_run(experiment_id, run_uuid)
+    # S3 への push はバックグラウンドで行う（状態は /push_status で見られる）
+    push = schedule_push(DATA_DIR / experiment_id / run_uuid)
+    return {"status": "ok", "push": push}
+
+
+@server.get("/push_status/<prj_id>/<experiment_id>/<run_uuid>")
+def push_status(prj_id: str, experiment_id: str, run_uuid: str) -> dict[str, Any]:
+    check_prj_id(prj_id)
+    return get_push_status(run_uuid)
 
 
 @server.route("/metric/<prj_id>/<experiment_id>/<run_uuid>", methods=["POST"])
-def save_metric(prj_id: str, experiment_id: str, run_uuid: str) -> dict:
+def save_metric(prj_id: str, experiment_id: str, run_uuid: str) -> ResponseReturnValue:
     check_prj_id(prj_id)
     key = request.form.get("key")
-    dim = request.form.get("dim")
-    vec_file = request.files["value"]
-    dir_path = DATA_DIR / experiment_id / run_uuid
-    metric_path = dir_path / f"{key}.bin"
-    meta_path = dir_path / f"{key}.meta"
-    with open(metric_path, "ab") as f:
-        f.write(vec_file.read())
-    if not meta_path.exists():
-        with open(meta_path, "w") as f:
-            f.write(str(dim))
+    dim = int(request.form["dim"])
+    value = request.files["value"].read()
+    batch = metric_pb2.MetricBatch(
+        experiment_id=experiment_id, run_uuid=run_uuid, key=key, dim=dim, count=len(value) // (dim * 4), values=value
+    )
+    # gRPC と同じ経路で書き込み、カタログ・要約統計・監視にも反映する
+    try:
+        metric_service.submit_threadsafe(batch).result(timeout=METRIC_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"Failed to save metric {run_uuid}/{key}: {e}")
+        return {"status": "error", "message": str(e) or type(e).__name__}, 500
     return {"status": "ok"}
 
 
+@server.get("/export/<prj_id>/<experiment_id>")
+def export_metrics(prj_id: str, experiment_id: str) -> ResponseReturnValue:
+    """run × metric の行を npy / arrow / parquet で少しずつ流す
+
+    query: metrics=a,b（必須） runs=x,y または parent=<run>（省略時は experiment の全 run）
+    format=npy|arrow|parquet step_min= step_max= dims=0,2 または 0:3（0 始まり）
+    """
+    check_prj_id(prj_id)
+    args = request.args
+    fmt = args.get("format", "npy")
+    if not args.get("metrics"):
+        return {"status": "error", "message": "metrics is required"}, 400
+    metrics = args["metrics"].split(",")
+    try:
+        parts = plan_export(
+            int(experiment_id),
+            args["runs"].split(",") if args.get("runs") else None,
+            metrics,
+            args.get("step_min", type=int),
+            args.get("step_max", type=int),
+            parse_dims(args.get("dims")),
+            args.get("parent"),
+        )
+        stream = export_stream(parts, fmt)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}, 400
+    filename = f"{experiment_id}_{'_'.join(metrics)}.{fmt}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    return Response(stream, mimetype=FORMATS[fmt], headers=headers)
+
+
+@server.get("/watch/<prj_id>/<experiment_id>/<run_uuid>")
+def watch_verdict(prj_id: str, experiment_id: str, run_uuid: str) -> dict[str, Any]:
+    """run が監視ルールに掛かっていればその判定（ストリームの ACK を見られないクライアント用）"""
+    check_prj_id(prj_id)
+    return {"verdict": metric_service.watcher.verdict(experiment_id, run_uuid)}
+
+
+@server.get("/cache_stats")
+def cache_stats() -> dict[str, Any]:
+    return get_cache_stats()
+
+
 @server.get("/grpc")
-def get_grpc_port():
+def get_grpc_port() -> dict[str, Any]:
     return {"port": os.getenv("GRPC_PORT")}
 
 
@@ -1,22 +1,72 @@
+import base64
+import hashlib
 import json
 import logging
 import os
-from collections import defaultdict
-from contextlib import contextmanager
+import re
+import shutil
+import time
+import warnings
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from datetime import UTC, datetime
+from functools import lru_cache
 from pathlib import Path
+from queue import Queue
+from threading import Lock, Thread
 from typing import Any
 
 import boto3
 import numpy as np
 import plotly.graph_objs as go
 from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import BotoCoreError, ClientError
+from chaser.lod import LOD_FACTOR, LOD_LEVELS, lod_path
+from chaser.metric_file import HEADER_SIZE, SUFFIX, Header, MetricFile, unpack_footer
+from chaser.migrate import migrate_run
+from chaser.stats import MetricStats
+from chaser.writer import HandleCache, MetricInfo
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.orm import aliased, sessionmaker
 
-from .orm import Base, ExperimentORM, RunORM, TagORM
+from .orm import Base, ExperimentORM, MetricORM, RunORM, TagORM
+from .transform import apply_transform, transform_label
 
 TRANSFER_CONFIG = TransferConfig(multipart_threshold=8 * 1024 * 1024, max_concurrency=10)
+S3_WORKERS = 8  # S3 と並列にやりとりするスレッド数
+PUSH_MANIFEST = ".s3manifest.json"  # run ごとの S3 に上げたファイルの一覧 (サイズ・更新時刻・ハッシュ)
 DATA_DIR = Path("/data/experiments")
+MAX_POINTS = 2000  # 1本の線に描く点数の目安
+READ_CACHE_SIZE = 256  # プロセス内で開いたままにするメトリクスファイル数
+
+LIVE_WINDOW = 5000  # ライブ追従時に1本の線に残す点数
+ENVELOPE_CACHE_SIZE = 256  # (run, metric, dims, 範囲, 点数) ごとの描画データ
+SWEEP_CACHE_SIZE = 4096  # sweep 集計用の run ごとの曲線
+SWEEP_QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+# (run, metric, dim, 変換) ごとの変換済み系列を合計でこのバイト数まで持つ（1つでこれを超える系列は持たない）
+TRANSFORM_CACHE_BYTES = int(os.getenv("CHASER_TRANSFORM_CACHE_BYTES", 1024**3))
+TRANSFORM_ROWS = 1 << 20  # 変換するときに一度に読む行数
+HEATMAP_CACHE_SIZE = 64  # (run, metric, 範囲, 格子) ごとのヒートマップ
+HEATMAP_ROWS = 256  # ヒートマップの縦（次元方向）のマス数の上限
+HEATMAP_BLOCK_BYTES = 64 * 1024**2  # step 順でないファイルのヒートマップを集計するときに一度に読む量
+GL_POINTS = 5000  # 図の点数がこれを超えたら Scattergl で描く
+CACHE_BYTES = int(os.getenv("CHASER_CACHE_BYTES", 100 * 1024**3))  # DATA_DIR に置いておく上限
+EVICT_INTERVAL = 60.0  # 秒
+
+Dims = slice | list[int] | None
+Envelope = tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]  # (steps, min, max, mean)
+envelope_cache: OrderedDict[tuple[Any, ...], dict[str, Any]] = OrderedDict()
+sweep_cache: OrderedDict[tuple[Any, ...], dict[str, Any]] = OrderedDict()
+transform_cache: OrderedDict[tuple[Any, ...], dict[str, Any]] = OrderedDict()
+heatmap_cache: OrderedDict[tuple[Any, ...], dict[str, Any]] = OrderedDict()
+envelope_lock = Lock()
+fetch_locks: dict[Path, Lock] = {}  # S3 から取ってくるファイルごとのロック
+fetch_lock = Lock()
+run_access: dict[Path, float] = {}  # run ディレクトリ -> 最後に読んだ時刻
+cache_stats = {"hits": 0, "misses": 0, "evicted_runs": 0, "evicted_bytes": 0}
+cache_lock = Lock()
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +80,12 @@ s3 = boto3.client(
     aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
     aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
 )
+s3_pool = ThreadPoolExecutor(S3_WORKERS)
+push_pool = ThreadPoolExecutor(S3_WORKERS)
+push_queue: Queue[tuple[Path, dict[str, Any]]] = Queue()
+push_status: dict[str, dict[str, Any]] = {}  # run_id -> 直近の push の状態
+push_lock = Lock()
+manifest_lock = Lock()
 
 
 @contextmanager
@@ -105,23 +161,609 @@ def get_tag(run_id: str, key: str = "mlflow.parentRunId") -> str | None:
         return tag.value if tag else None
 
 
+@lru_cache(maxsize=READ_CACHE_SIZE)
+def load_metric_file(path: Path, size: int, mtime_ns: int) -> MetricFile:
+    """(path, size, mtime) ごとに1つの MetricFile を共有する（コールバック間で memmap を使い回す）"""
+    return MetricFile(path)
+
+
+def read_metric_file(path: Path) -> MetricFile | None:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return load_metric_file(path, stat.st_size, stat.st_mtime_ns)
+
+
+def open_metric(experiment_id: int, run_id: str, metric: str) -> MetricFile | None:
+    """メトリクスファイルを開く。手元になければ S3 から索引と LOD だけ取ってくる"""
+    path = DATA_DIR / str(experiment_id) / run_id / f"{metric}{SUFFIX}"
+    hit = path.exists()
+    touch_run(path.parent, hit)
+    if not hit:
+        with path_lock(path):
+            try:
+                if not path.exists():
+                    fetch_metric(experiment_id, run_id, metric)
+            except (BotoCoreError, ClientError):
+                logger.exception(f"Failed to fetch {metric} of run {run_id} from S3")
+    return read_metric_file(path)
+
+
 def get_dim(experiment_id: int, run_id: str, metric: str) -> int:
-    meta_path = DATA_DIR / str(experiment_id) / run_id / f"{metric}.meta"
-    if meta_path.exists():
-        with open(meta_path) as f:
-            return int(f.read().strip())
-    return 1
+    file = open_metric(experiment_id, run_id, metric)
+    return file.dim if file is not None else 1
+
+
+def get_data(
+    experiment_id: int,
+    run_id: str,
+    metric: str,
+    dims: Dims = None,
+    step_min: int | None = None,
+    step_max: int | None = None,
+) -> np.ndarray:
+    """値を (行, 次元) で返す。dims と step 範囲で切り出した分だけ読む"""
+    return get_series(experiment_id, run_id, metric, step_min, step_max, dims)[2]
+
+
+def get_step_order(experiment_id: int, run_id: str, metric: str, steps: np.ndarray) -> np.ndarray:
+    """step 順の並び替えインデックス（受信順が step 順でないファイル用）
+
+    argsort を `.sidx` にキャッシュする（行数が変わったら作り直す。S3 には上げない）。
+    """
+    index_path = DATA_DIR / str(experiment_id) / run_id / f"{metric}.sidx"
+    if index_path.exists() and index_path.stat().st_size == len(steps) * 8:
+        return np.fromfile(index_path, dtype=np.int64)
+    order = np.argsort(steps, kind="stable")
+    order.tofile(index_path)
+    return order
+
+
+def find_rows(steps: np.ndarray, step_min: int | None = None, step_max: int | None = None) -> slice:
+    """ソート済みの step 列から [step_min, step_max] の行範囲を二分探索で求める"""
+    start = 0 if step_min is None else int(np.searchsorted(steps, step_min, side="left"))
+    stop = len(steps) if step_max is None else int(np.searchsorted(steps, step_max, side="right"))
+    return slice(start, stop)
+
+
+def locate_rows(file: MetricFile, step_min: int | None = None, step_max: int | None = None) -> slice:
+    """step 順のファイルで [step_min, step_max] の行範囲を求める
+
+    footer の索引があればチャンクの step 範囲で絞り、境界の2チャンクだけを二分探索する
+    （S3 から部分的に取ってきたファイルでも、読むのはその2チャンクだけ）。
+    """
+    if file.index is None:
+        ensure_rows(file)
+        return find_rows(file.rows()["step"], step_min, step_max)
+    chunk_rows, start, stop = file.header.chunk_rows, 0, file.n_rows
+    if step_min is not None:
+        i = int(np.searchsorted([c.step_max for c in file.index], step_min, side="left"))
+        start = stop
+        if i < len(file.index):
+            rows = ensure_rows(file, i * chunk_rows, i * chunk_rows + file.index[i].n_rows)
+            start = i * chunk_rows + int(np.searchsorted(rows["step"], step_min, side="left"))
+    if step_max is not None:
+        j = int(np.searchsorted([c.step_min for c in file.index], step_max, side="right")) - 1
+        stop = 0
+        if j >= 0:
+            rows = ensure_rows(file, j * chunk_rows, j * chunk_rows + file.index[j].n_rows)
+            stop = j * chunk_rows + int(np.searchsorted(rows["step"], step_max, side="right"))
+    return slice(start, max(start, stop))
+
+
+def get_series(
+    experiment_id: int,
+    run_id: str,
+    metric: str,
+    step_min: int | None = None,
+    step_max: int | None = None,
+    dims: Dims = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """step 順に並べた (steps, timestamps, values) を返す
+
+    memmap から step 範囲の行・dims の列だけをコピーする。step 順に届いている場合は
+    step 列の二分探索で範囲を決める。
+    """
+    file = open_metric(experiment_id, run_id, metric)
+    if file is None:
+        return np.array([], np.int64), np.array([]), np.empty((0, 1), np.float32)
+    dims = slice(None) if dims is None else dims
+    if file.unsorted:
+        rows = ensure_rows(file)
+        order = get_step_order(experiment_id, run_id, metric, rows["step"])
+        steps = rows["step"][order]
+        order = order[find_rows(steps, step_min, step_max)]
+        return rows["step"][order], rows["time"][order], rows["value"][:, dims][order].astype(np.float32)
+    raw = locate_rows(file, step_min, step_max)
+    rows = ensure_rows(file, raw.start, raw.stop)
+    return np.array(rows["step"]), np.array(rows["time"]), np.array(rows["value"][:, dims], dtype=np.float32)
+
+
+def pick_level(n_rows: int, max_points: int) -> int:
+    """n_rows 行を max_points 点以内で描ける一番細かい LOD level"""
+    level = 0
+    while level < LOD_LEVELS and n_rows / LOD_FACTOR**level > max_points:
+        level += 1
+    return level
 
 
-def get_data(experiment_id: int, run_id: str, metric: str) -> np.ndarray:
-    file_path = DATA_DIR / str(experiment_id) / run_id / f"{metric}.bin"
-    if file_path.exists():
-        with open(file_path) as f:
-            return np.fromfile(file_path, dtype=np.float32)
-    return np.array([])
+def read_envelope(
+    file: MetricFile, start: int, stop: int, level: int, dims: Dims, max_points: int
+) -> tuple[Envelope, int, int]:
+    """[start, stop) 行の (steps, min, max, mean) を返す
+
+    末尾の level にまとまっていない分は下の level（最後は生データ）で補う。
+    あわせて level のバケットで確定した行の終わりと、その行までの点数を返す。
+    """
+    dims = slice(None) if dims is None else dims
+    parts, aligned, n_fixed = [], start, 0
+    for k in range(level, 0, -1):
+        if start >= stop or (lod := open_lod(file, k)) is None:
+            continue
+        width = LOD_FACTOR**k
+        first, last = start // width, min(lod.n_rows, -(-stop // width))
+        if first < last:
+            part = ensure_rows(lod, first, last)
+            values = part["value"].reshape((-1, 3, file.dim))[:, :, dims]
+            parts.append((np.array(part["step"]), values[:, 0], values[:, 1], values[:, 2]))
+            start = last * width
+            if k == level:
+                aligned, n_fixed = start, len(part)
+    if start < stop:
+        # LOD がない場合も点数が max_points 程度に収まるように間引く
+        part = ensure_rows(file, start, stop)[:: max(1, -(-(stop - start) // max_points))]
+        values = np.array(part["value"][:, dims], dtype=np.float32)
+        parts.append((np.array(part["step"]), values, values, values))
+        if level == 0:
+            aligned, n_fixed = stop, len(part)
+    if not parts:
+        n_dim = len(range(file.dim)[dims]) if isinstance(dims, slice) else len(dims)
+        return (np.array([], np.int64), *(np.empty((0, n_dim), np.float32),) * 3), aligned, n_fixed
+    steps, lower, upper, mean = (np.concatenate(columns) for columns in zip(*parts, strict=True))
+    return (steps, lower, upper, mean), aligned, n_fixed
+
+
+def get_envelope(
+    experiment_id: int,
+    run_id: str,
+    metric: str,
+    step_min: int | None = None,
+    step_max: int | None = None,
+    max_points: int = MAX_POINTS,
+    dims: Dims = None,
+) -> Envelope:
+    """表示用に (steps, min, max, mean) を max_points 程度まで間引いて返す
+
+    範囲内の行数から LOD ピラミッドの level を選ぶ。読む量は画面の点数で決まり、run の長さによらない。
+    """
+    file = open_metric(experiment_id, run_id, metric)
+    if file is None or file.unsorted:
+        steps, _, values = get_series(experiment_id, run_id, metric, step_min, step_max, dims)
+        stride = max(1, -(-len(steps) // max_points))
+        return steps[::stride], values[::stride], values[::stride], values[::stride]
+    raw = locate_rows(file, step_min, step_max)
+    level = pick_level(raw.stop - raw.start, max_points)
+    return read_envelope(file, raw.start, raw.stop, level, dims, max_points)[0]
+
+
+def get_cached_envelope(
+    experiment_id: int,
+    run_id: str,
+    metric: str,
+    dim: int,
+    step_range: tuple[int | None, int | None],
+    max_points: int,
+) -> Envelope:
+    """get_envelope のキャッシュ付き版（先頭 dim 次元）
+
+    ファイルサイズが同じならそのまま返す。追記中の run は、前回の結果のうち level の
+    バケットが確定した部分を残し、その後ろだけ読み直して継ぎ足す。
+    """
+    file = open_metric(experiment_id, run_id, metric)
+    if file is None or file.unsorted:
+        return get_envelope(experiment_id, run_id, metric, *step_range, max_points, slice(0, dim))
+    key = (experiment_id, run_id, metric, dim, step_range, max_points)
+    with envelope_lock:
+        entry = envelope_cache.get(key)
+        if entry is not None:
+            envelope_cache.move_to_end(key)
+    if entry is not None and entry["size"] == file.size:
+        cached: Envelope = entry["envelope"]
+        return cached
+
+    raw = locate_rows(file, *step_range)
+    level = pick_level(raw.stop - raw.start, max_points)
+    dims = slice(0, dim)
+    if entry is not None and entry["level"] == level and entry["start"] == raw.start and step_range[1] is None:
+        new, aligned, n_fixed = read_envelope(file, entry["aligned"], raw.stop, level, dims, max_points)
+        n_fixed += len(entry["fixed"][0])
+        steps, lower, upper, mean = (np.concatenate(columns) for columns in zip(entry["fixed"], new, strict=True))
+        envelope = (steps, lower, upper, mean)
+    else:
+        envelope, aligned, n_fixed = read_envelope(file, raw.start, raw.stop, level, dims, max_points)
+    # 次回に使い回せるのは level のバケットが確定した行（aligned まで）の点だけ
+    fixed = tuple(column[:n_fixed] for column in envelope)
+    entry = {"size": file.size, "level": level, "start": raw.start, "aligned": aligned, "fixed": fixed}
+    entry["envelope"] = envelope
+    with envelope_lock:
+        envelope_cache[key] = entry
+        envelope_cache.move_to_end(key)
+        while len(envelope_cache) > ENVELOPE_CACHE_SIZE:
+            envelope_cache.popitem(last=False)
+    return envelope
+
+
+def get_transformed(
+    experiment_id: int, run_id: str, metric: str, dim: int, transform: tuple[str, float | None]
+) -> tuple[np.ndarray, np.ndarray]:
+    """先頭 dim 次元に変換をかけた (steps, values) を step 順で返す
+
+    結果と変換の state をキャッシュしておき、追記された行だけを読んで続きを計算する。
+    step 順でないファイルは並び替えが変わるので毎回全体を計算し直す。
+    """
+    file = open_metric(experiment_id, run_id, metric)
+    if file is None:
+        return np.array([], np.int64), np.empty((0, dim), np.float32)
+    key = (experiment_id, run_id, metric, dim, transform)
+    with envelope_lock:
+        entry = transform_cache.get(key)
+        if entry is not None:
+            transform_cache.move_to_end(key)
+    if entry is not None and entry["size"] == file.size:
+        return entry["steps"][: entry["n_rows"]], entry["values"][: entry["n_rows"]]
+
+    if file.unsorted:
+        steps, _, values = get_series(experiment_id, run_id, metric, dims=slice(0, dim))
+        values, state = apply_transform(transform, values)
+        entry = {"size": file.size, "n_rows": len(steps), "steps": steps, "values": values, "state": state}
+    else:
+        if entry is None or entry["n_rows"] > file.n_rows:
+            entry = {
+                "n_rows": 0,
+                "steps": np.empty(0, np.int64),
+                "values": np.empty((0, dim), np.float32),
+                "state": None,
+            }
+        n_rows, steps, values, state = entry["n_rows"], entry["steps"], entry["values"], entry["state"]
+        if len(steps) < file.n_rows:
+            # 追記のたびに作り直さないよう、倍々に広げた配列に書き足す
+            capacity = max(file.n_rows, 2 * len(steps))
+            steps, values = np.resize(steps, capacity), np.resize(values, (capacity, dim))
+        for start in range(n_rows, file.n_rows, TRANSFORM_ROWS):
+            stop = min(start + TRANSFORM_ROWS, file.n_rows)
+            rows = ensure_rows(file, start, stop)
+            steps[start:stop] = rows["step"]
+            values[start:stop], state = apply_transform(transform, rows["value"][:, :dim], state)
+        entry = {"size": file.size, "n_rows": file.n_rows, "steps": steps, "values": values, "state": state}
+    entry["nbytes"] = entry["steps"].nbytes + entry["values"].nbytes
+    with envelope_lock:
+        transform_cache.pop(key, None)
+        if entry["nbytes"] <= TRANSFORM_CACHE_BYTES:
+            transform_cache[key] = entry
+        total = sum(e["nbytes"] for e in transform_cache.values())
+        while total > TRANSFORM_CACHE_BYTES:
+            total -= transform_cache.popitem(last=False)[1]["nbytes"]
+    return entry["steps"][: entry["n_rows"]], entry["values"][: entry["n_rows"]]
+
+
+def get_transformed_envelope(
+    experiment_id: int,
+    run_id: str,
+    metric: str,
+    dim: int,
+    transform: tuple[str, float | None],
+    step_range: tuple[int | None, int | None],
+    max_points: int,
+) -> Envelope:
+    """変換済みの系列を get_envelope と同じ (steps, min, max, mean) の形に間引く"""
+    steps, values = get_transformed(experiment_id, run_id, metric, dim, transform)
+    rows = find_rows(steps, *step_range)
+    steps, values = steps[rows], values[rows]
+    width = -(-len(steps) // max_points)
+    if width <= 1:
+        return steps, values, values, values
+    starts = np.arange(0, len(steps), width)
+    valid = ~np.isnan(values)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.add.reduceat(np.where(valid, values, 0), starts) / np.add.reduceat(valid, starts)
+    lower, upper = np.fmin.reduceat(values, starts), np.fmax.reduceat(values, starts)
+    return steps[starts], lower, upper, mean.astype(np.float32)
+
+
+def reduce_bins(values: np.ndarray, starts: np.ndarray, agg: str, axis: int) -> np.ndarray:
+    """axis 方向に starts で区切った区間ごとに NaN を除いて mean/min/max を取る"""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if agg == "mean":
+            valid = ~np.isnan(values)
+            total = np.add.reduceat(np.where(valid, values, 0), starts, axis=axis)
+            return total / np.add.reduceat(valid, starts, axis=axis)
+        return (np.fmin if agg == "min" else np.fmax).reduceat(values, starts, axis=axis)
+
+
+def get_heatmap(
+    experiment_id: int,
+    run_id: str,
+    metric: str,
+    step_range: tuple[int | None, int | None] = (None, None),
+    max_points: int = MAX_POINTS,
+    max_rows: int = HEATMAP_ROWS,
+    agg: str = "mean",
+) -> dict[str, Any]:
+    """全次元を (次元, step) の格子にまとめたヒートマップを返す
+
+    step 方向は get_envelope で max_points 程度まで間引いた点 (LOD のバケットの min/max/mean) をそのまま列にし、
+    次元方向は max_rows 以内の区間にまとめる。読む量は格子の大きさで決まり、行数にも次元数にもよらない。
+    ファイルサイズが同じ間はキャッシュを返す。
+    """
+    file = open_metric(experiment_id, run_id, metric)
+    empty = {"z": np.empty((0, 0), np.float32), "steps": np.array([], np.int64), "y0": 1.0, "dy": 1.0, "dim": 0}
+    if file is None:
+        return empty
+    key = (experiment_id, run_id, metric, step_range, max_points, max_rows, agg)
+    with envelope_lock:
+        entry = heatmap_cache.get(key)
+        if entry is not None:
+            heatmap_cache.move_to_end(key)
+    if entry is not None and entry["size"] == file.size:
+        cached: dict[str, Any] = entry["heatmap"]
+        return cached
+
+    # 次元方向: 区間の中の次元を同じ集計でまとめる
+    n_rows = min(max_rows, file.dim)
+    edges = np.linspace(0, file.dim, n_rows + 1).astype(np.int64)[:-1]
+    if file.unsorted:
+        steps, z = bin_unsorted(experiment_id, run_id, metric, file, step_range, max_points, edges, agg)
+    else:
+        steps, lower, upper, mean = get_envelope(experiment_id, run_id, metric, *step_range, max_points)
+        z = reduce_bins({"min": lower, "max": upper}.get(agg, mean), edges, agg, axis=1) if len(steps) else None
+    if len(steps) == 0 or z is None:
+        return {**empty, "dim": file.dim}
+    dy = file.dim / n_rows
+    heatmap = {
+        "z": np.ascontiguousarray(z.T, dtype=np.float32),
+        "steps": steps,
+        "y0": (dy + 1) / 2,  # 次元は 1 始まり
+        "dy": dy,
+        "dim": file.dim,
+    }
+    with envelope_lock:
+        heatmap_cache[key] = {"size": file.size, "heatmap": heatmap}
+        heatmap_cache.move_to_end(key)
+        while len(heatmap_cache) > HEATMAP_CACHE_SIZE:
+            heatmap_cache.popitem(last=False)
+    return heatmap
+
 
+def bin_unsorted(
+    experiment_id: int,
+    run_id: str,
+    metric: str,
+    file: MetricFile,
+    step_range: tuple[int | None, int | None],
+    max_points: int,
+    edges: np.ndarray,
+    agg: str,
+) -> tuple[np.ndarray, np.ndarray | None]:
+    """step 順でないファイルのヒートマップの格子 (列, 次元の区間) と各列の先頭の step を返す
 
-def list_experiments() -> list:
+    step 順に並べた行を max_points 列程度に等分し、ファイルを HEATMAP_BLOCK_BYTES ずつ読んで各列に集計する。
+    メモリに載せるのは step 列と並び替えのインデックス（1行あたり 20 bytes 程度）と1ブロック分の値だけ。
+    """
+    block = max(1, HEATMAP_BLOCK_BYTES // file.header.row_dtype.itemsize)
+    starts = range(0, file.n_rows, block)
+    steps = np.concatenate(
+        [np.array(ensure_rows(file, a, a + block)["step"]) for a in starts] or [np.array([])]
+    ).astype(np.int64)
+    order = get_step_order(experiment_id, run_id, metric, steps)
+    order = order[find_rows(steps[order], *step_range)]
+    if len(order) == 0:
+        return np.array([], np.int64), None
+    width = -(-len(order) // max_points)
+    columns = np.full(file.n_rows, -1, np.int32)
+    columns[order] = np.arange(len(order)) // width
+    shape = (int(columns[order[-1]]) + 1, len(edges))
+    total, count = np.zeros(shape), np.zeros(shape, np.int64)
+    out = np.full(shape, np.nan, np.float32)
+    ufunc = np.fmin if agg == "min" else np.fmax
+    for a in starts:
+        cols = columns[a : a + block]
+        if not (keep := cols >= 0).any():
+            continue
+        values = np.asarray(ensure_rows(file, a, a + block)["value"][keep], dtype=np.float32)
+        if agg == "mean":
+            valid = ~np.isnan(values)
+            np.add.at(total, cols[keep], np.add.reduceat(np.where(valid, values, 0), edges, axis=1, dtype=np.float64))
+            np.add.at(count, cols[keep], np.add.reduceat(valid, edges, axis=1))
+        else:
+            ufunc.at(out, cols[keep], ufunc.reduceat(values, edges, axis=1))
+    if agg == "mean":
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out = (total / count).astype(np.float32)
+    return steps[order[::width]], out
+
+
+def get_row_count(experiment_id: int, run_id: str, metric: str) -> int:
+    file = open_metric(experiment_id, run_id, metric)
+    return file.n_rows if file is not None else 0
+
+
+def get_tail(
+    experiment_id: int,
+    run_id: str,
+    metric: str,
+    start: int,
+    dim: int,
+    max_rows: int = LIVE_WINDOW,
+    transform: tuple[str, float | None] | None = None,
+) -> tuple[np.ndarray, np.ndarray, int]:
+    """start 行目以降に追記された (steps, values[:, :dim]) と、読み終えた行数を返す（多すぎる分は古い方を捨てる）"""
+    file = open_metric(experiment_id, run_id, metric)
+    if file is None or file.n_rows <= start:
+        return np.array([], np.int64), np.empty((0, dim), np.float32), start
+    if transform is not None:
+        steps, values = get_transformed(experiment_id, run_id, metric, dim, transform)
+        tail = slice(max(start, len(steps) - max_rows), len(steps))
+        return steps[tail].copy(), values[tail].copy(), len(steps)
+    rows = ensure_rows(file, max(start, file.n_rows - max_rows), file.n_rows)
+    return np.array(rows["step"]), np.array(rows["value"][:, :dim], dtype=np.float32), file.n_rows
+
+
+def get_run_curve(
+    experiment_id: int, run_id: str, metric: str, dim: int, goal: str, max_points: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """sweep 集計用に run 1本の dim 次元目の (steps, mean, best-so-far の steps, best-so-far) を返す
+
+    ファイルサイズが同じ間はキャッシュを返す。
+    best-so-far は LOD の min/max から作るので、間引いた点でも区間内の最良値を取りこぼさない。
+    """
+    file = open_metric(experiment_id, run_id, metric)
+    if file is None or dim > file.dim:
+        return (np.array([], np.int64), np.array([], np.float32)) * 2
+    key = (experiment_id, run_id, metric, dim, goal, max_points)
+    with envelope_lock:
+        entry = sweep_cache.get(key)
+        if entry is not None:
+            sweep_cache.move_to_end(key)
+    if entry is not None and entry["size"] == file.size:
+        cached: tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray] = entry["curve"]
+        return cached
+    steps, lower, upper, mean = get_envelope(experiment_id, run_id, metric, max_points=max_points, dims=[dim - 1])
+    best = np.fmin.accumulate(lower[:, 0]) if goal == "min" else np.fmax.accumulate(upper[:, 0])
+    # 間引いた点の best は区間の終わり（次の点の直前）から有効にする。min == max の点はその step から
+    ends = np.append(steps[1:] - 1, steps[-1:])
+    best_steps = np.where(lower[:, 0] == upper[:, 0], steps, np.maximum(steps, ends))
+    curve = (steps, mean[:, 0], best_steps, best)
+    with envelope_lock:
+        sweep_cache[key] = {"size": file.size, "curve": curve}
+        sweep_cache.move_to_end(key)
+        while len(sweep_cache) > SWEEP_CACHE_SIZE:
+            sweep_cache.popitem(last=False)
+    return curve
+
+
+def sample_curves(curves: list[tuple[Any, ...]], grid: np.ndarray, hold: bool) -> np.ndarray:
+    """各 run の曲線を grid 上の (run, 点) 行列にする。grid の各 step ではその step 以前の最後の値を取る
+
+    hold=False なら run の最後の step より後は NaN（終わった trial は分位点に入れない）。
+    """
+    matrix = np.full((len(curves), len(grid)), np.nan, dtype=np.float32)
+    for i, (steps, values) in enumerate(curves):
+        if len(steps) == 0:
+            continue
+        index = np.searchsorted(steps, grid, side="right") - 1
+        valid = (index >= 0) if hold else (index >= 0) & (grid <= steps[-1])
+        matrix[i, valid] = values[index[valid]]
+    return matrix
+
+
+def nan_quantiles(matrix: np.ndarray, qs: tuple[float, ...]) -> np.ndarray:
+    """列ごとに NaN を除いた分位点（np.nanquantile の linear と同じ値）を列をまとめて求める"""
+    ordered = np.sort(matrix, axis=0)  # NaN は末尾に寄る
+    count = np.sum(~np.isnan(matrix), axis=0)
+    out = np.full((len(qs), matrix.shape[1]), np.nan, dtype=np.float64)
+    columns = np.flatnonzero(count)
+    for i, q in enumerate(qs):
+        position = q * (count[columns] - 1)
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, count[columns] - 1)
+        lower, upper = ordered[low, columns].astype(np.float64), ordered[high, columns].astype(np.float64)
+        out[i, columns] = lower + (upper - lower) * (position - low)
+    return out
+
+
+def get_sweep(
+    experiment_id: int,
+    parent_id: str,
+    metric: str,
+    dim: int = 1,
+    goal: str = "min",
+    max_points: int = MAX_POINTS,
+) -> dict[str, Any]:
+    """parent の子 run すべての metric を共通の step 軸にそろえて集計する
+
+    分位点 (SWEEP_QUANTILES) と、sweep 全体での best-so-far を返す。run ごとの曲線はキャッシュするので、
+    2回目以降に読み直すのは新しく増えた・追記された trial だけ。
+    """
+    run_ids = [run["id"] for run in list_runs_hierarchy(experiment_id).get(parent_id, [])]
+    curves = [get_run_curve(experiment_id, run_id, metric, dim, goal, max_points) for run_id in run_ids]
+    ends = [(steps[0], steps[-1]) for steps, *_ in curves if len(steps)]
+    if not ends:
+        return {"runs": [], "steps": np.array([]), "values": np.empty((0, 0)), "quantiles": {}, "best": np.array([])}
+    first, last = min(s for s, _ in ends), max(e for _, e in ends)
+    grid = np.unique(np.linspace(first, last, max_points).round().astype(np.int64))
+    values = sample_curves([curve[:2] for curve in curves], grid, hold=False)
+    bests = sample_curves([curve[2:] for curve in curves], grid, hold=True)
+    with warnings.catch_warnings():
+        # まだ誰も到達していない step は全 run が NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        best = np.nanmin(bests, axis=0) if goal == "min" else np.nanmax(bests, axis=0)
+    quantiles = nan_quantiles(values, SWEEP_QUANTILES)
+    return {
+        "runs": run_ids,
+        "steps": grid,
+        "values": values,
+        "quantiles": dict(zip(SWEEP_QUANTILES, quantiles, strict=True)),
+        "best": best,
+    }
+
+
+def list_experiment_metrics(experiment_id: int) -> list[str]:
+    """experiment のどれかの run が持つ metric の一覧"""
+    with get_session() as session:
+        query = (
+            session.query(MetricORM.key)
+            .join(RunORM, MetricORM.run_id == RunORM.id)
+            .filter(RunORM.experiment_id == experiment_id)
+            .distinct()
+        )
+        return sorted(key for (key,) in query)
+
+
+def get_run_table(experiment_id: int, metric: str, dim: int = 1) -> list[dict[str, Any]]:
+    """experiment の run ごとの metric の要約統計を1回のクエリで取る（1次元目の最後の値の昇順）
+
+    要約統計は ingest 時に更新したものをカタログから読むだけで、メトリクスファイルは開かない。
+    """
+    parent = aliased(RunORM)
+    with get_session() as session:
+        query = (
+            session.query(RunORM.id, RunORM.name, parent.name, MetricORM)
+            .join(MetricORM, (MetricORM.run_id == RunORM.id) & (MetricORM.key == metric))
+            .outerjoin(TagORM, (TagORM.run_id == RunORM.id) & (TagORM.key == "mlflow.parentRunId"))
+            .outerjoin(parent, parent.id == TagORM.value)
+            .filter(RunORM.experiment_id == experiment_id)
+            .order_by(MetricORM.last_value.is_(None), MetricORM.last_value, RunORM.date)
+        )
+        table = []
+        for run_id, name, parent_name, row in query:
+            stats = json.loads(row.stats) if row.stats else {}
+            columns = {key: stats.get(key, [])[dim - 1 : dim] for key in ("last", "min", "max", "mean", "nan_count")}
+            table.append(
+                {
+                    "id": run_id,
+                    "run": name,
+                    "parent": parent_name,
+                    "rows": row.count,
+                    **{key: values[0] if values else None for key, values in columns.items()},
+                    "last_step": stats.get("last_step"),
+                }
+            )
+        return table
+
+
+def list_sweep_metrics(experiment_id: int, parent_id: str) -> list[str]:
+    """parent の子 run のどれかが持つ metric の一覧"""
+    run_ids = [run["id"] for run in list_runs_hierarchy(experiment_id).get(parent_id, [])]
+    if not run_ids:
+        return []
+    with get_session() as session:
+        query = session.query(MetricORM.key).filter(MetricORM.run_id.in_(run_ids)).distinct()
+        keys = sorted(key for (key,) in query)
+    return keys or list_metrics(experiment_id, run_ids[0])
+
+
+def list_experiments() -> list[dict[str, Any]]:
     with get_session() as session:
         return [
             {"name": exp.name, "id": exp.id}
@@ -129,7 +771,7 @@ def list_experiments() -> list:
         ]
 
 
-def list_runs(experiment_id: str, tag_name: str = "mlflow.parentRunId") -> list:
+def list_runs(experiment_id: int | str, tag_name: str = "mlflow.parentRunId") -> list[dict[str, Any]]:
     with get_session() as session:
         return [
             {"name": run.name, "id": run.id, "parent": tag.value if tag else None}
@@ -146,26 +788,48 @@ def list_runs(experiment_id: str, tag_name: str = "mlflow.parentRunId") -> list:
         ]
 
 
-def list_runs_hierarchy(experiment_id: str) -> dict:
-    hierarchy = defaultdict(list)
+def list_runs_hierarchy(experiment_id: int | str) -> dict[str | None, list[dict[str, Any]]]:
+    hierarchy: dict[str | None, list[dict[str, Any]]] = defaultdict(list)
     for run in list_runs(experiment_id):
         parent_id = run["parent"]
         hierarchy[parent_id].append(run)
     return hierarchy
 
 
-def list_metrics(experiment_id: int, run_id: str) -> list:
+def list_metrics(experiment_id: int, run_id: str) -> list[str]:
+    with get_session() as session:
+        query = session.query(MetricORM.key).filter(MetricORM.run_id == run_id).order_by(MetricORM.key)
+        keys = [key for (key,) in query]
+    if keys:
+        return keys
+    # カタログにない run（カタログ導入前のもの）はファイルから登録する
+    return [info.key for info in catalog_run(experiment_id, run_id)]
+
+
+def catalog_run(experiment_id: int, run_id: str) -> list[MetricInfo]:
     run_path = DATA_DIR / str(experiment_id) / run_id
     pull_all_from_s3(run_path, experiment_id, run_id)
     if not run_path.exists():
         return []
-    return sorted([p.stem for p in run_path.glob("*.bin")])
+    if migrate_run(run_path):
+        # 変換したものは S3 にもないので上げておく（上がるまでは手元から消されない）
+        schedule_push(run_path)
+    infos = []
+    for path in sorted(run_path.glob(f"*{SUFFIX}")):
+        header = MetricFile(path).header
+        size = sum(p.stat().st_size for p in run_path.glob(f"{path.stem}.*"))
+        stats = MetricStats.recover(path, header.dim).to_dict()
+        infos.append(
+            MetricInfo(str(experiment_id), run_id, path.stem, header.dim, header.dtype, header.n_rows, size, stats)
+        )
+    upsert_metrics(infos)
+    return infos
 
 
 ##########################################
 # 更新系
 ##########################################
-def update_plot_state(run_id: str, state: dict) -> None:
+def update_plot_state(run_id: str, state: dict[str, Any]) -> None:
     with get_session() as session:
         run = session.query(RunORM).filter(RunORM.id == run_id).first()
         plot_states = json.loads(run.state)
@@ -184,35 +848,451 @@ def delete_plot_state(run_id: str, plot_id: str) -> None:
             session.commit()
 
 
+def set_stats(metric: MetricORM, stats: dict[str, Any]) -> None:
+    """要約統計を JSON と1次元目の列（並べ替え用）に書く"""
+    metric.stats = json.dumps(stats)
+    metric.last_value, metric.min_value = stats["last"][0], stats["min"][0]
+    metric.max_value, metric.mean_value = stats["max"][0], stats["mean"][0]
+    metric.nan_count = stats["nan_count"][0]
+
+
+def upsert_metrics(infos: list[MetricInfo]) -> None:
+    """メトリクスカタログを更新する（ingest 側から呼ばれる。未登録の run のものは飛ばす）
+
+    まとめて書けなかったときは1件ずつ書き直し、書けないものだけ飛ばす（1件のせいで他の run の更新を止めない）。
+    """
+    try:
+        write_metrics(infos)
+    except DBAPIError:
+        if len(infos) == 1:
+            raise
+        for info in infos:
+            try:
+                write_metrics([info])
+            except DBAPIError as e:
+                logger.warning(f"Failed to update metric catalog for {info.run_uuid}/{info.key}: {e}")
+
+
+def write_metrics(infos: list[MetricInfo]) -> None:
+    for retry in range(2):
+        with get_session() as session:
+            run_ids = {info.run_uuid for info in infos}
+            known = {run_id for (run_id,) in session.query(RunORM.id).filter(RunORM.id.in_(run_ids))}
+            existing = {
+                (metric.run_id, metric.key): metric
+                for metric in session.query(MetricORM).filter(MetricORM.run_id.in_(known))
+            }
+            now = datetime.now(UTC)
+            for info in infos:
+                if info.run_uuid not in known:
+                    continue
+                if (metric := existing.get((info.run_uuid, info.key))) is None:
+                    metric = existing[(info.run_uuid, info.key)] = MetricORM(run_id=info.run_uuid, key=info.key)
+                    session.add(metric)
+                metric.dim, metric.dtype, metric.count, metric.size = info.dim, info.dtype, info.n_rows, info.size
+                if info.stats is not None:
+                    set_stats(metric, info.stats)
+                metric.date = now
+            try:
+                session.commit()
+                return
+            except IntegrityError:
+                # 別スレッドが同じ (run, key) を先に追加した
+                session.rollback()
+                if retry:
+                    raise
+
+
 ##########################################
 # S3系
 ##########################################
-def push_all_to_s3(dir_path: Path) -> None:
-    for file_path in dir_path.rglob("*"):
-        if file_path.is_file():
-            s3.upload_file(
-                Filename=str(file_path),
-                Bucket=os.getenv("PRJ_ID"),
-                Key=f"chain/{str(file_path.relative_to('/data'))}",
-                Config=TRANSFER_CONFIG,
-            )
+def s3_key(path: Path) -> str:
+    """ローカルのパスに対応する S3 のキー"""
+    return f"chain/experiments/{path.relative_to(DATA_DIR).as_posix()}"
+
+
+def file_entry(path: Path) -> dict[str, Any]:
+    stat = path.stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def file_digest(path: Path) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def read_manifest(dir_path: Path) -> dict[str, dict[str, Any]]:
+    manifest_path = dir_path / PUSH_MANIFEST
+    return json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+
+
+def update_manifest(dir_path: Path, entries: dict[str, dict[str, Any]]) -> None:
+    """S3 と同じ内容であることが分かったファイルをマニフェストに記録する"""
+    if not entries:
+        return
+    with manifest_lock:
+        manifest = read_manifest(dir_path)
+        manifest.update(entries)
+        manifest_path = dir_path / PUSH_MANIFEST
+        tmp = manifest_path.with_name(manifest_path.name + ".tmp")
+        tmp.write_text(json.dumps(manifest))
+        tmp.replace(manifest_path)
+
+
+def is_synced(entry: dict[str, Any], known: dict[str, Any]) -> bool:
+    return all(known.get(k) == v for k, v in entry.items())
+
+
+def push_targets(dir_path: Path) -> list[Path]:
+    """S3 に上げるファイル（途中のもの・S3 から取りかけのもの・手元で作り直せる索引は除く）"""
+    return [
+        path
+        for path in sorted(dir_path.rglob("*"))
+        if path.is_file()
+        and path.name != PUSH_MANIFEST
+        and path.suffix not in (".tmp", ".have", ".sidx")
+        and not have_path(path).exists()
+    ]
+
+
+def push_all_to_s3(dir_path: Path, status: dict[str, Any] | None = None) -> None:
+    """run ディレクトリを S3 に上げる。前回から変わっていないファイル（マニフェストのサイズとハッシュで判定）は飛ばす"""
+    status = {} if status is None else status
+    manifest = read_manifest(dir_path)
+
+    def push(path: Path) -> tuple[str, dict[str, Any]] | None:
+        name = path.relative_to(dir_path).as_posix()
+        entry, known = file_entry(path), manifest.get(name, {})
+        if is_synced(entry, known):
+            return None
+        entry["sha256"] = file_digest(path)
+        if known.get("sha256") != entry["sha256"]:
+            s3.upload_file(Filename=str(path), Bucket=os.getenv("PRJ_ID"), Key=s3_key(path), Config=TRANSFER_CONFIG)
+            with push_lock:
+                status["uploaded"] += 1
+                status["bytes"] += entry["size"]
+        return name, entry
+
+    targets = push_targets(dir_path)
+    status.update(files=len(targets), uploaded=0, bytes=0)
+    pushed: dict[str, dict[str, Any]] = {}
+    try:
+        for result in push_pool.map(push, targets):
+            if result is not None:
+                pushed.update([result])
+    finally:
+        update_manifest(dir_path, pushed)
+
+
+def schedule_push(dir_path: Path) -> dict[str, Any]:
+    """run ディレクトリの S3 への push を予約して状態を返す（実行中なら終わったあとにもう一度 push する）"""
+    with push_lock:
+        status = push_status.get(dir_path.name)
+        if status is None or status["state"] != "queued":
+            status = {"state": "queued", "queued_at": datetime.now(UTC).isoformat()}
+            push_status[dir_path.name] = status
+            push_queue.put((dir_path, status))
+        return dict(status)
+
+
+def push_worker() -> None:
+    while True:
+        dir_path, status = push_queue.get()
+        with push_lock:
+            status["state"] = "running"
+        try:
+            push_all_to_s3(dir_path, status)
+        except Exception as e:
+            logger.exception(f"Failed to push {dir_path} to S3")
+            with push_lock:
+                status.update(state="error", error=str(e))
+        else:
+            with push_lock:
+                status["state"] = "done"
+        finally:
+            with push_lock:
+                status["finished_at"] = datetime.now(UTC).isoformat()
+
+
+Thread(target=push_worker, daemon=True).start()
+
+
+def get_push_status(run_id: str) -> dict[str, Any]:
+    with push_lock:
+        return dict(push_status.get(run_id, {"state": "unknown"}))
+
+
+def list_s3_objects(prefix: str) -> list[dict[str, Any]]:
+    """prefix 以下のオブジェクトをすべて列挙（1000件ごとのページを辿る）"""
+    paginator = s3.get_paginator("list_objects_v2")
+    return [
+        obj
+        for page in paginator.paginate(Bucket=os.getenv("PRJ_ID"), Prefix=prefix)
+        for obj in page.get("Contents", [])
+    ]
+
+
+def download_objects(objects: list[dict[str, Any]], relative_root: Path, dir_path: Path) -> None:
+    """オブジェクトをスレッドプールで並列にダウンロード"""
+
+    def download(obj: dict[str, Any]) -> tuple[str, dict[str, Any]]:
+        local_path = dir_path / Path(obj["Key"]).relative_to(relative_root)
+        local_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = local_path.with_name(local_path.name + ".tmp")
+        s3.download_file(Bucket=os.getenv("PRJ_ID"), Key=obj["Key"], Filename=str(tmp), Config=TRANSFER_CONFIG)
+        tmp.replace(local_path)
+        return local_path.relative_to(dir_path).as_posix(), file_entry(local_path)
+
+    update_manifest(dir_path, dict(s3_pool.map(download, objects)))
+
+
+def read_s3_range(key: str, start: int, stop: int) -> bytes:
+    """[start, stop) バイトを HTTP Range で読む"""
+    response = s3.get_object(Bucket=os.getenv("PRJ_ID"), Key=key, Range=f"bytes={start}-{stop - 1}")
+    return response["Body"].read()
 
 
 def pull_all_from_s3(dir_path: Path, exp_id: int, run_id: str) -> None:
     if not dir_path.exists():
-        bucket = os.getenv("PRJ_ID")
         prefix = f"chain/experiments/{exp_id}/{run_id}/"
-        relative_root = Path(prefix)
-        response = s3.list_objects_v2(Bucket=bucket, Prefix=prefix)
-        contents = response.get("Contents", [])
-        if not contents:
-            return
-        for obj in contents:
-            s3_key = obj["Key"]
-            relative_path = Path(s3_key).relative_to(relative_root)
-            local_path = dir_path / relative_path
-            local_path.parent.mkdir(parents=True, exist_ok=True)
-            s3.download_file(Bucket=bucket, Key=s3_key, Filename=str(local_path))
+        download_objects(list_s3_objects(prefix), Path(prefix), dir_path)
+
+
+def have_path(path: Path) -> Path:
+    """S3 から取得済みのチャンクの記録（loss.chm -> loss.have, loss.lod2 -> loss.lod2.have）"""
+    return path.with_suffix(".have") if path.suffix == SUFFIX else path.with_name(path.name + ".have")
+
+
+def path_lock(path: Path) -> Lock:
+    """path を S3 から取ってくる処理（疎なファイルと `.have` の読み書き）を直列にするロック"""
+    with fetch_lock:
+        return fetch_locks.setdefault(path, Lock())
+
+
+def fetch_sparse(path: Path, size: int) -> None:
+    """S3 のメトリクスファイルの header と footer だけを Range で読み、同じサイズの疎なファイルとして置く
+
+    行は ensure_rows で必要なチャンクだけ後から埋める（取得済みのチャンクは `.have` に記録）。
+    path_lock(path) を取って呼ぶ。
+    """
+    key = s3_key(path)
+    header = Header.unpack(read_s3_range(key, 0, HEADER_SIZE))
+    if not header.footer_offset:
+        # 索引がない（閉じられていない）ファイルは丸ごと取る
+        download_objects([{"Key": key}], Path(s3_key(path.parent)), path.parent)
+        return
+    footer = read_s3_range(key, header.footer_offset, size)
+    n_chunks = len(unpack_footer(footer))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(header.pack())
+        f.seek(header.footer_offset)
+        f.write(footer)
+    np.zeros(n_chunks, dtype=np.uint8).tofile(have_path(path))
+    tmp.replace(path)
+
+
+def fetch_metric(experiment_id: int, run_id: str, metric: str) -> bool:
+    """メトリクス1つ分だけを S3 から取ってくる
+
+    生データは fetch_sparse で header と footer だけを置く。LOD は S3 にあることだけをマニフェストに記録し、
+    open_lod で初めて使うときに同じように取ってくる。
+    """
+    prefix = f"chain/experiments/{experiment_id}/{run_id}/"
+    run_path = DATA_DIR / str(experiment_id) / run_id
+    name = f"{metric}{SUFFIX}"
+    objects = list_s3_objects(prefix + f"{metric}.")
+    raw = next((obj for obj in objects if obj["Key"] == prefix + name), None)
+    if raw is None:
+        return False
+    fetch_sparse(run_path / name, raw["Size"])
+    lods = [obj for obj in objects if re.fullmatch(rf"{re.escape(metric)}\.lod\d+", Path(obj["Key"]).name)]
+    update_manifest(run_path, {Path(obj["Key"]).name: {"size": obj["Size"], "remote": True} for obj in lods})
+    return True
+
+
+def open_lod(file: MetricFile, level: int) -> MetricFile | None:
+    """LOD の level を開く。手元になく S3 にあれば（fetch_metric でマニフェストに記録済み）ここで取ってくる"""
+    path = lod_path(file.path, level)
+    if not path.exists():
+        with path_lock(path):
+            entry = read_manifest(path.parent).get(path.name)
+            if not path.exists() and entry is not None and entry.get("remote"):
+                try:
+                    fetch_sparse(path, entry["size"])
+                except (BotoCoreError, ClientError):
+                    logger.exception(f"Failed to fetch {path.name} from S3")
+    return read_metric_file(path)
+
+
+def ensure_rows(file: MetricFile, start: int = 0, stop: int | None = None) -> np.ndarray:
+    """[start, stop) 行のチャンクが手元になければ S3 から Range で並列に取ってきて、その行を返す"""
+    stop = file.n_rows if stop is None else stop
+    have_file = have_path(file.path)
+    if start < stop and have_file.exists():
+        with path_lock(file.path):
+            fetch_rows(file, have_file, start, stop)
+    return file.rows(start, stop)
+
+
+def fetch_rows(file: MetricFile, have_file: Path, start: int, stop: int) -> None:
+    """[start, stop) 行の未取得のチャンクを並列に取ってきて `.have` に記録する（path_lock(file.path) を取って呼ぶ）"""
+    if not have_file.exists():
+        return  # 待っている間に別のスレッドが取り終えた
+    chunk_rows, header = file.header.chunk_rows, file.header
+    have = np.fromfile(have_file, dtype=np.uint8)
+    missing = [i for i in range(start // chunk_rows, -(-stop // chunk_rows)) if i < len(have) and not have[i]]
+    if not missing:
+        return
+    key = s3_key(file.path)
+
+    def fetch(i: int) -> None:
+        first, last = header.row_offset(i * chunk_rows), header.row_offset(min((i + 1) * chunk_rows, file.n_rows))
+        data = read_s3_range(key, first, last)
+        fd = os.open(file.path, os.O_WRONLY)
+        try:
+            os.pwrite(fd, data, first)
+        finally:
+            os.close(fd)
+
+    list(s3_pool.map(fetch, missing))
+    have[missing] = 1
+    if have.all():
+        have_file.unlink()
+        update_manifest(file.path.parent, {file.path.name: file_entry(file.path)})
+    else:
+        have.tofile(have_file)
+
+
+##########################################
+# ローカルキャッシュ
+##########################################
+def touch_run(run_path: Path, hit: bool) -> None:
+    with cache_lock:
+        run_access[run_path] = time.time()
+        cache_stats["hits" if hit else "misses"] += 1
+
+
+def run_usage(run_path: Path) -> tuple[int, float]:
+    """run ディレクトリがディスク上で使っているバイト数（疎なファイルは実際に書いた分）と最終更新時刻"""
+    size, mtime = 0, run_path.stat().st_mtime
+    for path in run_path.rglob("*"):
+        stat = path.stat()
+        size += stat.st_blocks * 512
+        mtime = max(mtime, stat.st_mtime)
+    return size, mtime
+
+
+def is_evictable(run_path: Path) -> bool:
+    """すべてのファイルが S3 と同じ内容（マニフェストどおり）の run だけ手元から消してよい"""
+    manifest = read_manifest(run_path)
+    return bool(manifest) and all(
+        is_synced(file_entry(path), manifest.get(path.relative_to(run_path).as_posix(), {}))
+        for path in push_targets(run_path)
+    )
+
+
+def evicted_path(run_path: Path) -> Path:
+    """手元から消した run の印（サーバを再起動しても残す）"""
+    return run_path.with_name(f"{run_path.name}.remote")
+
+
+def restore_run(run_path: Path) -> None:
+    """手元から消した run に書き込みが来たら、開く前に S3 から丸ごと取り直す（HandleCache.restore）
+
+    空のファイルを作って追記すると、次の push で S3 にある完全なファイルを上書きしてしまう。
+    ダッシュボードが取りかけた疎なファイルも、追記できるように全体を取り直す。
+    """
+    marker = evicted_path(run_path)
+    if not marker.exists():
+        return
+    prefix = f"chain/experiments/{run_path.parent.name}/{run_path.name}/"
+    for obj in list_s3_objects(prefix):
+        path = run_path / Path(obj["Key"]).relative_to(prefix)
+        with path_lock(path):
+            download_objects([obj], Path(prefix), run_path)
+            have_path(path).unlink(missing_ok=True)
+    marker.unlink()
+    logger.info(f"Restored evicted run {run_path.name} from S3 before writing")
+
+
+def remove_run(run_path: Path, handles: HandleCache | None = None) -> bool:
+    """書き込み中でなく S3 に上がっている run を消す。書き込みと競合しないよう handles の lock の中で確かめる"""
+    with handles.lock if handles is not None else nullcontext():
+        if handles is not None and (run_path.parent.name, run_path.name) in handles.runs():
+            return False
+        if not is_evictable(run_path):
+            return False
+        trash = run_path.with_name(f".{run_path.name}.evicted")
+        run_path.rename(trash)
+        evicted_path(run_path).touch()
+        if handles is not None:
+            handles.dirs.discard(run_path)
+    shutil.rmtree(trash, ignore_errors=True)
+    return True
+
+
+def evict_runs(budget: int = CACHE_BYTES, handles: HandleCache | None = None) -> list[Path]:
+    """DATA_DIR の使用量が budget を超えていれば、最後に使われたのが古い run から消す"""
+    runs = []
+    for run_path in DATA_DIR.glob("*/*"):
+        if not run_path.is_dir():
+            continue
+        if run_path.name.startswith("."):
+            # 前回消しきれなかったもの
+            shutil.rmtree(run_path, ignore_errors=True)
+            continue
+        try:
+            size, mtime = run_usage(run_path)
+        except FileNotFoundError:
+            continue
+        with cache_lock:
+            accessed = run_access.get(run_path, mtime)
+        runs.append((accessed, size, run_path))
+
+    total = sum(size for _, size, _ in runs)
+    evicted = []
+    for _, size, run_path in sorted(runs):
+        if total <= budget:
+            break
+        try:
+            if not remove_run(run_path, handles):
+                continue
+        except FileNotFoundError:
+            continue
+        total -= size
+        evicted.append(run_path)
+        with cache_lock:
+            run_access.pop(run_path, None)
+            cache_stats["evicted_runs"] += 1
+            cache_stats["evicted_bytes"] += size
+        logger.info(f"Evicted {run_path} ({size} bytes) from the local cache")
+    return evicted
+
+
+def cache_worker(handles: HandleCache | None) -> None:
+    while True:
+        time.sleep(EVICT_INTERVAL)
+        try:
+            evict_runs(CACHE_BYTES, handles)
+        except Exception:
+            logger.exception("Failed to evict runs from the local cache")
+
+
+def start_cache_eviction(handles: HandleCache | None = None) -> None:
+    """バックグラウンドで定期的に evict_runs する
+
+    handles を渡すと書き込み中の run は消さず、消した run に書き込みが来たら S3 から戻してから開く。
+    """
+    if handles is not None:
+        handles.restore = restore_run
+    Thread(target=cache_worker, args=(handles,), daemon=True).start()
+
+
+def get_cache_stats() -> dict[str, Any]:
+    with cache_lock:
+        return {**cache_stats, "budget": CACHE_BYTES}
 
 
 ##########################################
@@ -225,7 +1305,16 @@ def check_prj_id(prj_id: str) -> None:
 ##########################################
 # 図関連
 ##########################################
-def save_plot_state(experiment_id: int, run_id: str, plot_id: str, metric: str = "", dim: int = 1):
+def save_plot_state(
+    experiment_id: int,
+    run_id: str,
+    plot_id: str,
+    metric: str = "",
+    dim: int = 1,
+    transform: str | None = None,
+    param: float | None = None,
+    plot_type: str = "lines",
+) -> None:
     if metric == "":
         metrics_list = list_metrics(experiment_id, run_id)
         if not metrics_list:
@@ -236,7 +1325,7 @@ def save_plot_state(experiment_id: int, run_id: str, plot_id: str, metric: str =
     dim = max(1, min(dim, n_dim))
 
     state = {
-        "type": "lines",
+        "type": plot_type,
         "experiment_id": experiment_id,
         "run_id": run_id,
         "plot_id": plot_id,
@@ -246,6 +1335,8 @@ def save_plot_state(experiment_id: int, run_id: str, plot_id: str, metric: str =
                 "option": {
                     "dim": dim,
                     "n_dim": n_dim,
+                    "transform": transform,
+                    "param": param,
                 },
             }
         ],
@@ -253,16 +1344,148 @@ def save_plot_state(experiment_id: int, run_id: str, plot_id: str, metric: str =
     update_plot_state(run_id, state)
 
 
-def generate_plot(experiment_id: int, run_id: str, metric: str, n_dim: int = 1, dim: int = 1):
+def typed_array(values: np.ndarray) -> dict[str, Any]:
+    """配列を plotly.js の typed array 表現 (base64 の bdata) にする（JSON の数値リストより小さく、速く読める）"""
+    values = np.asarray(values)
+    if values.dtype.kind in "iu" and values.dtype.itemsize > 4:
+        # plotly.js は 64bit 整数を読めない
+        fits = values.size == 0 or (values.min() >= np.iinfo(np.int32).min and values.max() <= np.iinfo(np.int32).max)
+        values = values.astype(np.int32 if fits else np.float64)
+    elif values.dtype.kind == "f" and values.dtype.itemsize < 4:
+        values = values.astype(np.float32)
+    elif values.dtype.kind not in "iuf":
+        values = values.astype(np.float64)
+    values = np.ascontiguousarray(values, dtype=values.dtype.newbyteorder("<"))
+    spec = {"dtype": values.dtype.str[1:], "bdata": base64.b64encode(values.tobytes()).decode()}
+    if values.ndim > 1:
+        spec["shape"] = ", ".join(map(str, values.shape))
+    return spec
+
+
+def scatter_type(n_points: int) -> type:
+    """図全体の点数が多いときは WebGL で描く"""
+    return go.Scattergl if n_points > GL_POINTS else go.Scatter
+
+
+def generate_plot(
+    experiment_id: int,
+    run_id: str,
+    metric: str,
+    n_dim: int = 1,
+    dim: int = 1,
+    step_range: tuple[int | None, int | None] = (None, None),
+    max_points: int = MAX_POINTS,
+    transform: tuple[str, float | None] | None = None,
+) -> dict[str, Any]:
     try:
-        data = get_data(experiment_id, run_id, metric)
-        data = data.reshape((-1, n_dim))
-        x = np.arange(data.shape[0])
-        lines = [go.Scatter(x=x, y=data[:, i], mode="lines", name=f"{metric} dim{i + 1}") for i in range(dim)]
-        return {"data": lines, "layout": {"title": f"{metric} for Run {run_id}", "height": 300}}
+        if transform is None:
+            x, lower, upper, mean = get_cached_envelope(experiment_id, run_id, metric, dim, step_range, max_points)
+        else:
+            envelope = get_transformed_envelope(experiment_id, run_id, metric, dim, transform, step_range, max_points)
+            x, lower, upper, mean = envelope
+        lines = []
+        scatter, x_spec = scatter_type(3 * mean.size), typed_array(x)
+        for i in range(lower.shape[1]):
+            if not np.array_equal(lower[:, i], upper[:, i], equal_nan=True):
+                # 間引いた区間の min/max を帯で描く
+                band = {"mode": "lines", "line": {"width": 0}, "showlegend": False, "hoverinfo": "skip"}
+                lines.append(scatter(x=x_spec, y=typed_array(lower[:, i]), **band))
+                lines.append(scatter(x=x_spec, y=typed_array(upper[:, i]), fill="tonexty", **band))
+            lines.append(scatter(x=x_spec, y=typed_array(mean[:, i]), mode="lines", name=f"{metric} dim{i + 1}"))
+        title = f"{metric} for Run {run_id}" + (f" ({transform_label(transform)})" if transform else "")
+        layout = {"title": title, "height": 300, "uirevision": f"{run_id}/{metric}"}
+        return {"data": lines, "layout": layout}
     except Exception as e:
         return {"data": [], "layout": {"title": f"{metric} (load error)", "height": 300}}
 
 
+def generate_heatmap(
+    experiment_id: int,
+    run_id: str,
+    metric: str,
+    step_range: tuple[int | None, int | None] = (None, None),
+    max_points: int = MAX_POINTS,
+    agg: str = "mean",
+) -> dict[str, Any]:
+    """全次元を1枚の画像 (Heatmap の trace 1本) で描く。次元数が多いメトリクス用"""
+    try:
+        heatmap = get_heatmap(experiment_id, run_id, metric, step_range, max_points, agg=agg)
+        lines = []
+        if heatmap["z"].size:
+            lines.append(
+                go.Heatmap(
+                    z=typed_array(heatmap["z"]),
+                    x=typed_array(heatmap["steps"]),
+                    y0=heatmap["y0"],
+                    dy=heatmap["dy"],
+                    colorscale="Viridis",
+                    hovertemplate="step %{x:.0f}<br>dim %{y:.0f}<br>%{z}<extra></extra>",
+                )
+            )
+        layout = {
+            "title": f"{metric} for Run {run_id} ({heatmap['dim']} dims, {agg})",
+            "height": 300,
+            "uirevision": f"{run_id}/{metric}/heatmap",
+            "yaxis": {"title": "dim"},
+        }
+        return {"data": lines, "layout": layout}
+    except Exception:
+        logger.exception(f"Failed to draw the heatmap of {metric} for run {run_id}")
+        return {"data": [], "layout": {"title": f"{metric} (load error)", "height": 300}}
+
+
+def generate_sweep_plot(
+    experiment_id: int,
+    parent_id: str,
+    metric: str,
+    dim: int = 1,
+    goal: str = "min",
+    max_points: int = MAX_POINTS,
+    max_overlay: int = 50_000,
+) -> dict[str, Any]:
+    """子 run を重ねた図: 各 run の線（薄く）、分位点の帯、中央値、sweep 全体の best-so-far"""
+    try:
+        sweep = get_sweep(experiment_id, parent_id, metric, dim, goal, max_points)
+        values, q = sweep["values"], {k: typed_array(v.astype(np.float32)) for k, v in sweep["quantiles"].items()}
+        lines = []
+        if values.size:
+            # 全 run を NaN で区切った1本の trace にまとめる
+            stride = max(1, -(-values.size // max_overlay))
+            overlay = np.hstack([values[:, ::stride], np.full((len(values), 1), np.nan, np.float32)])
+            xs = np.tile(np.append(sweep["steps"][::stride], np.nan), len(values))
+            x = typed_array(sweep["steps"])
+            lines.append(
+                scatter_type(overlay.size)(
+                    x=typed_array(xs),
+                    y=typed_array(overlay.ravel()),
+                    mode="lines",
+                    line={"width": 1, "color": "rgba(120, 120, 120, 0.25)"},
+                    name=f"runs ({len(values)})",
+                    hoverinfo="skip",
+                )
+            )
+            for low, high, alpha in ((0.1, 0.9, 0.15), (0.25, 0.75, 0.3)):
+                band = {"mode": "lines", "line": {"width": 0}, "showlegend": False, "hoverinfo": "skip"}
+                lines.append(go.Scatter(x=x, y=q[low], **band))
+                lines.append(
+                    go.Scatter(x=x, y=q[high], fill="tonexty", fillcolor=f"rgba(31, 119, 180, {alpha})", **band)
+                )
+            lines.append(go.Scatter(x=x, y=q[0.5], mode="lines", name="median", line={"color": "#1f77b4"}))
+            lines.append(
+                go.Scatter(
+                    x=x, y=typed_array(sweep["best"]), mode="lines", name=f"best ({goal})", line={"color": "#d62728"}
+                )
+            )
+        layout = {
+            "title": f"{metric} dim{dim} over {len(sweep['runs'])} runs",
+            "height": 400,
+            "uirevision": f"sweep/{parent_id}/{metric}",
+        }
+        return {"data": lines, "layout": layout}
+    except Exception:
+        logger.exception(f"Failed to aggregate {metric} over the children of {parent_id}")
+        return {"data": [], "layout": {"title": f"{metric} (load error)", "height": 400}}
+
+
 if __name__ == "__main__":
     pass
@@ -0,0 +1,204 @@
+import importlib.util
+import io
+from collections.abc import Buffer, Iterator
+from typing import NamedTuple
+
+import numpy as np
+from chaser.metric_file import MetricFile
+
+from .engine import ensure_rows, find_rows, get_step_order, list_runs_hierarchy, locate_rows, open_metric
+
+EXPORT_ROWS = 1 << 16  # 一度に読んで送る行数
+FORMATS = {
+    "npy": "application/octet-stream",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+class ExportPart(NamedTuple):
+    """書き出す (run, metric) 1つ分。rows は step 順に読む行（範囲か、並び替えた行番号）"""
+
+    run_id: str
+    metric: str
+    file: MetricFile
+    rows: slice | np.ndarray
+    dims: list[int]
+
+    @property
+    def n_rows(self) -> int:
+        return self.rows.stop - self.rows.start if isinstance(self.rows, slice) else len(self.rows)
+
+
+def parse_dims(text: str | None) -> slice | list[int]:
+    """ "0,2" や "1:3" 形式（0 始まり）の次元指定"""
+    if not text:
+        return slice(None)
+    if ":" in text:
+        start, _, stop = text.partition(":")
+        return slice(int(start) if start else None, int(stop) if stop else None)
+    return [int(d) for d in text.split(",")]
+
+
+def plan_export(
+    experiment_id: int,
+    run_ids: list[str] | None,
+    metrics: list[str],
+    step_min: int | None = None,
+    step_max: int | None = None,
+    dims: slice | list[int] = slice(None),
+    parent_id: str | None = None,
+) -> list[ExportPart]:
+    """書き出す run × metric と行範囲を決める（行はまだ読まない。範囲は footer の索引から求める）"""
+    if run_ids is None:
+        hierarchy = list_runs_hierarchy(experiment_id)
+        runs = hierarchy.get(parent_id, []) if parent_id else [run for group in hierarchy.values() for run in group]
+        run_ids = [run["id"] for run in runs]
+    parts = []
+    for run_id in run_ids:
+        for metric in metrics:
+            if (file := open_metric(experiment_id, run_id, metric)) is None:
+                continue
+            columns = list(range(file.dim))[dims] if isinstance(dims, slice) else dims
+            if any(not 0 <= d < file.dim for d in columns):
+                raise ValueError(f"dims {columns} out of range for {metric} of run {run_id} (dim={file.dim})")
+            rows: slice | np.ndarray
+            if file.unsorted:
+                steps = ensure_rows(file)["step"]
+                order = get_step_order(experiment_id, run_id, metric, steps)
+                rows = order[find_rows(steps[order], step_min, step_max)]
+            else:
+                rows = locate_rows(file, step_min, step_max)
+            parts.append(ExportPart(run_id, metric, file, rows, columns))
+    return parts
+
+
+def iter_rows(part: ExportPart) -> Iterator[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """(steps, times, values[:, dims]) を EXPORT_ROWS 行ずつ返す"""
+    if isinstance(part.rows, slice):
+        for start in range(part.rows.start, part.rows.stop, EXPORT_ROWS):
+            rows = ensure_rows(part.file, start, min(start + EXPORT_ROWS, part.rows.stop))
+            yield rows["step"], rows["time"], rows["value"][:, part.dims].astype(np.float32)
+    else:
+        data = ensure_rows(part.file)
+        for start in range(0, len(part.rows), EXPORT_ROWS):
+            rows = data[part.rows[start : start + EXPORT_ROWS]]
+            yield rows["step"], rows["time"], rows["value"][:, part.dims].astype(np.float32)
+
+
+def export_npy(parts: list[ExportPart]) -> Iterator[bytes]:
+    """1つの構造化配列 (run, metric, step, time, value[n_dims]) の .npy として書き出す
+
+    行数は先に分かっているので header を最初に書き、あとは行を順に流す。次元数はそろっている必要がある。
+    """
+    n_dims = {len(part.dims) for part in parts}
+    dtype = np.dtype(
+        [
+            ("run", f"S{max((len(p.run_id) for p in parts), default=1)}"),
+            ("metric", f"S{max((len(p.metric.encode()) for p in parts), default=1)}"),
+            ("step", "<i8"),
+            ("time", "<f8"),
+            ("value", "<f4", (n_dims.pop() if n_dims else 0,)),
+        ]
+    )
+    header = io.BytesIO()
+    np.lib.format.write_array_header_2_0(
+        header,
+        {
+            "descr": np.lib.format.dtype_to_descr(dtype),
+            "fortran_order": False,
+            "shape": (sum(p.n_rows for p in parts),),
+        },
+    )
+    yield header.getvalue()
+    for part in parts:
+        for steps, times, values in iter_rows(part):
+            out = np.empty(len(steps), dtype=dtype)
+            out["run"], out["metric"] = part.run_id.encode(), part.metric.encode()
+            out["step"], out["time"], out["value"] = steps, times, values
+            yield out.tobytes()
+
+
+class ChunkSink(io.RawIOBase):
+    """pyarrow の書き込み先。書かれたバイト列をためておき、呼び出し側が少しずつ取り出して送る"""
+
+    def __init__(self) -> None:
+        self.chunks: list[bytes] = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Buffer) -> int:
+        chunk = bytes(data)
+        self.chunks.append(chunk)
+        self.position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        return self.position
+
+    def drain(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+def export_arrow(parts: list[ExportPart], fmt: str = "arrow") -> Iterator[bytes]:
+    """Arrow IPC ストリーム、または Parquet（EXPORT_ROWS 行ごとの row group）として書き出す"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    n_dims = {len(part.dims) for part in parts}
+    value_type = pa.list_(pa.float32(), n_dims.pop()) if len(n_dims) == 1 else pa.list_(pa.float32())
+    schema = pa.schema(
+        [
+            ("run", pa.dictionary(pa.int32(), pa.string())),
+            ("metric", pa.dictionary(pa.int32(), pa.string())),
+            ("step", pa.int64()),
+            ("time", pa.float64()),
+            ("value", value_type),
+        ]
+    )
+    sink = ChunkSink()
+    writer = pa.ipc.new_stream(sink, schema) if fmt == "arrow" else pq.ParquetWriter(sink, schema)
+    for part in parts:
+        for steps, times, values in iter_rows(part):
+            n = len(steps)
+            flat = pa.array(values.ravel(), type=pa.float32())
+            if pa.types.is_fixed_size_list(value_type):
+                value = pa.FixedSizeListArray.from_arrays(flat, len(part.dims))
+            else:
+                value = pa.ListArray.from_arrays(
+                    np.arange(0, n * len(part.dims) + 1, len(part.dims), dtype=np.int32), flat
+                )
+            batch = pa.record_batch(
+                [
+                    pa.DictionaryArray.from_arrays(np.zeros(n, np.int32), pa.array([part.run_id])),
+                    pa.DictionaryArray.from_arrays(np.zeros(n, np.int32), pa.array([part.metric])),
+                    pa.array(steps, type=pa.int64()),
+                    pa.array(times, type=pa.float64()),
+                    value,
+                ],
+                schema=schema,
+            )
+            writer.write_batch(batch)
+            yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def export_stream(parts: list[ExportPart], fmt: str) -> Iterator[bytes]:
+    """書き出しのジェネレータを返す。送り始めてからは失敗を返せないので、条件はここで先に確かめる"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r} (choose from {', '.join(FORMATS)})")
+    if fmt == "npy":
+        if len({len(part.dims) for part in parts}) > 1:
+            raise ValueError("npy export needs the same number of dims for every metric")
+        return export_npy(parts)
+    if importlib.util.find_spec("pyarrow") is None:
+        raise ValueError(f"{fmt} export needs pyarrow")
+    return export_arrow(parts, fmt)
+
+
+if __name__ == "__main__":
+    pass
@@ -1,6 +1,6 @@
 from typing import Any
 
-from dash import dcc, html
+from dash import dash_table, dcc, html
 
 
 def get_layout() -> Any:
@@ -9,6 +9,8 @@ def get_layout() -> Any:
             # Run選択・Plot管理用のメモリストア
             dcc.Store(id="selected-run", storage_type="memory"),
             dcc.Store(id="plots-store", storage_type="memory", data={}),
+            # 図の描画幅（px）。表示する点数の目安に使う
+            dcc.Store(id="viewport-width", storage_type="memory"),
             html.Div(
                 style={"display": "flex", "height": "100vh", "fontFamily": "Arial, sans-serif"},
                 children=[
@@ -78,6 +80,100 @@ def get_layout() -> Any:
                         },
                         children=[
                             html.H3("Select an experiment and a run from the left."),
+                            # ライブ追従: 各図に追記分だけを extendData で送る
+                            dcc.Checklist(
+                                id="live-follow",
+                                options=[{"label": " Live follow", "value": "on"}],
+                                value=[],
+                                style={"fontSize": "15px"},
+                            ),
+                            # run ごとの要約統計（ingest 時に集計したもの）。列の見出しで並べ替えられる
+                            html.Div(
+                                id="run-table-container",
+                                style={"display": "none"},
+                                children=[
+                                    html.H4("Runs", style={"marginTop": "20px", "color": "#555"}),
+                                    html.Div(
+                                        [
+                                            dcc.Dropdown(
+                                                id="table-metric",
+                                                options=[],
+                                                clearable=False,
+                                                style={"width": "200px", "fontSize": "16px"},
+                                            ),
+                                            dcc.Input(
+                                                id="table-dim",
+                                                type="number",
+                                                min=1,
+                                                step=1,
+                                                value=1,
+                                                style={"width": "60px", "height": "34px", "marginLeft": "12px"},
+                                            ),
+                                        ],
+                                        style={"display": "flex", "alignItems": "center", "marginBottom": "10px"},
+                                    ),
+                                    dash_table.DataTable(
+                                        id="run-table",
+                                        columns=[
+                                            {"name": "Run", "id": "run"},
+                                            {"name": "Parent", "id": "parent"},
+                                            {"name": "Rows", "id": "rows", "type": "numeric"},
+                                            {"name": "Last step", "id": "last_step", "type": "numeric"},
+                                            {"name": "Last", "id": "last", "type": "numeric"},
+                                            {"name": "Min", "id": "min", "type": "numeric"},
+                                            {"name": "Max", "id": "max", "type": "numeric"},
+                                            {"name": "Mean", "id": "mean", "type": "numeric"},
+                                            {"name": "NaN", "id": "nan_count", "type": "numeric"},
+                                        ],
+                                        data=[],
+                                        sort_action="native",
+                                        filter_action="native",
+                                        page_size=15,
+                                        style_table={"overflowX": "auto"},
+                                        style_cell={"fontSize": "14px", "padding": "4px 8px", "textAlign": "right"},
+                                    ),
+                                ],
+                            ),
+                            # 子 run（Optuna の trial など）を持つ run を選んだときだけ出す sweep の集計図
+                            html.Div(
+                                id="sweep-container",
+                                style={"display": "none"},
+                                children=[
+                                    html.H4("Sweep", style={"marginTop": "20px", "color": "#555"}),
+                                    html.Div(
+                                        [
+                                            dcc.Dropdown(
+                                                id="sweep-metric",
+                                                options=[],
+                                                clearable=False,
+                                                style={"width": "200px", "fontSize": "16px"},
+                                            ),
+                                            dcc.Input(
+                                                id="sweep-dim",
+                                                type="number",
+                                                min=1,
+                                                step=1,
+                                                value=1,
+                                                style={"width": "60px", "height": "34px", "marginLeft": "12px"},
+                                            ),
+                                            dcc.RadioItems(
+                                                id="sweep-goal",
+                                                options=[
+                                                    {"label": " minimize", "value": "min"},
+                                                    {"label": " maximize", "value": "max"},
+                                                ],
+                                                value="min",
+                                                inline=True,
+                                                style={"marginLeft": "12px", "fontSize": "15px"},
+                                            ),
+                                        ],
+                                        style={"display": "flex", "alignItems": "center", "gap": "8px"},
+                                    ),
+                                    dcc.Graph(id="sweep-graph", figure={"data": [], "layout": {"height": 400}}),
+                                    # 新しい trial が終わったら図に反映する
+                                    dcc.Interval(id="sweep-interval", interval=10000, disabled=True),
+                                ],
+                            ),
                             html.Div(id="plots-container", style={"marginTop": "20px"}),
                         ],
                     ),
@@ -1,6 +1,7 @@
 from datetime import UTC, datetime
 
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, Text
+from sqlalchemy import BigInteger, Column, DateTime, Float, ForeignKey, Integer, String, Text, UniqueConstraint
+from sqlalchemy.dialects import mysql
 from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
@@ -29,6 +30,7 @@ class RunORM(Base):
 
     experiment = relationship("ExperimentORM", back_populates="runs")
     tags = relationship("TagORM", back_populates="run", cascade="all, delete-orphan")
+    metrics = relationship("MetricORM", back_populates="run", cascade="all, delete-orphan")
 
 
 class TagORM(Base):
@@ -43,5 +45,29 @@ class TagORM(Base):
     run = relationship("RunORM", back_populates="tags")
 
 
+class MetricORM(Base):
+    __tablename__ = "metrics"
+    __table_args__ = (UniqueConstraint("run_id", "key"),)
+
+    num = Column(Integer, primary_key=True, autoincrement=True)
+    run_id = Column(String(100), ForeignKey("runs.id"), nullable=False)
+    key = Column(String(100), nullable=False)
+    dim = Column(Integer, nullable=False, default=1)
+    dtype = Column(String(8), nullable=False, default="<f4")
+    count = Column(BigInteger, nullable=False, default=0)
+    size = Column(BigInteger, nullable=False, default=0)
+    # 1次元目の要約統計（run の並べ替え用）。全次元分は stats に JSON で持つ
+    last_value = Column(Float)
+    min_value = Column(Float)
+    max_value = Column(Float)
+    mean_value = Column(Float)
+    nan_count = Column(BigInteger, nullable=False, default=0)
+    # 次元数に比例して大きくなる（1024次元で 100KB 程度）ので、MySQL / MariaDB では 64KB までの TEXT にしない
+    stats = Column(Text().with_variant(mysql.LONGTEXT(), "mysql", "mariadb"))
+    date = Column(DateTime, nullable=False, default=lambda: datetime.now(UTC))
+
+    run = relationship("RunORM", back_populates="metrics")
+
+
 if __name__ == "__main__":
     pass
@@ -1,7 +1,21 @@
 from dash import dcc, html
 
+from .transform import TRANSFORMS
 
-def plot_card(plot_id, figure, all_metrics, metric, n_dim: int = 1, dim: int = 1):
+
+def plot_card(
+    plot_id,
+    figure,
+    all_metrics,
+    metric,
+    n_dim: int = 1,
+    dim: int = 1,
+    offset=None,
+    live: bool = False,
+    transform: str | None = None,
+    param=None,
+    plot_type: str = "lines",
+):
     return html.Div(
         [
             html.Div(
@@ -37,6 +51,53 @@ def plot_card(plot_id, figure, all_metrics, metric, n_dim: int = 1, dim: int = 1
                             "boxShadow": "none",
                         },
                     ),
+                    # lines: 先頭 dim 次元の線 / heatmap: 全次元を step × 次元の画像で
+                    dcc.Dropdown(
+                        id={"type": "plot-type", "index": plot_id},
+                        options=[{"label": "lines", "value": "lines"}, {"label": "heatmap", "value": "heatmap"}],
+                        value=plot_type,
+                        clearable=False,
+                        style={
+                            "width": "120px",
+                            "height": "40px",
+                            "fontSize": "16px",
+                            "borderRadius": "8px",
+                            "marginLeft": "12px",
+                        },
+                    ),
+                    # 平滑化などの変換（なしなら生データ）。param は EMA の係数か窓の行数
+                    dcc.Dropdown(
+                        id={"type": "transform-dropdown", "index": plot_id},
+                        options=[{"label": t["label"], "value": kind} for kind, t in TRANSFORMS.items()],
+                        value=transform,
+                        placeholder="raw",
+                        style={
+                            "width": "170px",
+                            "height": "40px",
+                            "fontSize": "16px",
+                            "borderRadius": "8px",
+                            "marginLeft": "12px",
+                        },
+                    ),
+                    dcc.Input(
+                        id={"type": "transform-param", "index": plot_id},
+                        type="number",
+                        min=0,
+                        value=param,
+                        placeholder="param",
+                        debounce=True,
+                        style={
+                            "width": "80px",
+                            "height": "40px",
+                            "fontSize": "16px",
+                            "borderRadius": "8px",
+                            "border": "1px solid #ccc",
+                            "marginLeft": "12px",
+                            "padding": "0 10px",
+                            "outline": "none",
+                            "boxShadow": "none",
+                        },
+                    ),
                     html.Button(
                         "✖",
                         id={"type": "delete-plot-btn", "index": plot_id},
@@ -76,6 +137,9 @@ def plot_card(plot_id, figure, all_metrics, metric, n_dim: int = 1, dim: int = 1
                 id={"type": "plot-update-dummy", "index": plot_id},
                 style={"display": "none"},
             ),
+            # ライブ追従用: 読み込み済みの行数と追記先の trace
+            dcc.Store(id={"type": "plot-offset", "index": plot_id}, data=offset),
+            dcc.Interval(id={"type": "live-interval", "index": plot_id}, interval=2000, disabled=not live),
         ],
         style={
             "padding": "10px",
@@ -0,0 +1,132 @@
+from typing import Any
+
+import numpy as np
+
+# 図に描く前にかける変換。どれも前回までの結果と state があれば、追記された行だけから続きを計算できる。
+#   ema:          y[t] = a * y[t-1] + (1 - a) * x[t]（a は TensorBoard の smoothing と同じ、0 <= a < 1）
+#   rolling_mean: 直近 window 行の平均（始めの window - 1 行はある分だけ）
+#   rolling_std:  直近 window 行の標準偏差 (ddof=0)
+#   cummax/cummin: それまでの最大・最小
+# NaN は欠測として飛ばす（ema・cummax/cummin は直前の値を保ち、rolling は窓内の NaN 以外で計算する）。
+TRANSFORMS: dict[str, dict[str, Any]] = {
+    "ema": {"label": "EMA", "param": 0.6},
+    "rolling_mean": {"label": "rolling mean", "param": 50},
+    "rolling_std": {"label": "rolling std", "param": 50},
+    "cummax": {"label": "cumulative max", "param": None},
+    "cummin": {"label": "cumulative min", "param": None},
+}
+EMA_BLOCK = 4096  # ema を閉じた式で計算する区間の最大長
+
+
+def parse_transform(kind: str | None, param: Any = None) -> tuple[str, float | None] | None:
+    """UI の値を (kind, param) にそろえる。変換なしは None"""
+    if not kind or kind not in TRANSFORMS:
+        return None
+    default = TRANSFORMS[kind]["param"]
+    if default is None:
+        return kind, None
+    param = default if param is None or param == "" else float(param)
+    if kind == "ema":
+        return kind, min(max(param, 0.0), 0.999999)
+    return kind, float(max(1, int(param)))
+
+
+def transform_label(transform: tuple[str, float | None]) -> str:
+    kind, param = transform
+    label: str = TRANSFORMS[kind]["label"]
+    if param is None:
+        return label
+    return f"{label} {param:g}"
+
+
+def ema_column(x: np.ndarray, a: float, y0: float) -> np.ndarray:
+    """NaN を含まない1列の EMA（y0 は直前の値）
+
+    区間ごとに y[i] = a^(i+1) y0 + (1 - a) a^i cumsum(x[j] / a^j) で求める。a^-i が溢れないように区間を区切る。
+    """
+    if a == 0:
+        return x.copy()
+    block = int(np.clip(300 / -np.log(a), 1, EMA_BLOCK))
+    powers = a ** np.arange(block, dtype=np.float64)
+    out = np.empty_like(x)
+    for start in range(0, len(x), block):
+        part = x[start : start + block]
+        p = powers[: len(part)]
+        y = a * p * y0 + (1 - a) * p * np.cumsum(part / p)
+        out[start : start + len(part)] = y
+        y0 = y[-1]
+    return out
+
+
+def fill_forward(y: np.ndarray, valid: np.ndarray, before: float) -> np.ndarray:
+    """valid でない位置を直前の valid な値で埋める（先頭側は before）"""
+    index = np.maximum.accumulate(np.where(valid, np.arange(len(y)), -1))
+    return np.where(index >= 0, y[np.maximum(index, 0)], before)
+
+
+def apply_ema(x: np.ndarray, a: float, state: np.ndarray | None) -> tuple[np.ndarray, np.ndarray]:
+    last = np.full(x.shape[1], np.nan) if state is None else state
+    out = np.empty_like(x)
+    for d in range(x.shape[1]):
+        valid = ~np.isnan(x[:, d])
+        values = x[valid, d]
+        y = np.full(len(x), np.nan)
+        if len(values):
+            y0 = last[d] if not np.isnan(last[d]) else values[0]
+            y[valid] = ema_column(values, a, y0)
+        out[:, d] = fill_forward(y, valid, last[d])
+    return out, (out[-1].copy() if len(out) else last)
+
+
+def apply_rolling(x: np.ndarray, window: int, state: np.ndarray | None, std: bool) -> tuple[np.ndarray, np.ndarray]:
+    """state は直前の window - 1 行（窓の続きに使う）"""
+    tail = np.empty((0, x.shape[1])) if state is None else state
+    full = np.concatenate([tail, x])
+    valid = ~np.isnan(full)
+    # 分散の桁落ちを避けるために列ごとの代表値を引いてから和を取る
+    with np.errstate(all="ignore"):
+        center = np.nan_to_num(np.nanmean(full, axis=0)) if full.size else np.zeros(x.shape[1])
+    z = np.where(valid, full - center, 0.0)
+    zeros = np.zeros((1, x.shape[1]))
+    counts = np.concatenate([zeros, np.cumsum(valid, axis=0)])
+    sums = np.concatenate([zeros, np.cumsum(z, axis=0)])
+    end = np.arange(len(tail), len(full)) + 1
+    start = np.maximum(end - window, 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        n = counts[end] - counts[start]
+        mean = (sums[end] - sums[start]) / n
+        if std:
+            squares = np.concatenate([zeros, np.cumsum(z * z, axis=0)])
+            out = np.sqrt(np.maximum((squares[end] - squares[start]) / n - mean * mean, 0))
+        else:
+            out = mean + center
+    out[n == 0] = np.nan
+    return out, full[max(len(full) - (window - 1), 0) :] if window > 1 else full[:0]
+
+
+def apply_cumulative(x: np.ndarray, state: np.ndarray | None, maximum: bool) -> tuple[np.ndarray, np.ndarray]:
+    first = np.full((1, x.shape[1]), np.nan) if state is None else state[None]
+    ufunc = np.fmax if maximum else np.fmin
+    out = ufunc.accumulate(np.concatenate([first, x]), axis=0)[1:]
+    return out, (out[-1].copy() if len(out) else first[0])
+
+
+def apply_transform(
+    transform: tuple[str, float | None], x: np.ndarray, state: np.ndarray | None = None
+) -> tuple[np.ndarray, np.ndarray]:
+    """x (行, 次元の2次元配列) に変換をかけ、(結果, 続きを計算するための state) を返す"""
+    kind, param = transform
+    if param is None:
+        param = TRANSFORMS[kind]["param"]  # cummax / cummin では使わない
+    x = np.asarray(x, dtype=np.float64)
+    if kind == "ema":
+        out, state = apply_ema(x, param, state)
+    elif kind in ("rolling_mean", "rolling_std"):
+        out, state = apply_rolling(x, int(param), state, std=kind == "rolling_std")
+    else:
+        out, state = apply_cumulative(x, state, maximum=kind == "cummax")
+    return out.astype(np.float32), state
+
+
+if __name__ == "__main__":
+    pass
@@ -81,6 +81,10 @@ if chaser_uri == "":
     logger.warning(msg)
     click.secho(msg, fg="yellow", err=True)
 
+# chaser クライアントの調整用 (任意): [project.chain.chaser_options]
+# 送信バッファが溢れたときは既定で古いものから捨てる（buffer_policy。学習は止めない）。README の Chaser 操作を参照
+chaser_options = pyproject.get("project", {}).get("chain", {}).get("chaser_options", {})
+
 mlflow_uri = pyproject.get("project", {}).get("chain", {}).get("mlflow", "")
 if mlflow_uri == "":
     msg = "MLFlow URI is missing in pyproject.toml"
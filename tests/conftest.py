@@ -0,0 +1,27 @@
+import importlib
+import sys
+from pathlib import Path
+from types import ModuleType
+
+import pytest
+
+
+@pytest.fixture
+def chaser_engine(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> ModuleType:
+    """chaser コンテナの app/src/engine（コンテナと同じく chain.chaser_server を chaser として import する）
+
+    DATA_DIR は tmp_path に向け、変換・描画のキャッシュは空にしておく。
+    S3 には触らない（手元にないものは S3 にもない扱い）。
+    """
+    for name in ("boto3", "sqlalchemy", "plotly"):
+        pytest.importorskip(name)
+    monkeypatch.setenv("DB_STORAGE", f"sqlite:///{tmp_path / 'chaser.db'}")
+    if "chaser" not in sys.modules:
+        monkeypatch.setitem(sys.modules, "chaser", importlib.import_module("chain.chaser_server"))
+    engine = importlib.import_module("chain.server.docker.chaser.app.src.engine")
+    monkeypatch.setattr(engine, "DATA_DIR", tmp_path / "data")
+    monkeypatch.setattr(engine, "fetch_metric", lambda experiment_id, run_id, metric: False)
+    for cache in (engine.envelope_cache, engine.sweep_cache, engine.transform_cache, engine.heatmap_cache):
+        cache.clear()
+    engine.load_metric_file.cache_clear()
+    return engine
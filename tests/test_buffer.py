@@ -0,0 +1,104 @@
+import queue
+import threading
+import time
+
+import pytest
+
+from chain.core.chaser import MetricBuffer, Sample
+
+
+def sample(i: int, nbytes: int = 10) -> Sample:
+    return Sample("loss", float(i), i, 0.0, nbytes)
+
+
+def drain(buffer: MetricBuffer) -> list[int | None]:
+    steps: list[int | None] = []
+    while True:
+        try:
+            _, s = buffer.get(timeout=0)
+        except queue.Empty:
+            return steps
+        buffer.done()
+        steps.append(s.step)
+
+
+def test_unknown_policy() -> None:
+    with pytest.raises(ValueError):
+        MetricBuffer(policy="oldest")
+
+
+def test_drop_oldest() -> None:
+    buffer = MetricBuffer(max_bytes=50, policy="drop_oldest")
+    for i in range(8):
+        buffer.put("run", sample(i))
+    assert buffer.nbytes == 50
+    assert drain(buffer) == [3, 4, 5, 6, 7]
+    assert buffer.pop_counts("run") == (8, 3)
+    assert buffer.pop_counts("run") == (0, 0)
+
+
+def test_sample_thins_and_widens_stride() -> None:
+    buffer = MetricBuffer(max_bytes=40, policy="sample")
+    for i in range(5):
+        buffer.put("run", sample(i))
+    # 5 個目で溢れたので 1 つおきに間引き、受付間隔が 2 になる
+    assert buffer.stride == 2
+    buffer.put("run", sample(5))
+    buffer.put("run", sample(6))  # 受付間隔から外れて捨てられる
+    assert drain(buffer) == [0, 2, 4, 5]
+    assert buffer.pop_counts("run") == (7, 3)
+    assert buffer.stride == 1  # 空いたら元に戻る
+
+
+def test_block_waits_for_space() -> None:
+    buffer = MetricBuffer(max_bytes=20, policy="block")
+    buffer.put("run", sample(0))
+    buffer.put("run", sample(1))
+    done = threading.Event()
+
+    def put() -> None:
+        buffer.put("run", sample(2))
+        done.set()
+
+    threading.Thread(target=put, daemon=True).start()
+    time.sleep(0.1)
+    assert not done.is_set()
+    buffer.get(timeout=1)
+    buffer.done()
+    assert done.wait(timeout=1)
+    assert drain(buffer) == [1, 2]
+    assert buffer.pop_counts("run") == (3, 0)
+
+
+def test_block_drops_oldest_after_timeout() -> None:
+    buffer = MetricBuffer(max_bytes=20, policy="block", block_timeout=0.1)
+    buffer.put("run", sample(0))
+    buffer.put("run", sample(1))
+    start = time.monotonic()
+    buffer.put("run", sample(2))  # 誰も取り出さないので待ちきれずに古いものを捨てる
+    assert 0.1 <= time.monotonic() - start < 1
+    assert buffer.overflowed
+    assert drain(buffer) == [1, 2]
+    assert buffer.pop_counts("run") == (3, 1)
+    assert not buffer.overflowed
+
+
+def test_default_policy_never_blocks() -> None:
+    buffer = MetricBuffer(max_bytes=20)
+    start = time.monotonic()
+    for i in range(10):
+        buffer.put("run", sample(i))
+    assert time.monotonic() - start < 0.1
+    assert buffer.pop_counts("run") == (10, 8)
+
+
+def test_counts_and_take_are_per_owner() -> None:
+    buffer = MetricBuffer(max_bytes=30, policy="drop_oldest")
+    buffer.put("a", sample(0))
+    buffer.put("b", sample(1))
+    buffer.put("a", sample(2))
+    buffer.put("b", sample(3))  # a の 0 が捨てられる
+    assert [s.step for s in buffer.take("b")] == [1, 3]
+    assert buffer.nbytes == 10
+    assert buffer.pop_counts("a") == (2, 1)
+    assert buffer.pop_counts("b") == (2, 0)
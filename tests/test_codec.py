@@ -0,0 +1,106 @@
+import asyncio
+import importlib.util
+import itertools
+from collections.abc import AsyncIterator
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pytest
+
+from chain.chaser_server import metric_pb2
+from chain.chaser_server.codec import CODECS, DTYPES, Encoding, decode_batch, encode_batch
+from chain.chaser_server.server import MetricService
+
+HAS_ZSTD = importlib.util.find_spec("zstandard") is not None
+
+
+def make_batch(n: int = 50, dim: int = 3) -> metric_pb2.MetricBatch:
+    steps = np.arange(n, dtype=np.int64) * 2
+    values = np.sin(steps[:, None] / 10 + np.arange(dim)[None]).astype(np.float32)
+    values[3, 1] = np.nan
+    return metric_pb2.MetricBatch(
+        experiment_id="1",
+        run_uuid="run",
+        key="acts",
+        dim=dim,
+        count=n,
+        values=values.tobytes(),
+        steps=steps.tobytes(),
+        timestamps=(1.7e9 + steps * 0.5).tobytes(),
+    )
+
+
+@pytest.mark.parametrize(("dtype", "delta", "codec"), list(itertools.product(DTYPES, (False, True), CODECS)))
+def test_round_trip(dtype: str, delta: bool, codec: str) -> None:
+    if codec == "zstd" and not HAS_ZSTD:
+        pytest.skip("zstandard is not installed")
+    original = make_batch()
+    batch = decode_batch(encode_batch(make_batch(), Encoding(dtype, delta, codec)))
+    assert batch.steps == original.steps and batch.timestamps == original.timestamps
+    assert not batch.delta and batch.codec == "" and batch.encoding == DTYPES[dtype]
+    values, expected = np.frombuffer(batch.values, np.float32), np.frombuffer(original.values, np.float32)
+    # float16 / bfloat16 は丸めた分だけずれる（NaN は NaN のまま）
+    rtol = {"float32": 0, "float16": 1e-3, "bfloat16": 1e-2}[dtype]
+    np.testing.assert_allclose(values, expected, rtol=rtol, atol=rtol)
+
+
+def test_steps_only_columns_round_trip() -> None:
+    batch = make_batch()
+    batch.timestamps = b""
+    batch = decode_batch(encode_batch(batch, Encoding("float16", True, "zlib")))
+    assert batch.timestamps == b"" and batch.steps == make_batch().steps
+
+
+@pytest.mark.parametrize(
+    "spec",
+    [{"dtype": "int8"}, {"codec": "lz4"}, {"level": 3}],
+)
+def test_parse_rejects_invalid_spec(spec: dict[str, Any]) -> None:
+    with pytest.raises(ValueError):
+        Encoding.parse(spec)
+
+
+def test_parse() -> None:
+    assert Encoding.parse({"dtype": "bfloat16", "delta": True}) == Encoding("bfloat16", True, "")
+
+
+@pytest.mark.parametrize(
+    "fields",
+    [
+        {"encoding": "f8"},
+        {"codec": "lz4"},
+        {"codec": "zlib", "values": b"not zlib"},
+        {"delta": True, "values": b"\0" * 7},
+    ],
+)
+def test_decode_rejects_invalid_batch(fields: dict[str, Any]) -> None:
+    batch = make_batch()
+    for name, value in fields.items():
+        setattr(batch, name, value)
+    with pytest.raises(ValueError):
+        decode_batch(batch)
+
+
+def test_invalid_batch_gets_error_ack(tmp_path: Path) -> None:
+    service = MetricService()
+    service.handles.data_dir = tmp_path
+    broken = make_batch()
+    broken.codec = "zlib"
+    truncated = make_batch()
+    truncated.values = truncated.values[:-4]
+
+    async def requests() -> AsyncIterator[metric_pb2.MetricBatch]:
+        for seq, batch in enumerate([broken, truncated, make_batch()], 1):
+            batch.seq = seq
+            yield batch
+
+    async def stream() -> list[metric_pb2.MetricAck]:
+        return [ack async for ack in service.StreamBatches(requests(), None)]
+
+    acks = {ack.seq: ack for ack in asyncio.run(stream())}
+    assert acks[1].status == "error" and "encoding" in acks[1].message
+    assert acks[2].status == "error" and "size" in acks[2].message
+    assert acks[3].status == "ok"
+    (info,) = service.handles.close_run("1", "run")
+    assert info.n_rows == 50
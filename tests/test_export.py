@@ -0,0 +1,108 @@
+import importlib
+import io
+from pathlib import Path
+from types import ModuleType
+from typing import Any
+
+import numpy as np
+import pytest
+
+from chain.chaser_server.metric_file import MetricWriter, row_dtype
+
+Written = dict[tuple[str, str], np.ndarray]  # (run, metric) ごとに書いた行
+Expected = list[tuple[str, str, np.ndarray, np.ndarray]]  # (run, metric, step と time, value)
+
+
+def write_metric(path: Path, steps: np.ndarray, dim: int, seed: int = 0) -> np.ndarray:
+    rows = np.empty(len(steps), dtype=row_dtype("<f4", dim))
+    rows["step"] = steps
+    rows["time"] = 1.7e9 + steps / 10
+    rows["value"] = np.random.default_rng(seed).normal(size=(len(steps), dim))
+    rows["value"][3, 0] = np.nan
+    path.parent.mkdir(parents=True, exist_ok=True)
+    writer = MetricWriter(path, dim)
+    writer.append(rows, unsorted=bool((np.diff(steps) < 0).any()))
+    writer.close()
+    return rows
+
+
+@pytest.fixture
+def export(chaser_engine: ModuleType) -> tuple[ModuleType, Written]:
+    """2 run × 2 metric を書いた DATA_DIR と export モジュール。run b の loss は step 順でない"""
+    steps = np.arange(0, 3000, 3)
+    written = {
+        ("a", "loss"): write_metric(chaser_engine.DATA_DIR / "1" / "a" / "loss.chm", steps, 3),
+        ("a", "acc"): write_metric(chaser_engine.DATA_DIR / "1" / "a" / "acc.chm", steps[:500], 3, seed=1),
+        ("b", "loss"): write_metric(chaser_engine.DATA_DIR / "1" / "b" / "loss.chm", steps[::-1], 3, seed=2),
+    }
+    return importlib.import_module("chain.server.docker.chaser.app.src.export"), written
+
+
+def expected_rows(
+    written: Written,
+    parts: list[tuple[str, str]],
+    step_range: tuple[int, int],
+    dims: list[int],
+) -> Expected:
+    """(run, metric, step 順に並べて範囲で切った行) を書き出す順に"""
+    out: Expected = []
+    for run_id, metric in parts:
+        rows = np.sort(written[run_id, metric], order="step")
+        rows = rows[(rows["step"] >= step_range[0]) & (rows["step"] <= step_range[1])]
+        out.append((run_id, metric, rows[["step", "time"]], rows["value"][:, dims]))
+    return out
+
+
+def assert_table(columns: dict[str, Any], expected: Expected) -> None:
+    runs = [r for run_id, _, rows, _ in expected for r in [run_id] * len(rows)]
+    metrics = [m for _, metric, rows, _ in expected for m in [metric] * len(rows)]
+    assert columns["run"] == runs and columns["metric"] == metrics
+    np.testing.assert_array_equal(columns["step"], np.concatenate([rows["step"] for _, _, rows, _ in expected]))
+    np.testing.assert_array_equal(columns["time"], np.concatenate([rows["time"] for _, _, rows, _ in expected]))
+    np.testing.assert_array_equal(
+        np.asarray(columns["value"], np.float32), np.concatenate([values for *_, values in expected])
+    )
+
+
+def plan(export: ModuleType, dims: list[int]) -> list[Any]:
+    parts: list[Any] = export.plan_export(
+        1, ["a", "b", "missing"], ["loss", "acc"], step_min=100, step_max=2500, dims=dims
+    )
+    return parts
+
+
+@pytest.mark.parametrize("fmt", ["npy", "arrow", "parquet"])
+def test_round_trip(export: tuple[ModuleType, Written], fmt: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    module, written = export
+    if fmt != "npy":
+        pytest.importorskip("pyarrow")
+    monkeypatch.setattr(module, "EXPORT_ROWS", 100)  # 複数のチャンク・row group に分かれるように
+    parts = plan(module, [2, 0])
+    assert [(p.run_id, p.metric) for p in parts] == [("a", "loss"), ("a", "acc"), ("b", "loss")]
+    expected = expected_rows(written, [("a", "loss"), ("a", "acc"), ("b", "loss")], (100, 2500), [2, 0])
+    data = b"".join(module.export_stream(parts, fmt))
+    if fmt == "npy":
+        table = np.load(io.BytesIO(data))
+        columns = {name: table[name] for name in ("step", "time", "value")}
+        columns["run"] = [r.decode() for r in table["run"]]
+        columns["metric"] = [m.decode() for m in table["metric"]]
+    else:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.ipc.open_stream(data).read_all() if fmt == "arrow" else pq.read_table(io.BytesIO(data))
+        columns = {name: table[name].to_pylist() for name in table.column_names}
+        if fmt == "parquet":
+            assert pq.ParquetFile(io.BytesIO(data)).num_row_groups > 1
+    assert_table(columns, expected)
+
+
+def test_rejects_invalid_requests(export: tuple[ModuleType, Written]) -> None:
+    module, _ = export
+    parts = [*plan(module, [0]), *module.plan_export(1, ["a"], ["acc"], dims=slice(0, 2))]
+    with pytest.raises(ValueError):
+        module.export_stream(parts, "npy")
+    with pytest.raises(ValueError):
+        module.plan_export(1, ["a"], ["loss"], dims=[3])
+    with pytest.raises(ValueError):
+        module.export_stream(parts, "csv")
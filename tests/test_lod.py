@@ -0,0 +1,127 @@
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from chain.chaser_server.lod import LOD_FACTOR, LOD_LEVELS, LodPyramid, expand, lod_path, summarize
+from chain.chaser_server.metric_file import MetricFile, MetricWriter, row_dtype
+
+
+def make_rows(start: int, n: int, dim: int = 2, seed: int = 0) -> np.ndarray:
+    rows = np.empty(n, dtype=row_dtype("<f4", dim))
+    rows["step"] = np.arange(start, start + n) * 3
+    rows["time"] = 1.7e9 + rows["step"] / 10
+    rows["value"] = np.random.default_rng(seed + start).normal(size=(n, dim))
+    return rows
+
+
+def brute_force(rows: np.ndarray, level: int) -> dict[str, np.ndarray]:
+    """level の行を生データから直接求める（LOD_FACTOR**level 行ずつ、端数は捨てる）"""
+    width = LOD_FACTOR**level
+    n = len(rows) // width * width
+    values = rows["value"][:n].astype(np.float64).reshape((n // width, width, rows["value"].shape[1]))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # まるごと NaN の区間は NaN
+        return {
+            "step": rows["step"][:n:width],
+            "time": rows["time"][width - 1 : n : width],
+            "min": np.nanmin(values, axis=1),
+            "max": np.nanmax(values, axis=1),
+            "mean": np.nanmean(values, axis=1),
+        }
+
+
+def read_level(path: Path, level: int, dim: int) -> dict[str, np.ndarray]:
+    rows = np.asarray(MetricFile(lod_path(path, level)).rows())
+    values = rows["value"].reshape((len(rows), 3, dim))
+    return {"step": rows["step"], "time": rows["time"], "min": values[:, 0], "max": values[:, 1], "mean": values[:, 2]}
+
+
+def build(path: Path, rows: np.ndarray, sizes: list[int]) -> None:
+    """生データと LOD ピラミッドを sizes 行ずつ追記して作る（MetricHandle と同じ順）"""
+    writer = MetricWriter(path, rows["value"].shape[1])
+    pyramid = LodPyramid(writer)
+    pos = 0
+    for size in sizes:
+        writer.append(rows[pos : pos + size])
+        pyramid.append(rows[pos : pos + size])
+        pos += size
+    pyramid.close()
+    writer.close()
+
+
+def assert_matches(path: Path, rows: np.ndarray, dim: int) -> None:
+    for level in range(1, LOD_LEVELS + 1):
+        expected = brute_force(rows, level)
+        if not len(expected["step"]):
+            assert not lod_path(path, level).exists() or MetricFile(lod_path(path, level)).n_rows == 0
+            continue
+        actual = read_level(path, level, dim)
+        np.testing.assert_array_equal(actual["step"], expected["step"])
+        np.testing.assert_array_equal(actual["time"], expected["time"])
+        np.testing.assert_array_equal(actual["min"], expected["min"].astype(np.float32))
+        np.testing.assert_array_equal(actual["max"], expected["max"].astype(np.float32))
+        # 上の level の mean は下の level の mean の平均（float32 で丸めた分だけずれる）
+        np.testing.assert_allclose(actual["mean"], expected["mean"], rtol=1e-5, atol=1e-6)
+
+
+def test_summarize_matches_brute_force_with_nan() -> None:
+    rows = make_rows(0, LOD_FACTOR * 20)
+    rows["value"][3, 0] = np.nan
+    rows["value"][LOD_FACTOR : 2 * LOD_FACTOR, 1] = np.nan  # まるごと NaN の区間
+    out = summarize(expand(rows, 2), 2).copy()
+    values = out["value"].reshape((len(out), 3, 2))
+    expected = brute_force(rows, 1)
+    np.testing.assert_array_equal(out["step"], expected["step"])
+    np.testing.assert_array_equal(out["time"], expected["time"])
+    np.testing.assert_array_equal(values[:, 0], expected["min"].astype(np.float32))
+    np.testing.assert_array_equal(values[:, 1], expected["max"].astype(np.float32))
+    np.testing.assert_allclose(values[:, 2], expected["mean"], rtol=1e-5, atol=1e-6)
+    assert np.isnan(values[1, :, 1]).all()
+
+
+@pytest.mark.parametrize("sizes", [[1000], [1] * 100, [7, 1, 56, 9, 500, 3, 64, 512, 1]])
+def test_incremental_appends_with_partial_blocks(tmp_path: Path, sizes: list[int]) -> None:
+    path = tmp_path / "loss.chm"
+    rows = make_rows(0, sum(sizes))
+    build(path, rows, sizes)
+    assert_matches(path, rows, 2)
+
+
+@pytest.mark.parametrize("n", [LOD_FACTOR**LOD_LEVELS - 1, LOD_FACTOR**LOD_LEVELS, LOD_FACTOR**LOD_LEVELS + 5])
+def test_level_boundaries(tmp_path: Path, n: int) -> None:
+    path = tmp_path / "loss.chm"
+    rows = make_rows(0, n, dim=1)
+    build(path, rows, [n // 3, n - n // 3])
+    top = MetricFile(lod_path(path, LOD_LEVELS)).n_rows if lod_path(path, LOD_LEVELS).exists() else 0
+    assert top == n // LOD_FACTOR**LOD_LEVELS
+    assert MetricFile(lod_path(path, LOD_LEVELS - 1)).n_rows == n // LOD_FACTOR ** (LOD_LEVELS - 1)
+    assert not lod_path(path, LOD_LEVELS + 1).exists()
+    assert_matches(path, rows, 1)
+
+
+def test_reopen_restores_pending_rows(tmp_path: Path) -> None:
+    path = tmp_path / "loss.chm"
+    rows = make_rows(0, 3000)
+    build(path, rows[:1234], [1234])
+    writer = MetricWriter(path, 2)
+    pyramid = LodPyramid(writer)  # 端数は下の level の末尾から読み直す
+    writer.append(rows[1234:])
+    pyramid.append(rows[1234:])
+    pyramid.close()
+    writer.close()
+    assert_matches(path, rows, 2)
+
+
+def test_level_ahead_of_source_is_rebuilt(tmp_path: Path) -> None:
+    path = tmp_path / "loss.chm"
+    rows = make_rows(0, 600)
+    build(path, rows, [600])
+    stale = MetricWriter(lod_path(path, 1), 6)  # 生データより先に進んだ level 1（壊れたファイルの名残）
+    stale.append(expand(make_rows(600, LOD_FACTOR * 10), 2)[::LOD_FACTOR])
+    stale.close()
+    writer = MetricWriter(path, 2)
+    LodPyramid(writer).close()
+    writer.close()
+    assert_matches(path, rows, 2)
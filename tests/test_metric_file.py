@@ -0,0 +1,139 @@
+import os
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from chain.chaser_server.metric_file import (
+    CHUNK,
+    FLAG_UNSORTED,
+    FOOTER,
+    HEADER_SIZE,
+    Header,
+    MetricFile,
+    MetricWriter,
+    row_dtype,
+)
+
+
+def make_rows(start: int, n: int, dim: int = 3) -> np.ndarray:
+    rows = np.empty(n, dtype=row_dtype("<f4", dim))
+    rows["step"] = np.arange(start, start + n)
+    rows["time"] = 1.7e9 + rows["step"]
+    rows["value"] = rows["step"][:, None] + np.arange(dim)[None] / 10
+    return rows
+
+
+def write(path: Path, *parts: np.ndarray, close: bool = True, chunk_bytes: int = 4096) -> MetricWriter:
+    writer = MetricWriter(path, parts[0]["value"].shape[1], chunk_bytes=chunk_bytes)
+    for rows in parts:
+        writer.append(rows)
+    if close:
+        writer.close()
+    return writer
+
+
+def test_header_round_trip() -> None:
+    header = Header.create(5, "<f2")._replace(n_rows=10, footer_offset=1234, flags=FLAG_UNSORTED)
+    data = header.pack()
+    assert len(data) == HEADER_SIZE
+    assert Header.unpack(data) == header
+    assert Header.unpack(data).unsorted
+
+
+def test_header_rejects_foreign_and_truncated() -> None:
+    with pytest.raises(ValueError):
+        Header.unpack(b'{"n_rows": 1}'.ljust(HEADER_SIZE, b"\0"))
+    with pytest.raises(ValueError):
+        Header.unpack(Header.create(1).pack()[:10])
+
+
+def test_round_trip_with_footer(tmp_path: Path) -> None:
+    path = tmp_path / "loss.chm"
+    rows = make_rows(0, 1000)
+    write(path, rows[:300], rows[300:])
+    file = MetricFile(path)
+    assert file.n_rows == 1000 and not file.torn and not file.unsorted
+    np.testing.assert_array_equal(np.asarray(file.rows()), rows)
+    assert file.index is not None
+    assert sum(chunk.n_rows for chunk in file.index) == 1000
+    assert file.index[0].step_min == 0 and file.index[-1].step_max == 999
+    assert file.verify() == []
+
+
+def test_float16_storage(tmp_path: Path) -> None:
+    path = tmp_path / "acts.chm"
+    rows = make_rows(0, 100)
+    writer = MetricWriter(path, 3, "<f2")
+    writer.append(rows)
+    writer.close()
+    file = MetricFile(path)
+    assert file.header.dtype == "<f2"
+    np.testing.assert_array_equal(file.rows()["value"], rows["value"].astype(np.float16))
+
+
+def test_crc_detects_corruption(tmp_path: Path) -> None:
+    path = tmp_path / "loss.chm"
+    write(path, make_rows(0, 1000))
+    with open(path, "r+b") as f:
+        f.seek(HEADER_SIZE + 20)
+        byte = f.read(1)
+        f.seek(HEADER_SIZE + 20)
+        f.write(bytes([byte[0] ^ 0xFF]))
+    assert MetricFile(path).verify() == [0]
+
+
+def test_unsorted_flag(tmp_path: Path) -> None:
+    path = tmp_path / "loss.chm"
+    writer = write(path, make_rows(100, 10), close=False)
+    writer.append(make_rows(0, 10), unsorted=True)
+    writer.close()
+    assert MetricFile(path).unsorted
+
+
+def test_recover_without_footer(tmp_path: Path) -> None:
+    """close されずに落ちたファイル（footer なし）は索引を作り直して追記を続けられる"""
+    path = tmp_path / "loss.chm"
+    rows = make_rows(0, 500)
+    writer = write(path, rows[:400], close=False)
+    os.close(writer.fd)
+    file = MetricFile(path)
+    assert file.footer is None and file.n_rows == 400
+    write(path, rows[400:])
+    file = MetricFile(path)
+    np.testing.assert_array_equal(np.asarray(file.rows()), rows)
+    assert file.index is not None and file.verify() == []
+
+
+def test_recover_torn_tail(tmp_path: Path) -> None:
+    """header の行数より短いファイルは読める行までを使い、書きかけの行は捨てて追記を再開する"""
+    path = tmp_path / "loss.chm"
+    rows = make_rows(0, 500)
+    writer = write(path, rows[:400], close=False)
+    os.close(writer.fd)
+    itemsize = rows.dtype.itemsize
+    os.truncate(path, HEADER_SIZE + 350 * itemsize + itemsize // 2)  # 351 行目の途中で切れた
+    file = MetricFile(path)
+    assert file.torn and file.n_rows == 350
+    np.testing.assert_array_equal(np.asarray(file.rows()), rows[:350])
+
+    write(path, rows[350:])
+    file = MetricFile(path)
+    assert not file.torn and file.n_rows == 500
+    np.testing.assert_array_equal(np.asarray(file.rows()), rows)
+    assert file.verify() == []
+
+
+def test_reopen_after_close_drops_footer(tmp_path: Path) -> None:
+    path = tmp_path / "loss.chm"
+    rows = make_rows(0, 600)
+    write(path, rows[:300])
+    writer = MetricWriter(path, 3)
+    assert writer.header.footer_offset == 0 and writer.last_step == 299
+    writer.append(rows[300:])
+    writer.close()
+    file = MetricFile(path)
+    np.testing.assert_array_equal(np.asarray(file.rows()), rows)
+    assert file.index is not None
+    assert file.size == file.header.footer_offset + FOOTER.size + len(file.index) * CHUNK.size
+    assert file.verify() == []
@@ -0,0 +1,77 @@
+import os
+from pathlib import Path
+
+import numpy as np
+
+from chain.chaser_server import metric_pb2
+from chain.chaser_server.metric_file import MetricFile
+from chain.chaser_server.writer import HandleCache
+from chain.core.spool import ChaserSpool, list_spools
+
+
+def make_batch(batch_id: int, n: int = 10) -> metric_pb2.MetricBatch:
+    steps = np.arange((batch_id - 1) * n, batch_id * n, dtype=np.int64)
+    return metric_pb2.MetricBatch(
+        experiment_id="1",
+        run_uuid="run",
+        key="loss",
+        dim=1,
+        count=n,
+        values=steps.astype(np.float32).tobytes(),
+        steps=steps.tobytes(),
+        writer="w",
+        batch_id=batch_id,
+    )
+
+
+def test_write_read_commit(tmp_path: Path) -> None:
+    spool = ChaserSpool.for_run("1", "run", tmp_path)
+    spool.write([make_batch(1), make_batch(2)])
+    spool.write([make_batch(3)])
+    records = list(spool.read())
+    assert [batch.batch_id for _, batch in records] == [1, 2, 3]
+    assert records[-1][0] == spool.path.stat().st_size
+
+    spool.commit(records[0][0])
+    reopened = ChaserSpool(spool.path)
+    assert reopened.active and reopened.offset == records[0][0]
+    assert [batch.batch_id for _, batch in reopened.read()] == [2, 3]
+    assert [s.path for s in list_spools(tmp_path)] == [spool.path]
+    assert reopened.owner_alive()  # このプロセスが書いた
+
+    reopened.commit(records[-1][0])
+    assert reopened.exhausted()
+    reopened.clear()
+    assert not spool.path.exists() and list_spools(tmp_path) == []
+
+
+def test_torn_record_is_ignored(tmp_path: Path) -> None:
+    spool = ChaserSpool.for_run("1", "run", tmp_path)
+    spool.write([make_batch(1), make_batch(2)])
+    os.truncate(spool.path, spool.path.stat().st_size - 5)
+    assert [batch.batch_id for _, batch in spool.read()] == [1]
+
+
+def test_rewrite_puts_unacked_batches_first(tmp_path: Path) -> None:
+    spool = ChaserSpool.for_run("1", "run", tmp_path)
+    spool.write([make_batch(2), make_batch(3), make_batch(4)])
+    spool.commit(next(spool.read())[0])  # 2 は再送済み
+    spool.rewrite([make_batch(1)])
+    assert spool.offset == 0
+    assert [batch.batch_id for _, batch in spool.read()] == [1, 3, 4]
+
+
+def test_replay_after_ack_timeout_is_not_duplicated(tmp_path: Path) -> None:
+    """書き込まれたが ACK が届かずスプールに退避したバッチを再送しても、行は増えない"""
+    spool = ChaserSpool.for_run("1", "run", tmp_path / "spool")
+    handles = HandleCache(tmp_path / "data")
+    name = ("1", "run", "loss")
+    handles.write({name: [make_batch(1), make_batch(2)]})
+    spool.write([make_batch(2), make_batch(3)])
+    for _, batch in spool.read():
+        handles.write({name: [batch]})
+    handles.write({name: [make_batch(3)]})  # 再接続時の再送
+    (info,) = handles.close_run(*name[:2])
+    assert info.n_rows == 30
+    assert info.stats is not None and info.stats["n_rows"] == 30
+    assert not MetricFile(tmp_path / "data/1/run/loss.chm").unsorted  # LOD も使える
@@ -0,0 +1,59 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from chain.core.chaser import ChaserActiveRun, MetricBuffer, to_vector, value_nbytes
+
+
+def test_ndarray_is_not_copied() -> None:
+    value = np.arange(6, dtype=np.float32).reshape(2, 3)
+    vector = to_vector(value)
+    assert vector.shape == (6,) and np.shares_memory(vector, value)
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        (1.5, [1.5]),
+        (3, [3]),
+        ([1.0, 2.0], [1.0, 2.0]),
+        (memoryview(np.arange(3, dtype=np.float64)), [0.0, 1.0, 2.0]),
+        (bytearray(b"\x01\x02"), [1, 2]),
+    ],
+)
+def test_values(value: object, expected: list[float]) -> None:
+    np.testing.assert_array_equal(to_vector(value), expected)
+
+
+def test_non_numeric_is_rejected() -> None:
+    with pytest.raises(TypeError):
+        to_vector(["a", "b"])
+
+
+def test_value_nbytes() -> None:
+    assert value_nbytes(np.zeros(4, np.float32)) == 16
+    assert value_nbytes(bytearray(10)) == 10
+    assert value_nbytes([1.0, 2.0]) == 16
+    assert value_nbytes(1.0) == 8
+
+
+def test_tensor_is_read_through_dlpack() -> None:
+    torch = pytest.importorskip("torch")
+    value = torch.arange(4, dtype=torch.float32, requires_grad=True) * 2
+    vector = to_vector(value)
+    np.testing.assert_array_equal(vector, [0, 2, 4, 6])
+    assert vector.ctypes.data == value.data_ptr()
+
+
+def test_logged_tensor_does_not_keep_its_graph() -> None:
+    torch = pytest.importorskip("torch")
+    run = ChaserActiveRun.__new__(ChaserActiveRun)
+    vars(run).update(run_uuid="run", sender=SimpleNamespace(buffer=MetricBuffer()))
+    x = torch.ones(1000, requires_grad=True)
+    loss = (x.exp() * x).sum()
+    run.log_metric("loss", loss)
+    ((_, sample),) = run.sender.buffer.items
+    # グラフへの参照を持たず、値は元のメモリのまま
+    assert sample.value.grad_fn is None and not sample.value.requires_grad
+    assert sample.value.data_ptr() == loss.data_ptr()
@@ -0,0 +1,106 @@
+from pathlib import Path
+from types import ModuleType
+from typing import Any
+
+import numpy as np
+import pytest
+
+from chain.chaser_server.metric_file import MetricWriter, row_dtype
+from chain.server.docker.chaser.app.src.transform import EMA_BLOCK, apply_transform
+
+TRANSFORMS = [("ema", 0.6), ("ema", 0.999), ("rolling_mean", 50.0), ("rolling_std", 7.0), ("cummax", None)]
+
+
+def make_values(n: int, dim: int = 2, seed: int = 0) -> np.ndarray:
+    values = np.random.default_rng(seed).normal(size=(n, dim)).cumsum(axis=0).astype(np.float32)
+    values[5:9, 0] = np.nan  # 欠測
+    values[n // 2 :: 97, 1] = np.nan
+    values[-3:, 1] = np.nan  # 末尾の欠測は次の追記に state で引き継ぐ
+    return values
+
+
+def ema_loop(x: np.ndarray, a: float) -> np.ndarray:
+    """定義どおりに1行ずつ計算した ema（NaN は直前の値を保ち、最初の値から始める）"""
+    out = np.full(x.shape, np.nan)
+    for d in range(x.shape[1]):
+        y = np.nan
+        for i, value in enumerate(x[:, d].astype(np.float64)):
+            if not np.isnan(value):
+                y = value if np.isnan(y) else a * y + (1 - a) * value
+            out[i, d] = y
+    return out
+
+
+def apply_in_parts(transform: tuple[str, float | None], x: np.ndarray, sizes: list[int]) -> np.ndarray:
+    out, state, pos = [], None, 0
+    for size in sizes:
+        part, state = apply_transform(transform, x[pos : pos + size], state)
+        out.append(part)
+        pos += size
+    return np.concatenate(out)
+
+
+@pytest.mark.parametrize("a", [0.0, 0.6, 0.999])
+def test_ema_matches_definition(a: float) -> None:
+    x = make_values(2 * EMA_BLOCK + 100)
+    out, _ = apply_transform(("ema", a), x)
+    np.testing.assert_allclose(out, ema_loop(x, a), rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize("transform", TRANSFORMS)
+@pytest.mark.parametrize("sizes", [[1] * 300, [7, 0, 1, 250, 3, EMA_BLOCK + 10, 2]])
+def test_incremental_equals_full_recompute(transform: tuple[str, float | None], sizes: list[int]) -> None:
+    x = make_values(sum(sizes))
+    full, _ = apply_transform(transform, x)
+    np.testing.assert_allclose(apply_in_parts(transform, x, sizes), full, rtol=1e-5, atol=1e-5)
+
+
+def test_leading_nan_is_kept_until_first_value() -> None:
+    x = np.array([[np.nan], [np.nan], [2.0], [np.nan], [4.0]], np.float32)
+    out = apply_in_parts(("ema", 0.5), x, [1, 1, 3])
+    np.testing.assert_array_equal(out[:, 0], [np.nan, np.nan, 2.0, 2.0, 3.0])
+
+
+def write_rows(path: Path, values: np.ndarray, start: int) -> None:
+    rows = np.empty(len(values), dtype=row_dtype("<f4", values.shape[1]))
+    rows["step"] = np.arange(start, start + len(values)) * 10
+    rows["time"] = 1.7e9 + rows["step"]
+    rows["value"] = values
+    writer = MetricWriter(path, values.shape[1])
+    writer.append(rows)
+    writer.close()
+
+
+def test_transform_cache_extends_with_appended_rows(chaser_engine: ModuleType, monkeypatch: pytest.MonkeyPatch) -> None:
+    engine = chaser_engine
+    path = engine.DATA_DIR / "1" / "run" / "loss.chm"
+    path.parent.mkdir(parents=True)
+    values = make_values(1000, dim=3)
+    transform = ("ema", 0.9)
+    transformed: list[int] = []
+
+    def counting(transform: tuple[str, float | None], x: np.ndarray, state: Any = None) -> Any:
+        transformed.append(len(x))
+        return apply_transform(transform, x, state)
+
+    monkeypatch.setattr(engine, "apply_transform", counting)
+    monkeypatch.setattr(engine, "TRANSFORM_ROWS", 256)
+
+    write_rows(path, values[:600], 0)
+    steps, out = engine.get_transformed(1, "run", "loss", 2, transform)
+    np.testing.assert_array_equal(steps, np.arange(600) * 10)
+    np.testing.assert_array_equal(out, apply_transform(transform, values[:600, :2])[0])
+    assert sum(transformed) == 600
+
+    # 同じサイズの間はキャッシュを返す
+    engine.get_transformed(1, "run", "loss", 2, transform)
+    assert sum(transformed) == 600
+
+    # 追記された行だけを変換して続ける
+    write_rows(path, values[600:], 600)
+    steps, out = engine.get_transformed(1, "run", "loss", 2, transform)
+    assert sum(transformed) == 1000
+    np.testing.assert_array_equal(steps, np.arange(1000) * 10)
+    np.testing.assert_allclose(out, apply_transform(transform, values[:, :2])[0], rtol=1e-6, atol=1e-6)
+    (entry,) = engine.transform_cache.values()
+    assert entry["n_rows"] == 1000 and entry["size"] == path.stat().st_size
@@ -0,0 +1,107 @@
+from typing import Any
+
+import numpy as np
+import pytest
+
+from chain.chaser_server import metric_pb2
+from chain.chaser_server.watch import Watcher, WatchRule, first_violation, parse_rules
+
+
+def make_batch(values: list[float] | np.ndarray, start: int = 0, key: str = "loss") -> metric_pb2.MetricBatch:
+    values = np.asarray(values, dtype=np.float32).reshape((len(values), -1))
+    return metric_pb2.MetricBatch(
+        experiment_id="1",
+        run_uuid="run",
+        key=key,
+        dim=values.shape[1],
+        count=len(values),
+        values=values.tobytes(),
+        steps=np.arange(start, start + len(values), dtype=np.int64).tobytes(),
+    )
+
+
+def check(rule: WatchRule, values: list[Any], steps: list[int] | None = None) -> int | None:
+    x = np.asarray(values, dtype=np.float32).reshape((len(values), -1))
+    return first_violation(rule, np.arange(len(x)) if steps is None else np.asarray(steps), x, {})
+
+
+@pytest.mark.parametrize(
+    ("rule", "values", "expected"),
+    [
+        (WatchRule("loss", "above", 10.0), [1, 5, 11, 20], 2),
+        (WatchRule("loss", "above", 10.0), [1, 5, 10], None),
+        (WatchRule("loss", "below", 0.0), [1, -1, 0], 1),
+        (WatchRule("loss", "above", 10.0, warmup=3), [20, 20, 20, 20], 3),
+        (WatchRule("loss", "nonfinite"), [1, np.inf, np.nan], 1),
+        (WatchRule("loss", "nonfinite"), [1, 2, 3], None),
+    ],
+)
+def test_threshold_and_nonfinite(rule: WatchRule, values: list[float], expected: int | None) -> None:
+    assert check(rule, values) == expected
+
+
+def test_dim_selects_a_column() -> None:
+    values = [[0, 0], [0, 20], [20, 0]]
+    assert check(WatchRule("acts", "above", 10.0), values) == 1
+    assert check(WatchRule("acts", "above", 10.0, dim=0), values) == 2
+    assert check(WatchRule("acts", "above", 10.0, dim=5), values) is None
+
+
+def test_plateau_counts_steps_since_last_improvement() -> None:
+    rule = WatchRule("loss", "plateau", threshold=0.1, patience=10)
+    steps = [0, 5, 10, 15, 20, 25]
+    # step 5 の改善は min_delta 未満なので、step 0 から 10 step を超えた step 15 で掛かる
+    assert check(rule, [1.0, 0.95, 0.93, 0.92, 0.5, 0.4], steps) == 3
+    assert check(rule, [1.0, 0.8, 0.6, 0.4, 0.2, 0.0], steps) is None
+    # NaN は改善にならない
+    assert check(rule, [1.0, np.nan, np.nan, np.nan, np.nan, np.nan], steps) == 3
+    assert check(rule._replace(mode="max"), [0.0, 0.2, 0.4, 0.45, 0.5, 0.52], steps) == 5
+
+
+def test_plateau_state_carries_over_batches() -> None:
+    watcher = Watcher([WatchRule("loss", "plateau", patience=100)])
+    name = ("1", "run", "loss")
+    assert watcher.check({name: [make_batch(np.linspace(1, 0, 50))]}) == {}
+    assert watcher.check({name: [make_batch(np.ones(100), start=50)]}) == {}
+    (verdict,) = watcher.check({name: [make_batch(np.ones(10), start=150)]}).values()
+    assert verdict["step"] == 150 and verdict["rule"]["kind"] == "plateau"
+
+
+def test_watcher_keeps_the_first_verdict_per_run() -> None:
+    watcher = Watcher([WatchRule("*", "nonfinite")])
+    watcher.set_rules("1", "run", [WatchRule("loss", "above", 10.0)])
+    verdicts = watcher.check({("1", "run", "loss"): [make_batch([1, 20, np.nan])]})
+    assert verdicts[("1", "run")]["reason"] == "loss: non-finite value at step 2"
+    watcher.check({("1", "run", "acc"): [make_batch([np.nan], key="acc")]})
+    assert watcher.verdict("1", "run") == verdicts[("1", "run")]
+    watcher.close_run("1", "run")
+    assert watcher.verdict("1", "run") is None and not watcher.states
+
+
+def test_parse_rules() -> None:
+    specs: list[dict[str, Any]] = [
+        {"key": "loss", "kind": "plateau", "patience": "1000", "threshold": 1},
+        {"key": "*", "kind": "nonfinite"},
+    ]
+    assert parse_rules(specs) == [WatchRule("loss", "plateau", 1.0, 1000), WatchRule("*", "nonfinite")]
+    assert parse_rules('[{"key": "acc", "kind": "below", "dim": 1}]') == [WatchRule("acc", "below", dim=1)]
+    assert parse_rules(None) == [] and parse_rules("") == []
+
+
+@pytest.mark.parametrize(
+    "specs",
+    [
+        '{"key": "loss", "kind": "nonfinite"}',
+        "[{key: loss}]",
+        ["loss"],
+        [["loss", "nonfinite"]],
+        [{"key": "loss", "kind": "nan"}],
+        [{"key": "loss", "kind": "plateau"}],
+        [{"key": "loss", "kind": "above", "threshold": "high"}],
+        [{"key": "loss", "kind": "above", "mode": "median"}],
+        [{"key": "loss", "kind": "above", "limit": 1}],
+    ],
+)
+def test_parse_rules_rejects_invalid_specs(specs: Any) -> None:
+    with pytest.raises(ValueError):
+        parse_rules(specs)
@@ -0,0 +1,75 @@
+from pathlib import Path
+
+import numpy as np
+
+from chain.chaser_server import metric_pb2
+from chain.chaser_server.metric_file import MetricFile
+from chain.chaser_server.writer import HandleCache
+
+
+def make_batch(run: str, start: int, n: int = 100, writer: str = "", batch_id: int = 0) -> metric_pb2.MetricBatch:
+    steps = np.arange(start, start + n, dtype=np.int64)
+    return metric_pb2.MetricBatch(
+        experiment_id="1",
+        run_uuid=run,
+        key="loss",
+        dim=1,
+        count=n,
+        values=steps.astype(np.float32).tobytes(),
+        steps=steps.tobytes(),
+        writer=writer,
+        batch_id=batch_id,
+    )
+
+
+def test_resent_batches_are_written_once(tmp_path: Path) -> None:
+    handles = HandleCache(tmp_path)
+    name = ("1", "run", "loss")
+    handles.write({name: [make_batch("run", 0, writer="w", batch_id=1)]})
+    handles.write({name: [make_batch("run", 100, writer="w", batch_id=2)]})
+    handles.write(
+        {name: [make_batch("run", 100, writer="w", batch_id=2), make_batch("run", 200, writer="w", batch_id=3)]}
+    )
+    handles.write({name: [make_batch("run", 200, writer="w", batch_id=3)]})
+    (info,) = handles.close_run("1", "run")
+    assert info.n_rows == 300 and info.stats is not None and info.stats["n_rows"] == 300
+    file = MetricFile(tmp_path / "1/run/loss.chm")
+    assert not file.unsorted
+    np.testing.assert_array_equal(file.rows()["step"], np.arange(300))
+
+    # 閉じた後のスプールの再送も捨てる。別の writer や writer のないバッチは書く
+    _, written, errors = handles.write(
+        {name: [make_batch("run", 200, writer="w", batch_id=3), make_batch("run", 300, writer="w2", batch_id=1)]}
+    )
+    assert errors == {} and [batch.writer for batch in written[name]] == ["w2"]
+    handles.write({name: [make_batch("run", 400), make_batch("run", 500)]})
+    assert handles.close_run("1", "run")[0].n_rows == 600
+
+
+def test_broken_file_fails_only_its_group(tmp_path: Path) -> None:
+    (tmp_path / "1/bad").mkdir(parents=True)
+    (tmp_path / "1/bad/loss.chm").write_bytes(b"not a metric file")
+    handles = HandleCache(tmp_path)
+    good, bad = ("1", "good", "loss"), ("1", "bad", "loss")
+    infos, _, errors = handles.write({good: [make_batch("good", 0)], bad: [make_batch("bad", 0)]})
+    assert [info.run_uuid for info in infos] == ["good"]
+    assert list(errors) == [bad] and isinstance(errors[bad], ValueError)
+    infos, _, errors = handles.write({good: [make_batch("good", 100)]})
+    assert errors == {} and infos[0].n_rows == 200
+
+
+def test_restore_runs_before_first_open(tmp_path: Path) -> None:
+    handles = HandleCache(tmp_path)
+    restored: list[Path] = []
+    handles.restore = restored.append
+    name = ("1", "run", "loss")
+    handles.write({name: [make_batch("run", 0)]})
+    handles.write({name: [make_batch("run", 100)]})
+    handles.close_run("1", "run")
+    handles.write({name: [make_batch("run", 200)]})
+    # 同じプロセスで開いたことのある run は戻さない。消したら (dirs から外れたら) また呼ぶ
+    assert restored == [tmp_path / "1/run"]
+    handles.close_run("1", "run")
+    handles.dirs.discard(tmp_path / "1/run")
+    handles.write({name: [make_batch("run", 300)]})
+    assert restored == [tmp_path / "1/run"] * 2